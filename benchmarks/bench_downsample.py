@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import argparse
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from time import perf_counter
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from dash_app.downsample import DOWNSAMPLERS, PG_EPOCH, binary_to_arrays, downsample
+
+
+def make_rowset(n_points):
+    start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    prices = np.cumsum(np.random.default_rng(0).choice([-1, 1], size=n_points))
+    return [(Decimal(int(p)), start + timedelta(seconds=i)) for i, p in enumerate(prices)]
+
+
+def to_columns(rowset):
+    # The same rows as the array queries send them: float8send and timestamptz_send columns
+    y, x = zip(*rowset)
+    created = np.array([ts.replace(tzinfo=None) for ts in x], dtype='datetime64[us]') - PG_EPOCH
+    return np.array(y, dtype='>f8').tobytes(), created.astype(np.int64).astype('>i8').tobytes()
+
+
+def build_full(rowset, budget, method):
+    # The path before downsampling: tuples straight into the figure
+    y, x = list(zip(*rowset))
+    return go.Figure(data=[go.Scatter(x=x, y=y, mode='lines')])
+
+
+def build_downsampled(columns, budget, method):
+    x, y = binary_to_arrays(*columns)
+    x, y = downsample(x, y, budget, method)
+    return go.Figure(data=[go.Scatter(x=x, y=y, mode='lines')])
+
+
+def measure(build, rows, budget, method, repeat):
+    timings = []
+    payload = None
+    for _ in range(repeat):
+        t1 = perf_counter()
+        payload = pio.to_json(build(rows, budget, method), validate=False)
+        timings.append(perf_counter() - t1)
+    return min(timings), len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency and payload of range figures with downsampling')
+    parser.add_argument('--points', type=int, nargs='+', default=(3_600, 86_400, 604_800))
+    parser.add_argument('--budget', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{"points":>8} {"path":8} {"ms":>9} {"payload KB":>11}')
+    for n_points in args.points:
+        rowset = make_rowset(n_points)
+        columns = to_columns(rowset)
+        cases = [('full', build_full, None, rowset)]
+        cases.extend((m, build_downsampled, m, columns) for m in sorted(DOWNSAMPLERS))
+        for name, build, method, rows in cases:
+            seconds, size = measure(build, rows, args.budget, method, args.repeat)
+            print(f'{n_points:>8} {name:8} {seconds * 1000:>9.1f} {size / 1024:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import argparse
+from time import process_time
+
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+from dash_app.app import App
+
+
+def make_series(n_points):
+    x = np.datetime64('2022-01-01T00:00:00', 'us') + np.arange(n_points) * np.timedelta64(1, 's')
+    y = np.cumsum(np.random.default_rng(0).choice([-1.0, 1.0], size=n_points))
+    return x, y
+
+
+def full_update(x, y, row_limit, new_rows):
+    # The stream callback output before extendData: the whole window as a new figure
+    x, y = x[-row_limit:], y[-row_limit:]
+    return [App.build_figure(x, y, [x[0], x[-1]], [y.min(), y.max()]), None]
+
+
+def extend_update(x, y, row_limit, new_rows):
+    return [App.build_extend_data(x[-new_rows:], y[-new_rows:], row_limit), {'ticker': 'ticker_0', 'last': str(x[-1])}]
+
+
+def measure(build, x, y, row_limit, new_rows, repeat):
+    t1 = process_time()
+    for _ in range(repeat):
+        payload = to_json_plotly({'multi': True, 'response': build(x, y, row_limit, new_rows)})
+    return (process_time() - t1) / repeat, len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes and server CPU per stream update')
+    parser.add_argument('--row-limit', type=int, nargs='+', default=(180, 1800, 18000))
+    parser.add_argument('--new-rows', type=int, default=1, help='Rows appended between two updates')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f'{"row_limit":>9} {"mode":7} {"bytes":>9} {"cpu ms":>8}')
+    for row_limit in args.row_limit:
+        x, y = make_series(row_limit + args.new_rows)
+        for mode, build in (('figure', full_update), ('extend', extend_update)):
+            cpu, size = measure(build, x, y, row_limit, args.new_rows, args.repeat)
+            print(f'{row_limit:>9} {mode:7} {size:>9,} {cpu * 1000:>8.3f}')
+
+
+if __name__ == '__main__':
+    main()
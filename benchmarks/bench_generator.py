@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import argparse
+from datetime import timedelta
+from time import perf_counter
+
+import numpy as np
+
+from data_source.generator import GENERATORS, create_generator, to_records
+from utils.helpers import utc_now
+
+DEFAULT_TICKERS = (100, 10_000, 100_000)
+
+
+def bench_live(kind, n_tickers, steps):
+    generator = create_generator(kind, n_tickers, seed=0)
+    ticker_ids = np.arange(n_tickers, dtype=np.int32)
+    t1 = perf_counter()
+    for _ in range(steps):
+        block = generator.advance()
+        to_records(ticker_ids, (utc_now(),), block)
+    return steps * n_tickers / (perf_counter() - t1)
+
+
+def bench_backfill(kind, n_tickers, seconds, block_rows, records=True):
+    generator = create_generator(kind, n_tickers, seed=0)
+    ticker_ids = np.arange(n_tickers, dtype=np.int32)
+    start = utc_now()
+    timestamps = [start + timedelta(seconds=i) for i in range(seconds)]
+    chunk_size = max(1, block_rows // n_tickers)
+    t1 = perf_counter()
+    for i in range(0, seconds, chunk_size):
+        chunk = timestamps[i:i + chunk_size]
+        block = generator.advance(len(chunk))
+        if records:
+            to_records(ticker_ids, chunk, block)
+    return seconds * n_tickers / (perf_counter() - t1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rows/sec of the tick generators')
+    parser.add_argument('--tickers', type=int, nargs='+', default=DEFAULT_TICKERS)
+    parser.add_argument('--engines', nargs='+', default=sorted(GENERATORS), choices=sorted(GENERATORS))
+    parser.add_argument('--live-rows', type=int, default=1_000_000, help='Rows generated per live run')
+    parser.add_argument('--backfill-rows', type=int, default=3_000_000, help='Rows generated per backfill run')
+    parser.add_argument('--block-rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print(f'{"engine":8} {"tickers":>8} {"live rows/s":>14} {"backfill rows/s":>16} {"arrays rows/s":>16}')
+    for kind in args.engines:
+        for n_tickers in args.tickers:
+            live = bench_live(kind, n_tickers, max(1, args.live_rows // n_tickers))
+            backfill = bench_backfill(kind, n_tickers, max(1, args.backfill_rows // n_tickers), args.block_rows)
+            arrays = bench_backfill(
+                kind, n_tickers, max(1, args.backfill_rows // n_tickers), args.block_rows, records=False,
+            )
+            print(f'{kind:8} {n_tickers:>8} {live:>14,.0f} {backfill:>16,.0f} {arrays:>16,.0f}')
+
+
+if __name__ == '__main__':
+    main()
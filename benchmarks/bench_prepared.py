@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import argparse
+import re
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+import numpy as np
+
+from dash_app.db import RAW_SOURCE, ROLLUPS, DataSource
+from utils.helpers import utc_now
+from utils.reader import read_config
+
+PLANNING_TIME = re.compile(r'Planning Time: ([\d.]+) ms')
+
+
+def literal_query(db, name, args):
+    # The previous way of building dashboard queries: values formatted into the SQL text
+    query = db.queries[name]
+    for i, arg in reversed(list(enumerate(args, start=1))):
+        value = f"'{arg:%Y-%m-%d %H:%M:%S.%f}'::timestamptz" if hasattr(arg, 'strftime') else str(arg)
+        query = query.replace(f'${i}', value)
+    return query
+
+
+def planning_time(db, query):
+    plan = db.select(f'explain (analyze, summary) {query}')
+    return float(PLANNING_TIME.search('\n'.join(row[0] for row in plan)).group(1))
+
+
+def bench_query(db, name, args, iterations):
+    literal = literal_query(db, name, args)
+    cases = {
+        'literal': lambda: db.select(literal),
+        'prepared': lambda: db.select_prepared(name, *args),
+    }
+    result = {}
+    for case, run in cases.items():
+        run()
+        timings = []
+        for _ in range(iterations):
+            t1 = perf_counter()
+            run()
+            timings.append(perf_counter() - t1)
+        result[case] = np.median(timings) * 1000
+
+    result['plan_literal'] = planning_time(db, literal)
+    placeholders = ', '.join(
+        f"'{arg:%Y-%m-%d %H:%M:%S.%f}'" if hasattr(arg, 'strftime') else str(arg) for arg in args
+    )
+    result['plan_prepared'] = planning_time(db, f'execute {name}({placeholders})')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Literal vs prepared dashboard queries')
+    parser.add_argument('-c', '--config', type=str, default='dash_config.yml', help='Configuration file')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--ticker-id', type=int, default=1)
+    parser.add_argument('--sessions', type=int, default=10, help='Open dashboards, each polling once per second')
+    args = parser.parse_args()
+
+    config = read_config(args.config)
+    db = DataSource(**config['db_config'])
+    row_limit = config.get('row_limit', 180)
+    x, _ = db.get_last_data(args.ticker_id, limit=1)
+    last = x[-1].astype(datetime).replace(tzinfo=timezone.utc)
+    # Newest partitions, where stream reads find their rows
+    start, end = db.partitions.windows(utc_now())[0]
+
+    cases = {
+        'get_last_data': (args.ticker_id, start, end, row_limit),
+        'get_update': (args.ticker_id, last - timedelta(seconds=2), row_limit),
+        # Range reads go through tiles, at the resolution of a 30 minute and a 6 hour window
+        f'get_tile_{RAW_SOURCE}': (args.ticker_id, last - timedelta(minutes=30), last),
+        f'get_tile_{ROLLUPS[-1][0]}': (args.ticker_id, last - timedelta(hours=6), last),
+        'get_date_range': (args.ticker_id, 24),
+    }
+
+    print(f'{"query":24} {"literal ms":>11} {"prepared ms":>12} {"plan lit ms":>12} {"plan prep ms":>13}')
+    for name, query_args in cases.items():
+        result = bench_query(db, name, query_args, args.iterations)
+        print(
+            f'{name:24} {result["literal"]:>11.3f} {result["prepared"]:>12.3f} '
+            f'{result["plan_literal"]:>12.3f} {result["plan_prepared"]:>13.3f}'
+        )
+        if name == 'get_last_data':
+            saving = result['literal'] - result['prepared']
+            print(f'{"":24} saving {saving:.3f} ms per stream callback, '
+                  f'{saving * args.sessions * 60:.1f} ms per minute for {args.sessions} sessions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+import numpy as np
+
+from data_source.db import DataBase
+from data_source.db.db import SAVE_MODES
+from data_source.generator import create_generator, to_records
+from utils.helpers import get_partition_info
+from utils.reader import read_config
+
+# Far in the past, so the benchmark never touches live partitions
+BENCH_START = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+async def bench_mode(db_config, save_mode, n_tickers, iterations, hour):
+    db = DataBase('save_tick benchmark', save_mode=save_mode, **db_config)
+    await db.create_conn_pool(max_size=1)
+    generator = create_generator('numpy', n_tickers, seed=0)
+    ticker_ids = np.arange(1, n_tickers + 1, dtype=np.int32)
+    start = BENCH_START + timedelta(hours=hour)
+    tab_name, ts_constraint_start, ts_constraint_end = get_partition_info(start)
+
+    timings = []
+    try:
+        for i in range(iterations):
+            ts = start + timedelta(seconds=i)
+            data = to_records(ticker_ids, (ts,), generator.advance())
+            t1 = perf_counter()
+            await db.save_tick(
+                data=data,
+                tab_name=tab_name,
+                ts_constraint_start=ts_constraint_start,
+                ts_constraint_end=ts_constraint_end,
+            )
+            timings.append(perf_counter() - t1)
+    finally:
+        await db.pool.execute(f'drop table if exists {tab_name}')
+        await db.pool_close()
+    return np.array(timings)
+
+
+async def run(config_file, tickers, iterations):
+    db_config = read_config(config_file)['db_config']
+    db_config.pop('db_pool_size', None)
+    db_config.pop('save_mode', None)
+
+    print(f'{"mode":8} {"tickers":>8} {"p50 ms":>8} {"p95 ms":>8} {"rows/s":>12}')
+    for hour, save_mode in enumerate(SAVE_MODES):
+        for n_tickers in tickers:
+            timings = await bench_mode(db_config, save_mode, n_tickers, iterations, hour)
+            p50, p95 = np.percentile(timings, [50, 95]) * 1000
+            rate = n_tickers * len(timings) / timings.sum()
+            print(f'{save_mode:8} {n_tickers:>8} {p50:>8.2f} {p95:>8.2f} {rate:>12,.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare save_tick write paths')
+    parser.add_argument('-c', '--config', type=str, default='ds_config.yml', help='Configuration file')
+    parser.add_argument('--tickers', type=int, nargs='+', default=(100, 10_000))
+    parser.add_argument('--iterations', type=int, default=60)
+    args = parser.parse_args()
+    asyncio.run(run(args.config, args.tickers, args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+import numpy as np
+
+from dash_app.db import RAW_SOURCE, DataSource
+from data_source.db import DataBase
+from data_source.generator import create_generator
+from utils.helpers import get_partition_info
+from utils.reader import read_config
+from utils.storage import LAYOUTS
+
+# Far in the past, so the benchmark never touches live partitions
+BENCH_START = datetime(2000, 1, 1, tzinfo=timezone.utc)
+DATA_SOURCE_PARAMS = ('schema', 'host', 'port', 'database', 'user', 'password')
+# Seconds written per save_tick call, like the historical backfill
+CHUNK_SECONDS = 60
+
+
+async def write_layout(db_config, layout, n_tickers, seconds, hour):
+    db = DataBase('storage benchmark', storage_layout=layout, **db_config)
+    await db.create_conn_pool(max_size=1)
+    generator = create_generator('numpy', n_tickers, seed=0)
+    ticker_ids = np.arange(1, n_tickers + 1, dtype=np.int32)
+    start = BENCH_START + timedelta(hours=hour)
+    tab_name, ts_constraint_start, ts_constraint_end = get_partition_info(
+        start,
+        db.partition_prefix,
+        db.partition_granularity,
+    )
+
+    elapsed = 0
+    try:
+        for offset in range(0, seconds, CHUNK_SECONDS):
+            timestamps = [start + timedelta(seconds=i) for i in range(offset, min(seconds, offset + CHUNK_SECONDS))]
+            data = db.to_records(ticker_ids, timestamps, generator.advance(len(timestamps)))
+            t1 = perf_counter()
+            await db.save_tick(
+                data=data,
+                tab_name=tab_name,
+                ts_constraint_start=ts_constraint_start,
+                ts_constraint_end=ts_constraint_end,
+            )
+            elapsed += perf_counter() - t1
+        await db.pool.execute(f'analyze {tab_name}')
+        size = await db.pool.fetchval('select pg_total_relation_size($1::regclass)', tab_name)
+    finally:
+        await db.pool_close()
+    return tab_name, start, elapsed, size
+
+
+def read_layout(params, layout, n_tickers, start, end, iterations):
+    db = DataSource(storage_layout=layout, **params)
+    ticker_ids = np.linspace(1, n_tickers, num=min(n_tickers, 10), dtype=np.int64).tolist()
+    timings = []
+    try:
+        for i in range(iterations + 1):
+            ticker_id = ticker_ids[i % len(ticker_ids)]
+            t1 = perf_counter()
+            db.get_tile(RAW_SOURCE, ticker_id, start, end)
+            if i:
+                # The first call also prepares the statement
+                timings.append(perf_counter() - t1)
+    finally:
+        db.pool.close()
+    return np.array(timings)
+
+
+async def run(config_file, layouts, n_tickers, seconds, iterations):
+    db_config = read_config(config_file)['db_config']
+    params = {key: db_config[key] for key in DATA_SOURCE_PARAMS}
+    for key in ('db_pool_size', 'storage_layout', 'notify_channel'):
+        db_config.pop(key, None)
+
+    print(f'{"layout":8} {"rows":>10} {"size MB":>9} {"B/row":>7} {"rows/s":>12} {"read p50 ms":>12} {"read p95 ms":>12}')
+    for hour, layout in enumerate(layouts):
+        tab_name, start, elapsed, size = await write_layout(db_config, layout, n_tickers, seconds, hour)
+        try:
+            timings = read_layout(params, layout, n_tickers, start, start + timedelta(seconds=seconds), iterations)
+        finally:
+            db = DataBase('storage benchmark', **db_config)
+            await db.create_conn_pool(max_size=1)
+            await db.pool.execute(f'drop table if exists {tab_name}')
+            await db.pool_close()
+
+        rows = n_tickers * seconds
+        p50, p95 = np.percentile(timings, [50, 95]) * 1000
+        print(
+            f'{layout:8} {rows:>10,} {size / 2 ** 20:>9.1f} {size / rows:>7.1f} '
+            f'{rows / elapsed:>12,.0f} {p50:>12.2f} {p95:>12.2f}'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare ticker log storage layouts')
+    parser.add_argument('-c', '--config', type=str, default='ds_config.yml', help='Configuration file')
+    parser.add_argument('--layouts', nargs='+', choices=LAYOUTS, default=LAYOUTS)
+    parser.add_argument('--tickers', type=int, default=1000)
+    parser.add_argument('--seconds', type=int, default=600, help='Seconds of data written per layout, up to an hour')
+    parser.add_argument('--iterations', type=int, default=50, help='Single ticker range reads per layout')
+    args = parser.parse_args()
+    asyncio.run(run(args.config, args.layouts, args.tickers, min(args.seconds, 3600), args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""Concurrent load on a running dashboard, with latency percentiles.
+
+    python benchmarks/load_dash.py --url http://localhost:8050 --sessions 50 --duration 60 \
+        --mix stream=90,zoom=5,pan=3,switch=2 -o load.json
+
+Every session behaves like a browser tab: it selects a ticker, then on every
+interval tick does one action picked by --mix and posts the same
+_dash-update-component requests the browser would:
+
+- stream: interval tick with the slider ON, update_graph_scatter and extend_graph
+- zoom: new x range of the current ticker with the slider OFF
+- pan: the last zoomed range moved by a part of its width
+- switch: another ticker, select_ticker and the first stream figure
+
+Callback payloads are built from /_dash-dependencies and tickers are read from
+/_dash-layout, so no database access is needed.
+"""
+import argparse
+import json
+import random
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from time import monotonic, perf_counter, sleep
+
+import numpy as np
+import requests
+
+from benchmarks.suite import callback_request
+from dash_app.app import (
+    CONTAINER_ID,
+    DROPDOWN_ID,
+    GRAPH_ID,
+    INTERVAL_ID,
+    PUSH_STORE_ID,
+    SLIDER_ID,
+    SLIDER_OFF,
+    SLIDER_ON,
+    STREAM_STATE_ID,
+)
+
+ACTIONS = ('stream', 'zoom', 'pan', 'switch')
+DEFAULT_MIX = 'stream=90,zoom=5,pan=3,switch=2'
+# Widths of zoomed windows, in seconds
+ZOOM_WIDTHS = (60, 600, 3600, 6 * 3600)
+REQUEST_TIMEOUT = 30
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(','):
+        action, _, weight = part.partition('=')
+        action = action.strip()
+        if action not in ACTIONS:
+            raise argparse.ArgumentTypeError(f'Unknown action {action!r}, expected one of {ACTIONS}')
+        try:
+            mix[action] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'Bad weight of {action}: {weight!r}')
+    if sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError('The mix needs a positive weight')
+    return mix
+
+
+def find_options(component, component_id):
+    if isinstance(component, list):
+        for child in component:
+            options = find_options(child, component_id)
+            if options is not None:
+                return options
+    elif isinstance(component, dict):
+        props = component.get('props', {})
+        if props.get('id') == component_id:
+            return [option['value'] if isinstance(option, dict) else option for option in props.get('options', [])]
+        return find_options(props.get('children'), component_id)
+    return None
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (action, callback) -> latencies of successful requests
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.bytes = defaultdict(int)
+        self.ticks = 0
+        self.late_ticks = 0
+        self.error_samples = []
+
+    def add(self, action, callback, elapsed, size, error=None):
+        with self.lock:
+            if error is None:
+                self.timings[action, callback].append(elapsed)
+                self.bytes[action, callback] += size
+            else:
+                self.errors[action, callback] += 1
+                if len(self.error_samples) < 10:
+                    self.error_samples.append(f'{action}/{callback}: {error}')
+
+    def tick(self, late):
+        with self.lock:
+            self.ticks += 1
+            self.late_ticks += late
+
+
+class Session(threading.Thread):
+    def __init__(self, number, args, dependencies, tickers, stats, start_at, stop):
+        super().__init__(name=f'session-{number}', daemon=True)
+        self.args = args
+        self.dependencies = dependencies
+        self.tickers = tickers
+        self.stats = stats
+        self.start_at = start_at
+        self.stop = stop
+        self.random = random.Random(args.seed + number)
+        self.http = requests.Session()
+        self.url = args.url.rstrip('/') + '/_dash-update-component'
+
+        self.ticker = None
+        self.n_intervals = 0
+        self.slider = SLIDER_ON
+        self.relayout = None
+        self.stream_state = None
+        self.zoom = None
+
+    def post(self, action, callback, values, changed):
+        body = callback_request(self.dependencies[callback], values, changed)
+        t1 = perf_counter()
+        try:
+            response = self.http.post(self.url, json=body, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            self.stats.add(action, callback, perf_counter() - t1, 0, type(e).__name__)
+            return None
+        elapsed = perf_counter() - t1
+        # 204 is a PreventUpdate, a normal answer
+        if response.status_code not in (200, 204):
+            self.stats.add(action, callback, elapsed, 0, f'HTTP {response.status_code}')
+            return None
+        self.stats.add(action, callback, elapsed, len(response.content))
+        return response.json()['response'] if response.status_code == 200 else {}
+
+    def values(self):
+        return {
+            f'{INTERVAL_ID}.n_intervals': self.n_intervals,
+            f'{DROPDOWN_ID}.value': self.ticker,
+            f'{GRAPH_ID}.relayoutData': self.relayout,
+            f'{SLIDER_ID}.value': self.slider,
+            f'{PUSH_STORE_ID}.data': None,
+            f'{STREAM_STATE_ID}.data': self.stream_state,
+        }
+
+    def update_state(self, response):
+        if response and STREAM_STATE_ID in response:
+            self.stream_state = response[STREAM_STATE_ID]['data']
+
+    def graph(self, action, changed):
+        self.update_state(self.post(action, 'figure', self.values(), changed))
+
+    def stream(self, action='stream'):
+        self.n_intervals += 1
+        self.slider, self.relayout, self.zoom = SLIDER_ON, None, None
+        # The interval is an input of both graph callbacks, the browser fires them together
+        self.graph(action, f'{INTERVAL_ID}.n_intervals')
+        self.update_state(self.post(action, 'extend', self.values(), f'{INTERVAL_ID}.n_intervals'))
+
+    def switch(self):
+        choices = [ticker for ticker in self.tickers if ticker != self.ticker] or self.tickers
+        self.ticker = self.random.choice(choices)
+        self.post('switch', 'select', self.values(), f'{DROPDOWN_ID}.value')
+        # A new graph component starts with empty state
+        self.stream_state = None
+        self.stream('switch')
+
+    def relayout_to(self, action, start, end):
+        self.zoom = (start, end)
+        self.slider = SLIDER_OFF
+        self.relayout = {
+            'xaxis.range[0]': f'{start:%Y-%m-%d %H:%M:%S.%f}',
+            'xaxis.range[1]': f'{end:%Y-%m-%d %H:%M:%S.%f}',
+        }
+        self.graph(action, f'{GRAPH_ID}.relayoutData')
+
+    def now(self):
+        if self.stream_state:
+            return datetime.fromisoformat(self.stream_state['last'][:26])
+        return datetime.utcnow()
+
+    def zoom_in(self):
+        width = timedelta(seconds=self.random.choice(ZOOM_WIDTHS))
+        end = self.now() - timedelta(seconds=self.random.uniform(0, self.args.history * 3600))
+        self.relayout_to('zoom', end - width, end)
+
+    def pan(self):
+        if self.zoom is None:
+            return self.zoom_in()
+        start, end = self.zoom
+        shift = (end - start) * self.random.uniform(-0.5, 0.5)
+        self.relayout_to('pan', start + shift, end + shift)
+
+    def run(self):
+        sleep(max(0.0, self.start_at - monotonic()))
+        if self.stop.is_set():
+            return
+        self.switch()
+        handlers = {'stream': self.stream, 'zoom': self.zoom_in, 'pan': self.pan, 'switch': self.switch}
+        actions, weights = zip(*self.args.mix.items())
+        next_tick = monotonic() + self.args.interval
+        while not self.stop.wait(max(0.0, next_tick - monotonic())):
+            handlers[self.random.choices(actions, weights)[0]]()
+            next_tick += self.args.interval
+            # Like dcc.Interval, ticks missed while a request was running are not replayed
+            late = monotonic() > next_tick
+            self.stats.tick(late)
+            if late:
+                next_tick = monotonic() + self.args.interval
+        self.http.close()
+
+
+def percentiles(timings) -> dict:
+    if not timings:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99]) * 1000
+    return {'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3), 'p99_ms': round(p99, 3)}
+
+
+def summarize(stats: Stats, elapsed: float) -> dict:
+    rows = {}
+    keys = sorted(set(stats.timings) | set(stats.errors))
+    groups = [(f'{action}/{callback}', [(action, callback)]) for action, callback in keys]
+    groups.append(('total', keys))
+    for name, group in groups:
+        timings = [t for key in group for t in stats.timings[key]]
+        errors = sum(stats.errors[key] for key in group)
+        requests_count = len(timings) + errors
+        rows[name] = {
+            'requests': requests_count,
+            'errors': errors,
+            'error_rate': round(errors / requests_count, 4) if requests_count else 0.0,
+            'rps': round(requests_count / elapsed, 2),
+            'kb': round(sum(stats.bytes[key] for key in group) / max(len(timings), 1) / 1024, 1),
+            **percentiles(timings),
+        }
+    return rows
+
+
+def print_report(rows, stats, elapsed):
+    print(
+        f'{"action/callback":22} {"requests":>9} {"rps":>8} {"errors":>7} {"err %":>6} '
+        f'{"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"KB":>7}'
+    )
+    for name, row in rows.items():
+        p50, p95, p99 = (
+            '-' if row[key] is None else f'{row[key]:.1f}'
+            for key in ('p50_ms', 'p95_ms', 'p99_ms')
+        )
+        print(
+            f'{name:22} {row["requests"]:>9,} {row["rps"]:>8.1f} {row["errors"]:>7,} '
+            f'{row["error_rate"] * 100:>6.2f} {p50:>9} {p95:>9} {p99:>9} {row["kb"]:>7.1f}'
+        )
+    late = stats.late_ticks / stats.ticks * 100 if stats.ticks else 0
+    print(f'{elapsed:.1f} sec, {stats.ticks:,} ticks, {late:.2f}% late')
+    for sample in stats.error_samples:
+        print(f'  error {sample}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay browser sessions against a running dashboard')
+    parser.add_argument('--url', type=str, default='http://localhost:8050', help='Dashboard address')
+    parser.add_argument('--sessions', type=int, default=10, help='Concurrent browser sessions')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds of load after the ramp-up')
+    parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which sessions are started')
+    parser.add_argument('--interval', type=float, default=1, help='Seconds between ticks of a session')
+    parser.add_argument(
+        '--mix',
+        type=parse_mix,
+        default=parse_mix(DEFAULT_MIX),
+        help=f'Weights of {", ".join(ACTIONS)} per tick, default {DEFAULT_MIX}',
+    )
+    parser.add_argument('--history', type=float, default=1, help='Hours back from the last tick zooms may end at')
+    parser.add_argument('--tickers', type=int, default=0, help='Use only the first N tickers, 0 for all')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', type=str, help='Also write the report as JSON')
+    args = parser.parse_args()
+
+    base = args.url.rstrip('/')
+    dependencies = {}
+    for dependency in requests.get(f'{base}/_dash-dependencies', timeout=REQUEST_TIMEOUT).json():
+        output = dependency['output']
+        if f'{GRAPH_ID}.figure' in output:
+            dependencies['figure'] = dependency
+        elif f'{GRAPH_ID}.extendData' in output:
+            dependencies['extend'] = dependency
+        elif f'{CONTAINER_ID}.children' in output:
+            dependencies['select'] = dependency
+    missing = {'figure', 'extend', 'select'} - set(dependencies)
+    if missing:
+        raise SystemExit(f'{base} has no {", ".join(sorted(missing))} callbacks')
+    tickers = find_options(requests.get(f'{base}/_dash-layout', timeout=REQUEST_TIMEOUT).json(), DROPDOWN_ID)
+    if not tickers:
+        raise SystemExit(f'No tickers in the {DROPDOWN_ID} options of {base}')
+    if args.tickers:
+        tickers = tickers[:args.tickers]
+
+    stats = Stats()
+    stop = threading.Event()
+    started = monotonic()
+    sessions = [
+        Session(i, args, dependencies, tickers, stats, started + args.ramp_up * i / args.sessions, stop)
+        for i in range(args.sessions)
+    ]
+    for session in sessions:
+        session.start()
+    try:
+        sleep(args.ramp_up + args.duration)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for session in sessions:
+        session.join(REQUEST_TIMEOUT)
+    elapsed = monotonic() - started
+
+    rows = summarize(stats, elapsed)
+    print_report(rows, stats, elapsed)
+    if args.output:
+        report = {
+            'meta': {
+                'url': base,
+                'sessions': args.sessions,
+                'duration': args.duration,
+                'ramp_up': args.ramp_up,
+                'interval': args.interval,
+                'mix': args.mix,
+                'tickers': len(tickers),
+                'elapsed': round(elapsed, 3),
+                'ticks': stats.ticks,
+                'late_ticks': stats.late_ticks,
+            },
+            'results': rows,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Report is written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""Ingest and dashboard read path benchmarks with a JSON report.
+
+    python benchmarks/suite.py run --tickers 100 1000 --hours 1 6 -o report.json
+    python benchmarks/suite.py compare before.json after.json
+
+`run` starts a throwaway Postgres with initdb/pg_ctl (found on PATH, with
+pg_config or with --pg-bin; Postgres refuses to run as root), or uses the
+server of --config, whose data_source schema is dropped. Every ticker count
+x history length combination starts from a freshly installed schema, and all
+data is generated with a fixed seed at BENCH_START, so runs on the same
+machine are comparable.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+import asyncpg
+import numpy as np
+
+from dash_app.app import (
+    COMPARE_DROPDOWN_ID,
+    COMPARE_GRAPH_ID,
+    COMPARE_INTERVAL_ID,
+    COMPARE_MODE_ID,
+    COMPARE_PRICE,
+    DROPDOWN_ID,
+    GRAPH_ID,
+    INTERVAL_ID,
+    SLIDER_ID,
+    SLIDER_OFF,
+    SLIDER_ON,
+    STREAM_STATE_ID,
+)
+from dash_app.app import App as DashApp
+from dash_app.db import RAW_SOURCE, ROLLUPS, DataSource
+from data_source.app import App as DataSourceApp
+from data_source.db import DataBase
+from data_source.generator import create_generator
+from utils.helpers import get_partition_info
+from utils.reader import read_config
+
+BENCH_START = datetime(2000, 1, 1, tzinfo=timezone.utc)
+INSTALL_SQL = os.path.join(os.path.dirname(__file__), '..', 'data_source', 'sql', 'install.sql')
+DATA_SOURCE_PARAMS = ('schema', 'host', 'port', 'database', 'user', 'password')
+DEFAULT_TICKERS = (100, 1000)
+DEFAULT_HOURS = (1, 6)
+# Tickers read at once by the *_many queries and the comparison view
+MANY_TICKERS = 10
+ROW_LIMIT = 180
+# Metrics where a bigger value is better, everything else is a duration
+HIGHER_IS_BETTER = ('rows_per_sec',)
+
+
+class DisposablePostgres:
+    """Postgres cluster in a temporary directory, removed on exit."""
+
+    def __init__(self, bin_dir=None, options=()):
+        self.bin_dir = bin_dir or self.find_bin_dir()
+        self.options = list(options)
+        self.directory = None
+        self.port = None
+
+    @staticmethod
+    def find_bin_dir():
+        pg_ctl = shutil.which('pg_ctl')
+        if pg_ctl:
+            return os.path.dirname(pg_ctl)
+        if shutil.which('pg_config'):
+            return subprocess.check_output(['pg_config', '--bindir'], text=True).strip()
+        raise RuntimeError('initdb/pg_ctl not found, use --pg-bin or --config')
+
+    def _run(self, command, *args):
+        subprocess.run(
+            [os.path.join(self.bin_dir, command), *args],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+
+    def __enter__(self) -> dict:
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            raise RuntimeError('Postgres can not run as root, start the suite as another user or use --config')
+        self.directory = tempfile.mkdtemp(prefix='dash_bench_')
+        data = os.path.join(self.directory, 'data')
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+
+        self._run('initdb', '-D', data, '-U', 'dash', '--auth=trust', '-E', 'utf8')
+        server_options = ' '.join([
+            f'-p {self.port}',
+            f'-k {self.directory}',
+            "-c listen_addresses='127.0.0.1'",
+            *self.options,
+        ])
+        try:
+            self._run('pg_ctl', '-D', data, '-w', '-l', os.path.join(self.directory, 'server.log'),
+                      '-o', server_options, 'start')
+            self._run('createdb', '-h', '127.0.0.1', '-p', str(self.port), '-U', 'dash', 'dash')
+        except Exception:
+            self.__exit__(*sys.exc_info())
+            raise
+        return {
+            'schema': 'data_source',
+            'host': '127.0.0.1',
+            'port': self.port,
+            'database': 'dash',
+            'user': 'dash',
+            'password': 'dash',
+        }
+
+    def __exit__(self, *exc_info):
+        try:
+            self._run('pg_ctl', '-D', os.path.join(self.directory, 'data'), '-m', 'immediate', 'stop')
+        except subprocess.CalledProcessError:
+            pass
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+@contextmanager
+def existing_postgres(config_file):
+    db_config = read_config(config_file)['db_config']
+    yield {key: db_config[key] for key in DATA_SOURCE_PARAMS}
+
+
+def percentiles(timings) -> dict:
+    p50, p95 = np.percentile(timings, [50, 95]) * 1000
+    return {'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3)}
+
+
+async def connect(params):
+    return await asyncpg.connect(
+        host=params['host'],
+        port=params['port'],
+        database=params['database'],
+        user=params['user'],
+        password=params['password'],
+    )
+
+
+async def reset_schema(params) -> str:
+    conn = await connect(params)
+    try:
+        await conn.execute(f'drop schema if exists {params["schema"]} cascade')
+        with open(INSTALL_SQL) as file:
+            await conn.execute(file.read())
+        return await conn.fetchval('show server_version')
+    finally:
+        await conn.close()
+
+
+def data_source_config(params, n_tickers) -> dict:
+    return {
+        'ticker_range': [0, n_tickers],
+        'db_config': dict(params, db_pool_size=10),
+        'insert_interval': 1,
+        'generate_historical_data': False,
+        'historical_timedelta': 0,
+        'generator_seed': 0,
+        # Benchmarks generate the same prices whatever a previous run saved
+        'resume_from_checkpoint': False,
+    }
+
+
+async def bench_sync_tickers(params, n_tickers) -> dict:
+    db = DataBase('benchmark', **params)
+    await db.create_conn_pool(max_size=1)
+    tickers = [f'ticker_{n}' for n in range(n_tickers)]
+    try:
+        t1 = perf_counter()
+        await db.sync_tickers(tickers)
+        t2 = perf_counter()
+        await db.sync_tickers(tickers)
+        t3 = perf_counter()
+    finally:
+        await db.pool_close()
+    return {
+        'sync_tickers.new.sec': round(t2 - t1, 4),
+        'sync_tickers.unchanged.sec': round(t3 - t2, 4),
+    }
+
+
+async def bench_backfill(params, n_tickers, hours) -> dict:
+    app = DataSourceApp(name='benchmark', **data_source_config(params, n_tickers))
+    await app.setup()
+    try:
+        t1 = perf_counter()
+        await app.insert_historical_data(BENCH_START, BENCH_START + timedelta(hours=hours))
+        elapsed = perf_counter() - t1
+        rows = app.writer.rows_written
+    finally:
+        await app.shutdown()
+    return {
+        'backfill.sec': round(elapsed, 3),
+        'backfill.rows_per_sec': round(rows / elapsed),
+    }
+
+
+async def bench_save_tick(params, n_tickers, iterations) -> dict:
+    # One step per call like the live loop, an hour before the history so reads are not affected
+    db = DataBase('benchmark', **params)
+    await db.create_conn_pool(max_size=1)
+    generator = create_generator('numpy', n_tickers, seed=0)
+    ticker_ids = np.arange(1, n_tickers + 1, dtype=np.int32)
+    start = BENCH_START - timedelta(hours=1)
+    tab_name, ts_constraint_start, ts_constraint_end = get_partition_info(
+        start,
+        db.partition_prefix,
+        db.partition_granularity,
+    )
+    timings = []
+    try:
+        for i in range(iterations + 1):
+            data = db.to_records(ticker_ids, (start + timedelta(seconds=i),), generator.advance())
+            t1 = perf_counter()
+            await db.save_tick(data, tab_name, ts_constraint_start, ts_constraint_end)
+            if i:
+                # The first call also creates the partition
+                timings.append(perf_counter() - t1)
+        await db.drop_partition(tab_name)
+    finally:
+        await db.pool_close()
+    timings = np.array(timings)
+    result = {f'save_tick.{key}': value for key, value in percentiles(timings).items()}
+    result['save_tick.rows_per_sec'] = round(n_tickers * len(timings) / timings.sum())
+    return result
+
+
+def time_calls(call, args_list) -> dict:
+    call(*args_list[0])
+    timings = []
+    for args in args_list:
+        t1 = perf_counter()
+        call(*args)
+        timings.append(perf_counter() - t1)
+    return percentiles(timings)
+
+
+def bench_queries(params, hours, iterations) -> dict:
+    db = DataSource(**params, pool_max_size=2)
+    try:
+        ticker_ids = sorted(ticker_id for _, ticker_id in db.get_tickers())
+        many = ticker_ids[:MANY_TICKERS]
+        end = BENCH_START + timedelta(hours=hours)
+        rotate = [ticker_ids[i % len(ticker_ids)] for i in range(iterations)]
+        cases = {
+            'get_tickers': (db.get_tickers, [()] * iterations),
+            'get_last_data': (db.get_last_data, [(t, ROW_LIMIT) for t in rotate]),
+            'get_update': (db.get_update, [(t, end - timedelta(seconds=10), ROW_LIMIT) for t in rotate]),
+            'get_last_data_many': (db.get_last_data_many, [(many, ROW_LIMIT)] * iterations),
+            'get_update_many': (
+                db.get_update_many,
+                [(many, [end - timedelta(seconds=10)] * len(many), ROW_LIMIT)] * iterations,
+            ),
+            'get_date_range': (db.get_date_range, [(t, 24) for t in rotate]),
+            f'get_tile.{RAW_SOURCE}': (
+                db.get_tile,
+                [(RAW_SOURCE, t, end - timedelta(minutes=10), end) for t in rotate],
+            ),
+        }
+        cases.update({
+            f'get_tile.{table}': (db.get_tile, [(table, t, BENCH_START, end) for t in rotate])
+            for table, _ in ROLLUPS
+        })
+
+        result = {}
+        for name, (call, args_list) in cases.items():
+            for key, value in time_calls(call, args_list).items():
+                result[f'query.{name}.{key}'] = value
+
+        # Through the range cache: every ticker once cold, then again warm
+        window = [(t, end - timedelta(hours=hours), end) for t in rotate]
+        for state in ('cold', 'warm'):
+            timings = []
+            for args in window:
+                t1 = perf_counter()
+                db.get_data_by_range(*args)
+                timings.append(perf_counter() - t1)
+            for key, value in percentiles(timings[:len(ticker_ids)] if state == 'cold' else timings).items():
+                result[f'query.get_data_by_range.{state}.{key}'] = value
+        return result
+    finally:
+        db.pool.close()
+
+
+def callback_request(dependency: dict, values: dict, changed: str) -> dict:
+    def props(items):
+        return [
+            {'id': item['id'], 'property': item['property'], 'value': values.get(f'{item["id"]}.{item["property"]}')}
+            for item in items
+        ]
+
+    output = dependency['output']
+    if output.startswith('..'):
+        outputs = []
+        for part in output.strip('.').split('...'):
+            component_id, prop = part.split('.', 1)
+            outputs.append({'id': component_id, 'property': prop.split('@')[0]})
+    else:
+        component_id, prop = output.split('.', 1)
+        outputs = {'id': component_id, 'property': prop}
+    return {
+        'output': output,
+        'outputs': outputs,
+        'inputs': props(dependency['inputs']),
+        'state': props(dependency['state']),
+        'changedPropIds': [changed],
+    }
+
+
+def bench_callbacks(params, hours, iterations) -> dict:
+    app = DashApp(
+        name='benchmark',
+        update_interval=1,
+        row_limit=ROW_LIMIT,
+        db_config=dict(params, pool_max_size=2),
+        stream_mode='extend',
+    )
+    app.init_server()
+    client = app.app.server.test_client()
+    dependencies = {dep['output'].split('@')[0]: dep for dep in client.get('/_dash-dependencies').get_json()}
+
+    def find(output):
+        return next(dep for key, dep in dependencies.items() if output in key)
+
+    tickers = sorted(app.ticker_map, key=app.ticker_map.get)
+    end = BENCH_START + timedelta(hours=hours)
+    graph = find(f'{GRAPH_ID}.figure')
+    cases = {
+        'stream_figure': (graph, lambda i: {
+            f'{INTERVAL_ID}.n_intervals': i,
+            f'{DROPDOWN_ID}.value': tickers[i % len(tickers)],
+            f'{SLIDER_ID}.value': SLIDER_ON,
+        }, f'{INTERVAL_ID}.n_intervals'),
+        'extend': (find(f'{GRAPH_ID}.extendData'), lambda i: {
+            f'{INTERVAL_ID}.n_intervals': i,
+            f'{DROPDOWN_ID}.value': tickers[0],
+            f'{SLIDER_ID}.value': SLIDER_ON,
+            f'{STREAM_STATE_ID}.data': {'ticker': tickers[0], 'last': str(end - timedelta(seconds=10))[:19]},
+        }, f'{INTERVAL_ID}.n_intervals'),
+        'zoom_10min': (graph, lambda i: {
+            f'{DROPDOWN_ID}.value': tickers[i % len(tickers)],
+            f'{SLIDER_ID}.value': SLIDER_OFF,
+            f'{GRAPH_ID}.relayoutData': {
+                'xaxis.range[0]': f'{end - timedelta(minutes=10, seconds=i):%Y-%m-%d %H:%M:%S}',
+                'xaxis.range[1]': f'{end - timedelta(seconds=i):%Y-%m-%d %H:%M:%S}',
+            },
+        }, f'{GRAPH_ID}.relayoutData'),
+        'zoom_history': (graph, lambda i: {
+            f'{DROPDOWN_ID}.value': tickers[i % len(tickers)],
+            f'{SLIDER_ID}.value': SLIDER_OFF,
+            f'{GRAPH_ID}.relayoutData': {
+                'xaxis.range[0]': f'{BENCH_START + timedelta(seconds=i):%Y-%m-%d %H:%M:%S}',
+                'xaxis.range[1]': f'{end - timedelta(seconds=i):%Y-%m-%d %H:%M:%S}',
+            },
+        }, f'{GRAPH_ID}.relayoutData'),
+        'compare': (find(f'{COMPARE_GRAPH_ID}.figure'), lambda i: {
+            f'{COMPARE_INTERVAL_ID}.n_intervals': i,
+            f'{COMPARE_DROPDOWN_ID}.value': tickers[:MANY_TICKERS],
+            f'{COMPARE_MODE_ID}.value': COMPARE_PRICE,
+        }, f'{COMPARE_INTERVAL_ID}.n_intervals'),
+    }
+
+    result = {}
+    try:
+        for name, (dependency, values, changed) in cases.items():
+            timings = []
+            sizes = []
+            for i in range(iterations + 1):
+                body = callback_request(dependency, values(i), changed)
+                t1 = perf_counter()
+                response = client.post('/_dash-update-component', json=body)
+                elapsed = perf_counter() - t1
+                if response.status_code != 200:
+                    raise RuntimeError(f'Callback {name} answered {response.status_code}: {response.data[:200]}')
+                if i:
+                    timings.append(elapsed)
+                    sizes.append(len(response.data))
+            for key, value in percentiles(timings).items():
+                result[f'callback.{name}.{key}'] = value
+            result[f'callback.{name}.bytes'] = int(np.median(sizes))
+    finally:
+        app.db.pool.close()
+    return result
+
+
+async def run_case(params, n_tickers, hours, iterations) -> tuple:
+    server_version = await reset_schema(params)
+    result = {}
+    result.update(await bench_sync_tickers(params, n_tickers))
+    result.update(await bench_backfill(params, n_tickers, hours))
+    result.update(await bench_save_tick(params, n_tickers, iterations))
+    # The dashboard side is synchronous, keep it off the event loop
+    loop = asyncio.get_running_loop()
+    result.update(await loop.run_in_executor(None, bench_queries, params, hours, iterations))
+    result.update(await loop.run_in_executor(None, bench_callbacks, params, hours, iterations))
+    return server_version, result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(__file__),
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args):
+    logging.basicConfig(level=logging.WARNING)
+    if args.config:
+        server = existing_postgres(args.config)
+    else:
+        server = DisposablePostgres(args.pg_bin, [f'-c {option}' for option in args.pg_option])
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'tickers': args.tickers,
+            'hours': args.hours,
+            'iterations': args.iterations,
+        },
+        'results': {},
+    }
+    with server as params:
+        for n_tickers in args.tickers:
+            for hours in args.hours:
+                key = f'tickers={n_tickers},hours={hours}'
+                print(f'Run {key}', file=sys.stderr)
+                server_version, report['results'][key] = asyncio.run(run_case(params, n_tickers, hours, args.iterations))
+                report['meta']['postgres'] = server_version
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    print_report(report)
+
+
+def print_report(report):
+    for key, metrics in report['results'].items():
+        print(key)
+        for metric, value in sorted(metrics.items()):
+            print(f'  {metric:48} {value:>14}')
+
+
+def compare(args) -> int:
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+
+    print(f'{before["meta"]["commit"]} -> {after["meta"]["commit"]}')
+    regressions = 0
+    for key in sorted(set(before['results']) & set(after['results'])):
+        print(key)
+        old_metrics, new_metrics = before['results'][key], after['results'][key]
+        for metric in sorted(set(old_metrics) & set(new_metrics)):
+            old, new = old_metrics[metric], new_metrics[metric]
+            change = (new - old) / old * 100 if old else 0.0
+            worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+            flag = ''
+            if worse > args.threshold:
+                flag = ' REGRESSION'
+                regressions += 1
+            elif worse < -args.threshold:
+                flag = ' improved'
+            print(f'  {metric:48} {old:>12} {new:>12} {change:>+8.1f}%{flag}')
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest and dashboard read path benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run the benchmarks and write a JSON report')
+    run_parser.add_argument('--tickers', type=int, nargs='+', default=list(DEFAULT_TICKERS))
+    run_parser.add_argument('--hours', type=int, nargs='+', default=list(DEFAULT_HOURS), help='History length')
+    run_parser.add_argument('--iterations', type=int, default=50, help='Timed calls per query and callback')
+    run_parser.add_argument('-o', '--output', type=str, help='JSON report file')
+    run_parser.add_argument(
+        '-c', '--config', type=str,
+        help='Use the server of this config instead of a disposable one, its data_source schema is DROPPED',
+    )
+    run_parser.add_argument('--pg-bin', type=str, help='Directory of initdb and pg_ctl')
+    run_parser.add_argument('--pg-option', action='append', default=[], help='Server setting, e.g. shared_buffers=1GB')
+
+    compare_parser = commands.add_parser('compare', help='Compare two reports')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help='Percent change reported as a regression')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,29 @@
+import base64
+import functools
+import json
 import logging
+import os
+import queue
+import re
 from time import monotonic
 
 import dash
 import dash_bootstrap_components as dbc
-import plotly
-import plotly.graph_objects as go
+import flask
+import numpy as np
+from dash import dash_table
 from dash import dcc
 from dash import html
 from dash.dependencies import Output, Input, State
 from dash.exceptions import PreventUpdate
 
-from dash_app.db import DataSource
+from dash_app.buffer import TickerBuffers
+from dash_app.db import DEFAULT_MIN_POINTS, DataSource
+from dash_app.downsample import downsample
+from dash_app.notify import Broadcaster, TickListener
+from dash_app.overview import MarketOverview
 from utils.helpers import str_to_dt
+from utils.metrics import CONTENT_TYPE, REGISTRY, SIZE_BUCKETS
 
 logger = logging.getLogger(__name__)
 
@@ -22,25 +34,108 @@ INTERVAL_ID = 'graph-update'
 SLIDER_ID = 'slider'
 STORE_ID = 'store'
 BUTTON_ID = 'stream_button'
+PUSH_STORE_ID = 'push-store'
+STREAM_STATE_ID = 'stream-state'
+COMPARE_DROPDOWN_ID = 'compare_dropdown'
+COMPARE_MODE_ID = 'compare-mode'
+COMPARE_GRAPH_ID = 'compare-graph'
+COMPARE_INTERVAL_ID = 'compare-update'
+OVERVIEW_TABLE_ID = 'overview-table'
+OVERVIEW_INTERVAL_ID = 'overview-update'
+
+COMPARE_PRICE = 'price'
+COMPARE_CHANGE = 'change'
+
+# Overview table columns and the MarketOverview column they are sorted by, trend is not sortable
+OVERVIEW_COLUMNS = (
+    ('ticker', 'Ticker', 'ticker_id'),
+    ('price', 'Price', 'price'),
+    ('change', 'Change', 'change'),
+    ('trend', 'Trend', None),
+    ('updated', 'Updated', 'created'),
+)
 
 SLIDER_ON = 1
 SLIDER_OFF = 0
 
+# About 2x the pixel width of the graph
+DEFAULT_POINT_BUDGET = 2000
+
+ASSETS_FOLDER = os.path.join(os.path.dirname(__file__), 'assets')
+# Seconds between keepalive comments of the tick stream
+STREAM_KEEPALIVE = 15
+
+STREAM_MODE_FIGURE = 'figure'
+STREAM_MODE_EXTEND = 'extend'
+STREAM_MODES = (STREAM_MODE_FIGURE, STREAM_MODE_EXTEND)
+
+# Suffix dash adds to outputs with allow_duplicate
+DUPLICATE_OUTPUT_SUFFIX = re.compile(r'@[0-9a-f]+')
+
+CALLBACK_SECONDS = REGISTRY.histogram('dash_callback_seconds', 'Server side callback latency', ['callback'])
+PAYLOAD_BYTES = REGISTRY.histogram(
+    'dash_callback_payload_bytes',
+    'Size of callback responses sent to the browser',
+    ['output'],
+    buckets=SIZE_BUCKETS,
+)
+
 
 class App:
-    def __init__(self, *, name, update_interval, row_limit, db_config):
+    def __init__(
+            self,
+            *,
+            name,
+            update_interval,
+            row_limit,
+            db_config,
+            min_points=DEFAULT_MIN_POINTS,
+            point_budget=DEFAULT_POINT_BUDGET,
+            downsample_method='lttb',
+            buffer_max_age=None,
+            push_updates=False,
+            notify_channel='ticker_log',
+            stream_mode=STREAM_MODE_FIGURE,
+            range_cache=None,
+            compare_limit=50,
+            overview_points=60,
+            overview_page_size=20,
+    ):
+        if stream_mode not in STREAM_MODES:
+            raise ValueError(f'Unknown stream_mode {stream_mode!r}, expected one of {STREAM_MODES}')
         self.name = name
         self.row_limit = row_limit
+        self.min_points = min_points
+        self.point_budget = point_budget
+        self.downsample_method = downsample_method
         self.update_interval = update_interval
-        self.db = DataSource(**db_config)
+        self.db = DataSource(**db_config, range_cache=range_cache)
+        self.buffers = TickerBuffers(
+            self.db,
+            capacity=row_limit,
+            max_age=buffer_max_age,
+            min_refresh=update_interval / 2,
+        )
+        self.push_updates = push_updates
+        self.stream_mode = stream_mode
+        self.compare_limit = compare_limit
+        self.overview = MarketOverview(self.db, points=overview_points, min_refresh=update_interval / 2)
+        self.overview_page_size = overview_page_size
+        self.notify_channel = notify_channel
+        self.broadcaster = Broadcaster()
+        self.listener = None
         self.app = dash.Dash(
             self.name,
             suppress_callback_exceptions=True,
             external_stylesheets=[dbc.themes.BOOTSTRAP],
+            assets_folder=ASSETS_FOLDER,
+            # The browser side of the tick stream is only needed in push mode
+            assets_ignore='' if push_updates else r'push\.js',
         )
         self.x_cache = {}
         self.y_cache = {}
         self.ticker_map = {}
+        self.ticker_names = {}
         self.last_update = {}
         self.slider_marks = None
         self.stop_stream = False
@@ -57,7 +152,63 @@ class App:
                     class_name='mt-3',
                 ),
                 dbc.Container(id=CONTAINER_ID),
-                dcc.Store(id=STORE_ID)
+                dbc.Card(
+                    [
+                        dbc.CardHeader('Compare tickers'),
+                        dbc.CardBody([
+                            dcc.Dropdown(tickers, id=COMPARE_DROPDOWN_ID, multi=True),
+                            dcc.RadioItems(
+                                [
+                                    {'label': 'Price', 'value': COMPARE_PRICE},
+                                    {'label': 'Change', 'value': COMPARE_CHANGE},
+                                ],
+                                COMPARE_PRICE,
+                                id=COMPARE_MODE_ID,
+                                inline=True,
+                            ),
+                            dcc.Graph(id=COMPARE_GRAPH_ID),
+                            dcc.Interval(
+                                id=COMPARE_INTERVAL_ID,
+                                interval=1000,
+                                n_intervals=0,
+                                disabled=self.push_updates,
+                            ),
+                        ]),
+                    ],
+                    style={'width': '100%'},
+                    class_name='mt-3',
+                ),
+                dbc.Card(
+                    [
+                        dbc.CardHeader('Market overview'),
+                        dbc.CardBody([
+                            # Sorted and paged on the server, only the shown page is sent
+                            dash_table.DataTable(
+                                id=OVERVIEW_TABLE_ID,
+                                columns=[
+                                    {'name': name, 'id': column_id, 'type': 'text' if key is None else 'any'}
+                                    for column_id, name, key in OVERVIEW_COLUMNS
+                                ],
+                                page_current=0,
+                                page_size=self.overview_page_size,
+                                page_action='custom',
+                                sort_action='custom',
+                                sort_mode='single',
+                                sort_by=[],
+                            ),
+                            dcc.Interval(
+                                id=OVERVIEW_INTERVAL_ID,
+                                interval=1000,
+                                n_intervals=0,
+                                disabled=self.push_updates,
+                            ),
+                        ]),
+                    ],
+                    style={'width': '100%'},
+                    class_name='mt-3',
+                ),
+                dcc.Store(id=STORE_ID),
+                dcc.Store(id=PUSH_STORE_ID),
             ]
         )
 
@@ -65,7 +216,10 @@ class App:
             dbc.Row(f'{ticker}', justify='center', class_name='mt-3'),
             dcc.Graph(id=GRAPH_ID, animate=True),
             dcc.Slider(*slider_args, value=slider_value, id=SLIDER_ID, marks=marks),
-            dcc.Interval(id=INTERVAL_ID, interval=1000, n_intervals=0),
+            # Pushed ticks replace polling, see stream_ticks
+            dcc.Interval(id=INTERVAL_ID, interval=1000, n_intervals=0, disabled=self.push_updates),
+            # Ticker and last timestamp the browser has, for extendData updates
+            dcc.Store(id=STREAM_STATE_ID),
         ])
 
         self.callbacks = [
@@ -73,15 +227,59 @@ class App:
                 self.update_graph_scatter,
                 (
                     Output(GRAPH_ID, 'figure'),
+                    Output(STREAM_STATE_ID, 'data'),
                     [
                         Input(INTERVAL_ID, 'n_intervals'),
                         State(DROPDOWN_ID, 'value'),
                         Input(GRAPH_ID, 'relayoutData'),
                         State(SLIDER_ID, 'value'),
+                        Input(PUSH_STORE_ID, 'data'),
+                        State(STREAM_STATE_ID, 'data'),
                     ],
 
                 )
             ),
+            (
+                self.extend_graph,
+                (
+                    Output(GRAPH_ID, 'extendData'),
+                    Output(STREAM_STATE_ID, 'data', allow_duplicate=True),
+                    [
+                        Input(INTERVAL_ID, 'n_intervals'),
+                        Input(PUSH_STORE_ID, 'data'),
+                        State(DROPDOWN_ID, 'value'),
+                        State(SLIDER_ID, 'value'),
+                        State(STREAM_STATE_ID, 'data'),
+                    ],
+                ),
+                {'prevent_initial_call': True},
+            ),
+            (
+                self.update_compare,
+                (
+                    Output(COMPARE_GRAPH_ID, 'figure'),
+                    [
+                        Input(COMPARE_INTERVAL_ID, 'n_intervals'),
+                        Input(PUSH_STORE_ID, 'data'),
+                        Input(COMPARE_DROPDOWN_ID, 'value'),
+                        Input(COMPARE_MODE_ID, 'value'),
+                    ],
+                ),
+            ),
+            (
+                self.update_overview,
+                (
+                    Output(OVERVIEW_TABLE_ID, 'data'),
+                    Output(OVERVIEW_TABLE_ID, 'page_count'),
+                    [
+                        Input(OVERVIEW_INTERVAL_ID, 'n_intervals'),
+                        Input(PUSH_STORE_ID, 'data'),
+                        Input(OVERVIEW_TABLE_ID, 'page_current'),
+                        Input(OVERVIEW_TABLE_ID, 'page_size'),
+                        Input(OVERVIEW_TABLE_ID, 'sort_by'),
+                    ],
+                ),
+            ),
             (
                 self.select_ticker,
                 (
@@ -99,8 +297,17 @@ class App:
             # )
         ]
 
-    def update_graph_scatter(self, n_interval, current_ticker, relayout_data, slider_value):
+    def update_graph_scatter(
+            self,
+            n_interval,
+            current_ticker,
+            relayout_data,
+            slider_value,
+            push_event=None,
+            stream_state=None,
+    ):
         is_stream = slider_value == 1
+        is_extend = self.stream_mode == STREAM_MODE_EXTEND
         logger.debug(f'n_interval     -> {n_interval}')
         logger.debug(f'current_ticker -> {current_ticker}')
         logger.debug(f'relayout_data  -> {relayout_data}')
@@ -118,6 +325,14 @@ class App:
         if is_relayout_event and not is_stream:
             raise PreventUpdate
 
+        if (
+            is_extend and is_stream and
+            dash.callback_context.triggered_id in (INTERVAL_ID, PUSH_STORE_ID) and
+            stream_state and stream_state['ticker'] == current_ticker
+        ):
+            # The browser already has the figure, extend_graph sends the new rows
+            raise PreventUpdate
+
         start_x = end_x = start_y = end_y = None
         if relayout_data:
             if relayout_data.get('xaxis.range[0]'):
@@ -139,53 +354,146 @@ class App:
         t1 = monotonic()
 
         if start_x and end_x and not is_stream:
-            rowset = self.db.get_data_by_range(ticker_id, start_x, end_x)
+            x, y = self.db.get_data_by_range(ticker_id, start_x, end_x, self.min_points)
             logging.info(f'Load hist. data from DB {monotonic() - t1}sec.')
         else:
-            rowset = self.db.get_last_data(ticker_id, limit=self.row_limit)
-            logging.info(f'Load new data from DB {monotonic() - t1}sec.')
+            x, y = self.buffers.get(ticker_id)
+            logging.info(f'Load new data from buffer {monotonic() - t1}sec.')
 
-        if not rowset:
+        if not len(x):
             raise PreventUpdate
 
-        y, x = list(zip(*rowset))
-
-        if start_x == min(x) and end_x == max(x):
+        if start_x and end_x and np.datetime64(start_x, 'us') == x[0] and np.datetime64(end_x, 'us') == x[-1]:
             logger.debug('Double callback')
             raise PreventUpdate
 
         if is_stream or not (start_x and end_x):
-            start_x = min(x)
-            end_x = max(x)
-            start_y = min(y)
-            end_y = max(y)
+            start_x = x[0]
+            end_x = x[-1]
+            start_y = y.min()
+            end_y = y.max()
+
+        x, y = downsample(x, y, self.point_budget, self.downsample_method)
 
         logger.info(f'start_x -> {start_x}')
         logger.info(f'end_x   -> {end_x}')
         logger.info(f'start_y -> {start_y}')
         logger.info(f'end_y   -> {end_y}')
 
-        data = plotly.graph_objs.Scatter(
-            x=x,
-            y=y,
-            name='Scatter',
-            mode='lines'
-        )
+        if is_extend and is_stream:
+            # Fixed ranges would hide extended points, let plotly follow the data
+            figure = self.build_figure(x, y, extendable=True)
+            stream_state = {'ticker': current_ticker, 'last': str(x[-1])}
+        else:
+            figure = self.build_figure(x, y, [start_x, end_x], [start_y, end_y])
+            stream_state = None
+        return [figure, stream_state]
+
+    def extend_graph(self, n_interval, push_event, current_ticker, slider_value, stream_state):
+        if (
+            self.stream_mode != STREAM_MODE_EXTEND or slider_value != SLIDER_ON or
+            not current_ticker or not stream_state or stream_state['ticker'] != current_ticker
+        ):
+            raise PreventUpdate
+
+        x, y = self.buffers.get(self.ticker_map[current_ticker])
+        new = x > np.datetime64(stream_state['last'])
+        if not new.any():
+            raise PreventUpdate
+
+        x, y = x[new], y[new]
         return [
+            self.build_extend_data(x, y, self.row_limit),
+            {'ticker': current_ticker, 'last': str(x[-1])},
+        ]
+
+    @staticmethod
+    def typed_array(values: np.ndarray) -> dict:
+        # Plotly.js typed array: the raw little-endian buffer instead of a JSON number per point
+        return {'dtype': 'f8', 'bdata': base64.b64encode(np.ascontiguousarray(values, dtype='<f8')).decode('ascii')}
+
+    @staticmethod
+    def build_trace(x, y, name: str, extendable: bool = False) -> dict:
+        if extendable:
+            # extendTraces only appends to plain arrays
+            return {'type': 'scatter', 'x': x, 'y': y, 'name': name, 'mode': 'lines'}
+        return {
+            'type': 'scatter',
+            # Milliseconds since epoch, shown as UTC dates on a date axis
+            'x': App.typed_array(x.astype('datetime64[us]').astype(np.int64) / 1000),
+            'y': App.typed_array(y),
+            'name': name,
+            'mode': 'lines',
+        }
+
+    @staticmethod
+    def build_figure(x, y, x_range=None, y_range=None, extendable: bool = False) -> dict:
+        if x_range is None:
+            layout = {'xaxis': {'type': 'date', 'autorange': True}, 'yaxis': {'autorange': True}}
+        else:
+            layout = {'xaxis': {'type': 'date', 'range': x_range}, 'yaxis': {'range': y_range}}
+        return {
+            'data': [App.build_trace(x, y, 'Scatter', extendable)],
+            'layout': layout,
+        }
+
+    @staticmethod
+    def build_extend_data(x, y, max_points: int) -> list:
+        # extendData format: (new data, trace indices, max points per trace)
+        return [{'x': [x], 'y': [y]}, [0], max_points]
+
+    def update_compare(self, n_interval, push_event, tickers, mode):
+        if not tickers:
+            raise PreventUpdate
+
+        tickers = tickers[:self.compare_limit]
+        t1 = monotonic()
+        # One batched refresh for every selected ticker
+        data = self.buffers.get_many([self.ticker_map[ticker] for ticker in tickers])
+        logger.debug(f'Load {len(tickers)} tickers from buffers {monotonic() - t1}sec.')
+
+        traces = []
+        for ticker in tickers:
+            x, y = data[self.ticker_map[ticker]]
+            if not len(x):
+                continue
+            if mode == COMPARE_CHANGE:
+                y = y - y[0]
+            traces.append(self.build_trace(x, y, ticker))
+
+        return [{
+            'data': traces,
+            # Keeps zoom and hidden traces across updates
+            'layout': {'xaxis': {'type': 'date'}, 'uirevision': mode, 'legend': {'orientation': 'h'}},
+        }]
+
+    def update_overview(self, n_interval, push_event, page_current, page_size, sort_by):
+        sort_keys = {column_id: key for column_id, _, key in OVERVIEW_COLUMNS}
+        sort = sort_by[0] if sort_by else {'column_id': 'ticker', 'direction': 'asc'}
+        # Tickers are named after their number, so ticker order is ticker_id order
+        rows, n_tickers = self.overview.page(
+            sort_keys.get(sort['column_id']) or 'ticker_id',
+            sort['direction'] == 'desc',
+            page_current or 0,
+            page_size or self.overview_page_size,
+        )
+        data = [
             {
-                'data': [data],
-                'layout': go.Layout(
-                    xaxis=dict(
-                        range=[start_x, end_x],
-                        # autorange=False,
-                    ),
-                    yaxis=dict(
-                        range=[start_y, end_y],
-                        # autorange=False,
-                    ),
-                )
-            },
+                'ticker': self.ticker_names.get(ticker_id, str(ticker_id)),
+                'price': price,
+                'change': change,
+                'trend': trend,
+                'updated': str(created.astype('datetime64[s]')).replace('T', ' '),
+            }
+            for ticker_id, price, change, trend, created in zip(
+                rows['ticker_id'].tolist(),
+                rows['price'].tolist(),
+                rows['change'].tolist(),
+                rows['trend'],
+                rows['created'],
+            )
         ]
+        return [data, max(1, -(-n_tickers // (page_size or self.overview_page_size)))]
 
     def select_ticker(self, ticker: str):
         if not ticker:
@@ -205,11 +513,105 @@ class App:
             'slider_state': slider_value
         }]
 
-    def run_server(self, *args, **kwargs):
-        self.ticker_map = dict(self.db.get_tickers())
-        self.app.layout = self.layout(list(self.ticker_map))
+    def pool_stats(self):
+        return flask.jsonify(self.db.pool_stats())
 
-        for callback, callback_args in self.callbacks:
-            self.app.callback(callback_args)(callback)
+    def metrics(self):
+        return flask.Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
+    def register_metrics(self):
+        REGISTRY.gauge(
+            'dash_pool_connections',
+            'DB pool connections by state',
+            ['state'],
+            collect=lambda: {
+                (state,): value for state, value in self.db.pool_stats().items() if state in ('idle', 'in_use', 'waiting')
+            },
+        )
+        REGISTRY.counter(
+            'dash_pool_timeouts_total',
+            'Requests that got no DB connection in time',
+            collect=lambda: self.db.pool_stats()['timeouts'],
+        )
+        REGISTRY.counter(
+            'dash_range_cache_requests_total',
+            'Range cache tile lookups by result',
+            ['result'],
+            collect=lambda: {
+                ('hit',): self.db.range_cache.hits,
+                ('miss',): self.db.range_cache.misses,
+            },
+        )
+        REGISTRY.gauge(
+            'dash_range_cache_hit_ratio',
+            'Share of range cache tile lookups served from the cache',
+            collect=lambda: self.db.range_cache.stats()['hit_ratio'],
+        )
+        REGISTRY.gauge(
+            'dash_range_cache_bytes',
+            'Size of the tiles cached in process',
+            collect=lambda: self.db.range_cache.stats()['bytes'],
+        )
+
+    @staticmethod
+    def timed(callback):
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            with CALLBACK_SECONDS.time(callback=callback.__name__):
+                return callback(*args, **kwargs)
+        return wrapper
+
+    @staticmethod
+    def observe_payload(response):
+        request = flask.request
+        if request.path.endswith('_dash-update-component') and response.status_code == 200:
+            output = (request.get_json(silent=True) or {}).get('output', '')
+            PAYLOAD_BYTES.observe(
+                response.calculate_content_length() or 0,
+                output=DUPLICATE_OUTPUT_SUFFIX.sub('', output),
+            )
+        return response
+
+    def on_tick(self, event: dict):
+        # One tail fetch per watched ticker, whatever the number of viewers
+        self.buffers.refresh_active()
+        self.broadcaster.publish(event)
+
+    def stream_ticks(self):
+        def events():
+            with self.broadcaster.subscribe() as subscription:
+                yield ': connected\n\n'
+                while True:
+                    try:
+                        event = subscription.get(timeout=STREAM_KEEPALIVE)
+                    except queue.Empty:
+                        yield ': keepalive\n\n'
+                        continue
+                    yield f'data: {json.dumps(event)}\n\n'
+
+        return flask.Response(
+            events(),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+
+    def run_server(self, *args, **kwargs):
+        self.init_server()
         self.app.run_server(*args, **kwargs)
+
+    def init_server(self):
+        self.ticker_map = dict(self.db.get_tickers())
+        self.ticker_names = {ticker_id: ticker for ticker, ticker_id in self.ticker_map.items()}
+        self.app.layout = self.layout(list(self.ticker_map))
+        self.app.server.add_url_rule('/stats/pool', view_func=self.pool_stats)
+        self.app.server.add_url_rule('/metrics', view_func=self.metrics)
+        self.app.server.after_request(self.observe_payload)
+        self.register_metrics()
+
+        if self.push_updates:
+            self.app.server.add_url_rule('/stream/ticks', view_func=self.stream_ticks)
+            self.listener = TickListener(self.db.params, self.notify_channel, self.on_tick)
+            self.listener.start()
+
+        for callback, callback_args, *options in self.callbacks:
+            self.app.callback(callback_args, **(options[0] if options else {}))(self.timed(callback))
@@ -0,0 +1,12 @@
+// Forwards ticks pushed by the server into the push store, see App.stream_ticks
+(function () {
+    if (!window.EventSource) {
+        return;
+    }
+    var source = new EventSource('stream/ticks');
+    source.onmessage = function (event) {
+        if (window.dash_clientside && window.dash_clientside.set_props) {
+            window.dash_clientside.set_props('push-store', {data: JSON.parse(event.data)});
+        }
+    };
+})();
@@ -0,0 +1,190 @@
+__all__ = [
+    'RingBuffer',
+    'TickerBuffers',
+]
+
+import logging
+import threading
+from datetime import datetime
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    def __init__(self, capacity: int, max_age: Optional[float] = None):
+        self.capacity = capacity
+        self.max_age = None if max_age is None else np.timedelta64(int(max_age * 1e6), 'us')
+        self.x = np.empty(capacity, dtype='datetime64[us]')
+        self.y = np.empty(capacity, dtype=np.float64)
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def last_ts(self) -> Optional[np.datetime64]:
+        if not self.size:
+            return None
+        return self.x[(self.start + self.size - 1) % self.capacity]
+
+    def extend(self, x: np.ndarray, y: np.ndarray):
+        if len(x) >= self.capacity:
+            self.x[:] = x[-self.capacity:]
+            self.y[:] = y[-self.capacity:]
+            self.start, self.size = 0, self.capacity
+        elif len(x):
+            positions = (self.start + self.size + np.arange(len(x))) % self.capacity
+            self.x[positions] = x
+            self.y[positions] = y
+            overflow = max(0, self.size + len(x) - self.capacity)
+            self.start = (self.start + overflow) % self.capacity
+            self.size = min(self.capacity, self.size + len(x))
+        self._evict_old()
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        positions = (self.start + np.arange(self.size)) % self.capacity
+        return self.x[positions], self.y[positions]
+
+    def clear(self):
+        self.start = self.size = 0
+
+    def _evict_old(self):
+        if self.max_age is None or not self.size:
+            return
+        x, _ = self.arrays()
+        expired = int(np.searchsorted(x, self.last_ts - self.max_age, side='left'))
+        self.start = (self.start + expired) % self.capacity
+        self.size -= expired
+
+
+class _TickerBuffer(RingBuffer):
+    def __init__(self, capacity: int, max_age: Optional[float] = None):
+        super().__init__(capacity, max_age)
+        self.lock = threading.Lock()
+        self.refreshed = None
+        self.accessed = monotonic()
+
+
+class TickerBuffers:
+    """Latest ticks per ticker, shared by every session of the dash process.
+
+    A buffer is filled once with the last `capacity` rows and then only
+    fetches rows newer than its last timestamp, at most once per
+    `min_refresh` seconds whatever the number of viewers.
+    """
+
+    def __init__(
+            self,
+            db,
+            *,
+            capacity: int,
+            max_age: Optional[float] = None,
+            min_refresh: float = 0.5,
+            idle_timeout: float = 600,
+    ):
+        self.db = db
+        self.capacity = capacity
+        self.max_age = max_age
+        self.min_refresh = min_refresh
+        self.idle_timeout = idle_timeout
+        self.buffers: Dict[int, _TickerBuffer] = {}
+        self.lock = threading.Lock()
+
+    def get(self, ticker_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        buffer = self._get_buffer(ticker_id)
+        with buffer.lock:
+            now = monotonic()
+            buffer.accessed = now
+            if buffer.refreshed is None or now - buffer.refreshed >= self.min_refresh:
+                self._refresh(ticker_id, buffer)
+                buffer.refreshed = now
+            return buffer.arrays()
+
+    def get_many(self, ticker_ids: List[int]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        buffers = {ticker_id: self._get_buffer(ticker_id) for ticker_id in ticker_ids}
+        now = monotonic()
+        stale = [
+            ticker_id for ticker_id, buffer in buffers.items()
+            if buffer.refreshed is None or now - buffer.refreshed >= self.min_refresh
+        ]
+        if stale:
+            self._refresh_many(stale, buffers)
+
+        result = {}
+        for ticker_id, buffer in buffers.items():
+            with buffer.lock:
+                buffer.accessed = now
+                result[ticker_id] = buffer.arrays()
+        return result
+
+    def _refresh_many(self, ticker_ids: List[int], buffers: Dict[int, _TickerBuffer]):
+        # At most two queries for the whole batch: a tail fetch of filled buffers and a fill of the
+        # empty ones and of those too far behind for a tail fetch, like _refresh
+        filled = [ticker_id for ticker_id in ticker_ids if len(buffers[ticker_id])]
+        fetched = {}
+        if filled:
+            since = [buffers[ticker_id].last_ts.astype(datetime) for ticker_id in filled]
+            fetched.update(self.db.get_update_many(filled, since, limit=self.capacity))
+        refill = [
+            ticker_id for ticker_id in ticker_ids
+            if not len(buffers[ticker_id]) or len(fetched.get(ticker_id, ((),))[0]) >= self.capacity
+        ]
+        if refill:
+            fetched.update(self.db.get_last_data_many(refill, limit=self.capacity))
+
+        refreshed = monotonic()
+        for ticker_id in ticker_ids:
+            buffer = buffers[ticker_id]
+            x, y = fetched.get(ticker_id, (None, None))
+            with buffer.lock:
+                if x is not None and ticker_id in refill:
+                    buffer.clear()
+                elif x is not None and len(buffer):
+                    # Other sessions may have refreshed the buffer meanwhile
+                    new = x > buffer.last_ts
+                    x, y = x[new], y[new]
+                if x is not None:
+                    buffer.extend(x, y)
+                buffer.refreshed = refreshed
+
+    def refresh_active(self):
+        with self.lock:
+            buffers = list(self.buffers.items())
+        for ticker_id, buffer in buffers:
+            with buffer.lock:
+                self._refresh(ticker_id, buffer)
+                buffer.refreshed = monotonic()
+
+    def _get_buffer(self, ticker_id: int) -> _TickerBuffer:
+        with self.lock:
+            buffer = self.buffers.get(ticker_id)
+            if buffer is None:
+                self._drop_idle()
+                buffer = self.buffers[ticker_id] = _TickerBuffer(self.capacity, self.max_age)
+            return buffer
+
+    def _refresh(self, ticker_id: int, buffer: _TickerBuffer):
+        if not len(buffer):
+            buffer.extend(*self.db.get_last_data(ticker_id, limit=self.capacity))
+            return
+
+        last_ts = buffer.last_ts.astype(datetime)
+        x, y = self.db.get_update(ticker_id, last_ts, limit=self.capacity)
+        if len(x) >= self.capacity:
+            # Too far behind for a tail fetch, refill from scratch
+            logger.debug(f'Refill buffer of ticker {ticker_id}')
+            buffer.clear()
+            x, y = self.db.get_last_data(ticker_id, limit=self.capacity)
+        buffer.extend(x, y)
+
+    def _drop_idle(self):
+        now = monotonic()
+        for ticker_id, buffer in list(self.buffers.items()):
+            if now - buffer.accessed > self.idle_timeout:
+                del self.buffers[ticker_id]
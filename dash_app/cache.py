@@ -0,0 +1,217 @@
+__all__ = [
+    'MemoryBackend',
+    'RedisBackend',
+    'TileCache',
+    'to_datetime64',
+    'to_epoch',
+]
+
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+Tile = Tuple[np.ndarray, np.ndarray]
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_datetime64(ts: datetime) -> np.datetime64:
+    # Naive datetimes coming from the browser are UTC
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(ts, 'us')
+
+
+def to_epoch(ts: datetime) -> float:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return (ts - EPOCH).total_seconds()
+
+
+class MemoryBackend:
+    """LRU of tiles bounded by the size of their arrays."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.tiles: Dict[tuple, Tile] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys: List[tuple]) -> Dict[tuple, Tile]:
+        found = {}
+        with self.lock:
+            for key in keys:
+                tile = self.tiles.get(key)
+                if tile is not None:
+                    self.tiles.move_to_end(key)
+                    found[key] = tile
+        return found
+
+    def set_many(self, tiles: Dict[tuple, Tile]):
+        with self.lock:
+            for key, tile in tiles.items():
+                old = self.tiles.pop(key, None)
+                if old is not None:
+                    self.nbytes -= self._size(old)
+                self.tiles[key] = tile
+                self.nbytes += self._size(tile)
+            while self.nbytes > self.max_bytes and self.tiles:
+                _, tile = self.tiles.popitem(last=False)
+                self.nbytes -= self._size(tile)
+
+    @staticmethod
+    def _size(tile: Tile) -> int:
+        return tile[0].nbytes + tile[1].nbytes
+
+
+class RedisBackend:
+    """Tiles shared by every dashboard worker through a Redis-compatible server.
+
+    Memory is bounded by the server (maxmemory with an LRU policy) and by
+    the time to live of the keys.
+    """
+
+    def __init__(self, client, *, ttl: Optional[int] = None, prefix: str = 'dash:tile:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs):
+        if redis is None:
+            raise RuntimeError('redis package is required for a shared range cache')
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, key: tuple) -> str:
+        return self.prefix + ':'.join(map(str, key))
+
+    def get_many(self, keys: List[tuple]) -> Dict[tuple, Tile]:
+        if not keys:
+            return {}
+        values = self.client.mget([self._key(key) for key in keys])
+        return {key: self._decode(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, tiles: Dict[tuple, Tile]):
+        with self.client.pipeline(transaction=False) as pipe:
+            for key, tile in tiles.items():
+                pipe.set(self._key(key), self._encode(tile), ex=self.ttl)
+            pipe.execute()
+
+    @staticmethod
+    def _encode(tile: Tile) -> bytes:
+        x, y = tile
+        return x.astype('datetime64[us]').view(np.int64).tobytes() + y.astype(np.float64).tobytes()
+
+    @staticmethod
+    def _decode(value: bytes) -> Tile:
+        data = np.frombuffer(value, dtype=np.int64)
+        half = len(data) // 2
+        return data[:half].view('datetime64[us]'), data[half:].view(np.float64)
+
+
+class TileCache:
+    """Range reads assembled from fixed, per-ticker time tiles.
+
+    A tile spans `tile_points` points of a source (raw rows or a rollup),
+    so any window maps onto a few tiles whatever its exact bounds. Only
+    missing tiles are fetched, one query per contiguous run. Tiles which
+    may still receive rows are never cached: a tile is closed once it ends
+    before `saved_until(ticker_id)`, the time up to which the data source
+    has saved the rows and rollups of the ticker, however late it writes.
+    """
+
+    def __init__(
+            self,
+            fetch: Callable[[str, int, datetime, datetime], Tile],
+            saved_until: Callable[[int], Optional[datetime]],
+            *,
+            tile_points: int = 3600,
+            max_bytes: int = 256 * 2 ** 20,
+            redis_url: Optional[str] = None,
+            ttl: Optional[int] = 24 * 3600,
+    ):
+        self.fetch = fetch
+        self.saved_until = saved_until
+        self.tile_points = tile_points
+        self.local = MemoryBackend(max_bytes)
+        self.shared = RedisBackend.from_url(redis_url, ttl=ttl) if redis_url else None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, source: str, resolution: int, ticker_id: int, start: datetime, end: datetime) -> Tile:
+        tile_span = self.tile_points * resolution
+        first = int(to_epoch(start) // tile_span)
+        last = int(to_epoch(end) // tile_span)
+        keys = [(source, ticker_id, tile_span, i) for i in range(first, last + 1)]
+
+        tiles = self.local.get_many(keys)
+        if self.shared is not None and len(tiles) < len(keys):
+            shared = self.shared.get_many([key for key in keys if key not in tiles])
+            self.local.set_many(shared)
+            tiles.update(shared)
+
+        missing = [key for key in keys if key not in tiles]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            tiles.update(self._fetch_missing(source, ticker_id, tile_span, missing))
+
+        x = np.concatenate([tiles[key][0] for key in keys])
+        y = np.concatenate([tiles[key][1] for key in keys])
+        # Same bounds as the range queries: start < created < end
+        lo = np.searchsorted(x, to_datetime64(start), side='right')
+        hi = np.searchsorted(x, to_datetime64(end), side='left')
+        return x[lo:hi], y[lo:hi]
+
+    def _fetch_missing(self, source: str, ticker_id: int, tile_span: int, missing: List[tuple]) -> Dict[tuple, Tile]:
+        # Read before the tiles, so every row up to it is in what they fetch
+        saved_until = self.saved_until(ticker_id)
+        fetched = {}
+        closed = {}
+        for run in self._runs(missing):
+            run_start = EPOCH + timedelta(seconds=run[0][-1] * tile_span)
+            run_end = EPOCH + timedelta(seconds=(run[-1][-1] + 1) * tile_span)
+            x, y = self.fetch(source, ticker_id, run_start, run_end)
+
+            edges = [EPOCH + timedelta(seconds=key[-1] * tile_span) for key in run[1:]]
+            splits = np.searchsorted(x, [to_datetime64(edge) for edge in edges], side='left')
+            for key, tile_x, tile_y in zip(run, np.split(x, splits), np.split(y, splits)):
+                fetched[key] = (tile_x, tile_y)
+                if saved_until is not None and EPOCH + timedelta(seconds=(key[-1] + 1) * tile_span) <= saved_until:
+                    closed[key] = (tile_x, tile_y)
+
+        self.local.set_many(closed)
+        if self.shared is not None and closed:
+            self.shared.set_many(closed)
+        return fetched
+
+    @staticmethod
+    def _runs(keys: List[tuple]) -> List[List[tuple]]:
+        runs = []
+        for key in keys:
+            if runs and runs[-1][-1][-1] + 1 == key[-1]:
+                runs[-1].append(key)
+            else:
+                runs.append([key])
+        return runs
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'tiles': len(self.local.tiles),
+            'bytes': self.local.nbytes,
+        }
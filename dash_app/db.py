@@ -1,8 +1,283 @@
+import logging
 from datetime import datetime
-from functools import lru_cache
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
-import psycopg2
+import numpy as np
+import psycopg2.extensions
+
+from dash_app.cache import TileCache
+from dash_app.downsample import binary_to_arrays
+from dash_app.partitions import PartitionCatalog
+from dash_app.pool import CONNECTION_ERRORS, ConnectionPool
+from utils.archive import Archive
+from utils.helpers import utc_now
+from utils.metrics import REGISTRY
+from utils.storage import LAYOUT_NUMERIC, LAYOUT_PACKED, get_log_table, get_partition_prefix
+
+logger = logging.getLogger(__name__)
+
+# Source name of raw ticks in queries and the range cache, whatever the storage layout
+RAW_SOURCE = 'ticker_log_part'
+# (table, bucket size in seconds), coarsest first
+ROLLUPS = (
+    ('ticker_ohlc_1h', 3600),
+    ('ticker_ohlc_1m', 60),
+)
+RESOLUTIONS = dict(ROLLUPS, **{RAW_SOURCE: 1})
+DEFAULT_MIN_POINTS = 300
+
+QUERY_SECONDS = REGISTRY.histogram(
+    'dash_db_query_seconds',
+    'Dashboard query latency including the wait for a connection',
+    ['query'],
+)
+
+# Statements prepared once per connection, so Postgres parses and plans them once
+QUERIES = {
+    'get_tickers': '''\
+select ticker, id
+from data_source.ticker
+''',
+    'get_partitions': '''\
+select range_start, range_end
+from data_source.partition_catalog
+where log_table = $1
+''',
+    # Every ticker in one row of binary columns, see get_ticker_last. Rows left by tickers
+    # deleted before their last price was deleted with them are skipped by the join
+    'get_ticker_last': '''\
+select
+    string_agg(int4send(l.ticker_id), '' order by l.ticker_id),
+    string_agg(float8send(l.price::float8), '' order by l.ticker_id),
+    string_agg(timestamptz_send(l.created), '' order by l.ticker_id)
+from data_source.ticker_last l
+join data_source.ticker t on t.id = l.ticker_id
+''',
+    'get_saved_until': '''\
+select created
+from data_source.ticker_last
+where ticker_id = $1
+''',
+}
+# Raw tick queries of the row per ticker layouts, {log_table} is filled in by build_queries
+ROW_QUERIES = {
+    'get_update': '''\
+select
+    price,
+    created
+from data_source.{log_table}
+where ticker_id = $1
+    and created > $2
+order by created
+limit $3
+''',
+    f'get_tile_{RAW_SOURCE}': '''\
+select
+    price,
+    created
+from data_source.{log_table}
+where ticker_id = $1
+    and created >= $2
+    and created < $3
+order by created
+''',
+    'get_last_data': '''\
+select
+    price,
+    created
+from data_source.{log_table}
+where ticker_id = $1
+    and created >= $2
+    and created < $3
+order by created desc
+limit $4
+''',
+    'get_last_data_many': '''\
+select
+    t.ticker_id,
+    l.price,
+    l.created
+from unnest($1::int4[]) as t(ticker_id)
+cross join lateral (
+    select price, created
+    from data_source.{log_table}
+    where ticker_id = t.ticker_id
+        and created >= $2
+        and created < $3
+    order by created desc
+    limit $4
+) l
+''',
+    'get_update_many': '''\
+select
+    t.ticker_id,
+    l.price,
+    l.created
+from unnest($1::int4[], $2::timestamptz[]) as t(ticker_id, since)
+cross join lateral (
+    select price, created
+    from data_source.{log_table}
+    where ticker_id = t.ticker_id
+        and created > t.since
+        and created > $4
+    order by created
+    limit $3
+) l
+''',
+    'get_date_range': '''\
+select
+    date_trunc('hours', created) as ts
+from data_source.{log_table}
+where ticker_id = $1
+group by date_trunc('hours', created)
+order by ts
+limit $2
+''',
+}
+# Same queries for LAYOUT_PACKED, out of range array subscripts are null in Postgres
+PACKED_QUERIES = {
+    'get_update': '''\
+select
+    price,
+    created
+from (
+    select prices[$1 - first_id + 1] as price, created
+    from data_source.{log_table}
+    where created > $2
+) p
+where price is not null
+order by created
+limit $3
+''',
+    f'get_tile_{RAW_SOURCE}': '''\
+select
+    price,
+    created
+from (
+    select prices[$1 - first_id + 1] as price, created
+    from data_source.{log_table}
+    where created >= $2
+        and created < $3
+) p
+where price is not null
+order by created
+''',
+    'get_last_data': '''\
+select
+    price,
+    created
+from (
+    select prices[$1 - first_id + 1] as price, created
+    from data_source.{log_table}
+    where created >= $2
+        and created < $3
+) p
+where price is not null
+order by created desc
+limit $4
+''',
+    'get_last_data_many': '''\
+select
+    t.ticker_id,
+    l.price,
+    l.created
+from unnest($1::int4[]) as t(ticker_id)
+cross join lateral (
+    select prices[t.ticker_id - first_id + 1] as price, created
+    from data_source.{log_table}
+    where prices[t.ticker_id - first_id + 1] is not null
+        and created >= $2
+        and created < $3
+    order by created desc
+    limit $4
+) l
+''',
+    'get_update_many': '''\
+select
+    t.ticker_id,
+    l.price,
+    l.created
+from unnest($1::int4[], $2::timestamptz[]) as t(ticker_id, since)
+cross join lateral (
+    select prices[t.ticker_id - first_id + 1] as price, created
+    from data_source.{log_table}
+    where prices[t.ticker_id - first_id + 1] is not null
+        and created > t.since
+        and created > $4
+    order by created
+    limit $3
+) l
+''',
+    'get_date_range': '''\
+select
+    date_trunc('hours', created) as ts
+from data_source.{log_table}
+where prices[$1 - first_id + 1] is not null
+group by date_trunc('hours', created)
+order by ts
+limit $2
+''',
+}
+QUERIES.update({
+    f'get_tile_{table}': f'''\
+select
+    close,
+    bucket
+from data_source.{table}
+where ticker_id = $1
+    and bucket >= $2
+    and bucket < $3
+order by bucket
+'''
+    for table, _ in ROLLUPS
+})
+
+
+# Queries whose rows are aggregated into one row of binary columns, decoded by binary_to_arrays
+# without a Python object per row: big-endian float8 prices and timestamps in microseconds
+ARRAY_QUERIES = (
+    'get_update',
+    'get_last_data',
+    f'get_tile_{RAW_SOURCE}',
+    *(f'get_tile_{table}' for table, _ in ROLLUPS),
+)
+ARRAY_QUERY = '''\
+select
+    string_agg(float8send(price::float8), '' order by created),
+    string_agg(timestamptz_send(created), '' order by created)
+from (
+{query}) q (price, created)
+'''
+# Same, one row per ticker
+ARRAY_MANY_QUERIES = ('get_last_data_many', 'get_update_many')
+ARRAY_MANY_QUERY = '''\
+select
+    ticker_id,
+    string_agg(float8send(price::float8), '' order by created),
+    string_agg(timestamptz_send(created), '' order by created)
+from (
+{query}) q (ticker_id, price, created)
+group by ticker_id
+'''
+
+
+def build_queries(storage_layout: str = LAYOUT_NUMERIC) -> dict:
+    log_table = get_log_table(storage_layout)
+    raw_queries = PACKED_QUERIES if storage_layout == LAYOUT_PACKED else ROW_QUERIES
+    queries = {name: query.format(log_table=log_table) for name, query in raw_queries.items()}
+    queries.update(QUERIES)
+    for name in ARRAY_QUERIES:
+        queries[name] = ARRAY_QUERY.format(query=queries[name])
+    for name in ARRAY_MANY_QUERIES:
+        queries[name] = ARRAY_MANY_QUERY.format(query=queries[name])
+    return queries
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Names of the statements prepared on this connection
+        self.prepared = set()
 
 
 class DataSource:
@@ -15,6 +290,13 @@ class DataSource:
             database,
             user,
             password,
+            pool_min_size=1,
+            pool_max_size=10,
+            pool_timeout=5.0,
+            range_cache: Optional[dict] = None,
+            storage_layout: str = LAYOUT_NUMERIC,
+            archive_dir: Optional[str] = None,
+            partition_refresh_interval: float = 10.0,
     ):
         self.params = {
             'dbname': database,
@@ -22,81 +304,160 @@ class DataSource:
             'password': password,
             'host': host,
             'port': port,
+            'options': '-c timezone=UTC',
+            'connection_factory': PreparedConnection,
+        }
+        self.schema = schema
+        self.storage_layout = storage_layout
+        self.log_table = get_log_table(storage_layout)
+        self.queries = build_queries(storage_layout)
+        self.pool = ConnectionPool(
+            self.params,
+            min_size=pool_min_size,
+            max_size=pool_max_size,
+            timeout=pool_timeout,
+        )
+        # Raw ticks of partitions archived by the data source
+        self.archive = Archive(archive_dir, get_partition_prefix(storage_layout)) if archive_dir else None
+        self.partitions = PartitionCatalog(self.get_partitions, refresh_interval=partition_refresh_interval)
+        self.range_cache = TileCache(self.get_tile, self.get_saved_until, **(range_cache or {}))
+
+    def _run(self, execute, fetch: bool):
+        # Reads are idempotent, so a broken connection is retried once on a fresh one
+        for attempt in range(2):
+            try:
+                with self.pool.connection() as conn:
+                    with conn.cursor() as cursor:
+                        execute(cursor)
+                        return cursor.fetchall() if fetch else None
+            except CONNECTION_ERRORS:
+                if attempt:
+                    raise
+                logger.warning('Broken DB connection, retry', exc_info=True)
+
+    def _execute_prepared(self, cursor, name: str, args: tuple):
+        conn = cursor.connection
+        if name not in conn.prepared:
+            cursor.execute(f'prepare {name} as {self.queries[name]}')
+            conn.prepared.add(name)
+        if args:
+            cursor.execute(f'execute {name}({", ".join(["%s"] * len(args))})', args)
+        else:
+            cursor.execute(f'execute {name}')
+
+    def select(self, query: str, args: tuple = None) -> List[tuple]:
+        with QUERY_SECONDS.time(query='select'):
+            return self._run(lambda cursor: cursor.execute(query, args), fetch=True)
+
+    def select_prepared(self, name: str, *args) -> List[tuple]:
+        with QUERY_SECONDS.time(query=name):
+            return self._run(lambda cursor: self._execute_prepared(cursor, name, args), fetch=True)
+
+    def select_arrays(self, name: str, *args) -> Tuple[np.ndarray, np.ndarray]:
+        [(prices, created)] = self.select_prepared(name, *args)
+        return binary_to_arrays(prices, created)
+
+    def select_arrays_many(self, name: str, *args) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        return {
+            ticker_id: binary_to_arrays(prices, created)
+            for ticker_id, prices, created in self.select_prepared(name, *args)
         }
-        self.schema = schema,
-        self.conn = psycopg2.connect(**self.params)
-        self.execute("set timezone to 'UTC'")
 
-    def select(self, query: str) -> List[tuple]:
-        with self.conn.cursor() as cursor:
-            cursor.execute(query)
-            return cursor.fetchall()
+    def execute(self, query, args: tuple = None):
+        with QUERY_SECONDS.time(query='execute'):
+            self._run(lambda cursor: cursor.execute(query, args), fetch=False)
 
-    def execute(self, query):
-        with self.conn.cursor() as cursor:
-            cursor.execute(query)
+    def pool_stats(self) -> dict:
+        return self.pool.stats()
 
     def get_tickers(self):
-        return self.select(
-            '''\
-select ticker, id
-from data_source.ticker
-''',
-        )
+        return self.select_prepared('get_tickers')
+
+    def get_ticker_last(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Ticker ids in ascending order with their latest price and its timestamp."""
+        [(ticker_ids, prices, created)] = self.select_prepared('get_ticker_last')
+        created, prices = binary_to_arrays(prices, created)
+        return np.frombuffer(ticker_ids or b'', dtype='>i4').astype(np.int32), prices, created
+
+    def get_saved_until(self, ticker_id: int) -> Optional[datetime]:
+        """Time up to which the rows and rollups of the ticker are saved, None before its first write."""
+        try:
+            rowset = self.select_prepared('get_saved_until', ticker_id)
+        except psycopg2.errors.UndefinedTable:
+            logger.warning('Table data_source.ticker_last is missing, range tiles are not cached')
+            return None
+        return rowset[0][0] if rowset else None
+
+    def get_partitions(self):
+        return self.select_prepared('get_partitions', self.log_table)
 
     def get_update(self, ticker_id: int, ts: datetime, limit=60):
-        return self.select(
-            f'''\
-select
-    price,
-    created
-from data_source.ticker_log
-where ticker_id = {ticker_id}
-    and date_trunc('second', created) > '{ts:%Y-%m-%d %H:%M:%S}'::timestamptz
-order by created
-limit {limit}
-''',
-        )
+        return self.select_arrays('get_update', ticker_id, ts, limit)
 
-    @lru_cache(maxsize=128, typed=True)
-    def get_data_by_range(self, ticker_id: int, start: datetime, end: datetime):
-        return self.select(
-            f'''\
-select
-    price,
-    created 
-from data_source.ticker_log_part
-where ticker_id = {ticker_id}
-    and created > '{start:%Y-%m-%d %H:%M:%S}'::timestamptz
-    and created < '{end:%Y-%m-%d %H:%M:%S}'::timestamptz
-order by created
-''',
-        )
+    @staticmethod
+    def get_resolution(start: datetime, end: datetime, min_points: int = DEFAULT_MIN_POINTS) -> str:
+        span = (end - start).total_seconds()
+        for table, resolution in ROLLUPS:
+            if span / resolution >= min_points:
+                return table
+        return RAW_SOURCE
+
+    def get_data_by_range(self, ticker_id: int, start: datetime, end: datetime, min_points=DEFAULT_MIN_POINTS):
+        source = self.get_resolution(start, end, min_points)
+        return self.range_cache.get(source, RESOLUTIONS[source], ticker_id, start, end)
+
+    def get_tile(self, source: str, ticker_id: int, start: datetime, end: datetime):
+        if source != RAW_SOURCE or self.archive is None:
+            return self.select_arrays(f'get_tile_{source}', ticker_id, start, end)
+
+        parts = []
+        for part_start, part_end, path in self.archive.split(start, end):
+            if path is None:
+                parts.append(self.select_arrays(f'get_tile_{source}', ticker_id, part_start, part_end))
+            else:
+                with QUERY_SECONDS.time(query='archive'):
+                    parts.append(self.archive.read(path, ticker_id, part_start, part_end))
+        return self.concatenate(parts)
+
+    @staticmethod
+    def concatenate(parts: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([x for x, _ in parts]), np.concatenate([y for _, y in parts])
 
     def get_last_data(self, ticker_id: int, limit=300):
-        rowset = self.select(
-            f'''\
-select 
-    price, 
-    created
-from data_source.ticker_log_part
-where ticker_id = {ticker_id}
-order by created desc
-limit {limit}
-''',
-        )
-        return sorted(rowset, key=lambda r: r[1])
+        # Newest partitions first, older ones are only read while the limit is not met
+        parts = []
+        remaining = limit
+        for start, end in self.partitions.windows(utc_now()):
+            x, y = self.select_arrays('get_last_data', ticker_id, start, end, remaining)
+            parts.insert(0, (x, y))
+            remaining -= len(x)
+            if remaining <= 0:
+                break
+        return self.concatenate(parts)
+
+    def get_last_data_many(self, ticker_ids: List[int], limit=300):
+        parts = {}
+        missing = dict.fromkeys(ticker_ids, limit)
+        for start, end in self.partitions.windows(utc_now()):
+            rows = self.select_arrays_many('get_last_data_many', list(missing), start, end, max(missing.values()))
+            for ticker_id, (x, y) in rows.items():
+                x, y = x[-missing[ticker_id]:], y[-missing[ticker_id]:]
+                parts.setdefault(ticker_id, []).insert(0, (x, y))
+                missing[ticker_id] -= len(x)
+                if missing[ticker_id] <= 0:
+                    del missing[ticker_id]
+            if not missing:
+                break
+        return {ticker_id: self.concatenate(ticker_parts) for ticker_id, ticker_parts in parts.items()}
+
+    def get_update_many(self, ticker_ids: List[int], since: List[datetime], limit=60):
+        # Each ticker from its own last timestamp, at most limit rows. The oldest one bounds
+        # every ticker too, so partitions before it are pruned when the query starts
+        since = list(since)
+        return self.select_arrays_many('get_update_many', list(ticker_ids), since, limit, min(since))
 
     def get_date_range(self, ticker_id, limit=24):
-        rowset = self.select(
-            f'''\
-select
-    date_trunc('hours', created) as ts
-from data_source.ticker_log_part
-where ticker_id = {ticker_id}
-group by date_trunc('hours', created)
-order by ts
-limit {limit}
-''',
-        )
+        rowset = self.select_prepared('get_date_range', ticker_id, limit)
         return [r[0] for r in rowset]
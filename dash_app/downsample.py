@@ -0,0 +1,98 @@
+__all__ = [
+    'DOWNSAMPLERS',
+    'binary_to_arrays',
+    'downsample',
+    'lttb',
+    'minmax',
+]
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Timestamps are sent by Postgres as microseconds since 2000-01-01
+PG_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+
+
+def binary_to_arrays(prices: Optional[bytes], created: Optional[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert big-endian float8 and timestamptz binary columns into datetime64[us] x and float64 y arrays."""
+    if prices is None:
+        return np.empty(0, dtype='datetime64[us]'), np.empty(0, dtype=np.float64)
+    x = np.frombuffer(created, dtype='>i8').astype(np.int64).view('timedelta64[us]') + PG_EPOCH
+    return x, np.frombuffer(prices, dtype='>f8').astype(np.float64)
+
+
+def _bucket_edges(n: int, threshold: int) -> np.ndarray:
+    # First and last points are kept as is, the rest is split into equal buckets
+    return np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of points selected by Largest-Triangle-Three-Buckets."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    xf = x.astype(np.int64).astype(np.float64) if x.dtype.kind == 'M' else x.astype(np.float64)
+    yf = y.astype(np.float64)
+    edges = _bucket_edges(n, threshold)
+    starts, ends = edges[:-1], edges[1:]
+
+    # Averages of every bucket, used as the third vertex of the triangle
+    counts = ends - starts
+    x_sum = np.add.reduceat(xf[:-1], starts)
+    y_sum = np.add.reduceat(yf[:-1], starts)
+    avg_x = np.r_[x_sum / counts, xf[-1]]
+    avg_y = np.r_[y_sum / counts, yf[-1]]
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        bx = xf[start:end]
+        by = yf[start:end]
+        area = np.abs(
+            (xf[a] - avg_x[i + 1]) * (by - yf[a]) - (xf[a] - bx) * (avg_y[i + 1] - yf[a])
+        )
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of the min and max point of every bucket, in x order."""
+    n = len(x)
+    if threshold >= n or threshold < 4:
+        return np.arange(n)
+
+    inner = y[1:-1].astype(np.float64)
+    n_buckets = (threshold - 2) // 2
+    bucket_size = -(-len(inner) // n_buckets)
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:len(inner)] = inner
+    buckets = padded.reshape(n_buckets, bucket_size)
+
+    offsets = np.arange(n_buckets) * bucket_size + 1
+    # The last bucket may be all padding when the split is uneven
+    valid = ~np.isnan(buckets).all(axis=1)
+    buckets, offsets = buckets[valid], offsets[valid]
+    idx = np.concatenate([
+        [0],
+        offsets + np.nanargmin(buckets, axis=1),
+        offsets + np.nanargmax(buckets, axis=1),
+        [n - 1],
+    ])
+    return np.unique(idx)
+
+
+DOWNSAMPLERS = {
+    'lttb': lttb,
+    'minmax': minmax,
+}
+
+
+def downsample(x: np.ndarray, y: np.ndarray, threshold: int, method: str = 'lttb') -> Tuple[np.ndarray, np.ndarray]:
+    if len(x) <= threshold:
+        return x, y
+    idx = DOWNSAMPLERS[method](x, y, threshold)
+    return x[idx], y[idx]
@@ -0,0 +1,100 @@
+__all__ = [
+    'Broadcaster',
+    'TickListener',
+]
+
+import json
+import logging
+import queue
+import select
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster:
+    """Fans events out to every subscribed client queue."""
+
+    def __init__(self, max_queue: int = 16):
+        self.max_queue = max_queue
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    @contextmanager
+    def subscribe(self):
+        events = queue.Queue(maxsize=self.max_queue)
+        with self.lock:
+            self.subscribers.add(events)
+        try:
+            yield events
+        finally:
+            with self.lock:
+                self.subscribers.discard(events)
+
+    def publish(self, event: dict):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                # A slow client only needs the latest event
+                try:
+                    events.get_nowait()
+                except queue.Empty:
+                    pass
+                events.put_nowait(event)
+
+
+class TickListener(threading.Thread):
+    """Single LISTEN connection of the dash process."""
+
+    def __init__(self, params: dict, channel: str, on_tick: Callable[[dict], None], reconnect_delay: float = 5):
+        super().__init__(name='tick-listener', daemon=True)
+        self.params = {k: v for k, v in params.items() if k != 'connection_factory'}
+        self.channel = channel
+        self.on_tick = on_tick
+        self.reconnect_delay = reconnect_delay
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.listen()
+            except psycopg2.Error:
+                logger.exception(f'Listener of {self.channel} failed, reconnect in {self.reconnect_delay} sec')
+                self.stopping.wait(self.reconnect_delay)
+
+    def listen(self):
+        conn = psycopg2.connect(**self.params)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'listen {self.channel}')
+            logger.info(f'Listen to {self.channel}')
+
+            while not self.stopping.is_set():
+                if select.select([conn], [], [], 1)[0] == []:
+                    continue
+                conn.poll()
+                if not conn.notifies:
+                    continue
+                # Several batches may be pending, only the latest one matters
+                payload = conn.notifies[-1].payload
+                conn.notifies.clear()
+                try:
+                    self.on_tick(json.loads(payload))
+                except Exception:
+                    logger.exception('Error in tick handler')
+        finally:
+            conn.close()
@@ -0,0 +1,104 @@
+__all__ = [
+    'MarketOverview',
+    'sparkline',
+]
+
+import logging
+import threading
+from time import monotonic
+from typing import List, Optional, Tuple
+
+import numpy as np
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+SPARK_CHARS = np.array(list('▁▂▃▄▅▆▇█'))
+
+
+def sparkline(history: np.ndarray) -> List[str]:
+    """One block character per price of every row, scaled between the row's min and max.
+
+    Rows are oldest first, the missing prices before the first one are NaN.
+    """
+    missing = np.isnan(history)
+    low = np.nanmin(history, axis=1, keepdims=True)
+    high = np.nanmax(history, axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        levels = (history - low) / (high - low) * (len(SPARK_CHARS) - 1)
+    chars = SPARK_CHARS[np.nan_to_num(levels).round().astype(np.int64)]
+    return [''.join(row[~row_missing]) for row, row_missing in zip(chars, missing)]
+
+
+class MarketOverview:
+    """Latest price of every ticker, shared by every session of the dash process.
+
+    The ticker_last table is read with one query at most once per
+    `min_refresh` seconds, whatever the number of tickers and viewers. The
+    prices of the last `points` reads that brought new prices are kept
+    for sparklines, and change is measured over them.
+    """
+
+    def __init__(self, db, *, points: int = 60, min_refresh: float = 0.5):
+        self.db = db
+        self.points = points
+        self.min_refresh = min_refresh
+        self.ticker_ids = np.empty(0, dtype=np.int32)
+        # (tickers, points), newest prices last
+        self.history = np.empty((0, points), dtype=np.float64)
+        self.last_created: Optional[np.datetime64] = None
+        self.state = self._state(np.empty(0, dtype='datetime64[us]'))
+        self.refreshed = None
+        self.lock = threading.Lock()
+
+    def page(self, sort_by: str, descending: bool, page: int, page_size: int) -> Tuple[dict, int]:
+        """One page of tickers sorted by ticker_id, price, change or created, and the number of tickers.
+
+        Rows are arrays by column, with the sparkline of every ticker in `trend`.
+        """
+        with self.lock:
+            now = monotonic()
+            if self.refreshed is None or now - self.refreshed >= self.min_refresh:
+                self._refresh()
+                self.refreshed = now
+
+            state = self.state
+            order = np.argsort(state.get(sort_by, state['ticker_id']), kind='stable')
+            if descending:
+                order = order[::-1]
+            positions = order[page * page_size:(page + 1) * page_size]
+            rows = {column: values[positions] for column, values in state.items()}
+            rows['trend'] = sparkline(self.history[positions])
+            return rows, len(order)
+
+    def _refresh(self):
+        try:
+            ticker_ids, prices, created = self.db.get_ticker_last()
+        except psycopg2.errors.UndefinedTable:
+            logger.warning('Table data_source.ticker_last is missing, create it from install.sql')
+            return
+        if not np.array_equal(ticker_ids, self.ticker_ids):
+            # Tickers were added or removed, keep the history of the others
+            history = np.full((len(ticker_ids), self.points), np.nan)
+            _, old, new = np.intersect1d(self.ticker_ids, ticker_ids, assume_unique=True, return_indices=True)
+            history[new] = self.history[old]
+            self.ticker_ids, self.history = ticker_ids, history
+        elif not len(created) or created.max() == self.last_created:
+            return
+
+        self.history[:, :-1] = self.history[:, 1:]
+        self.history[:, -1] = prices
+        self.last_created = created.max() if len(created) else None
+        self.state = self._state(created)
+        logger.debug(f'Market overview of {len(ticker_ids)} tickers refreshed')
+
+    def _state(self, created: np.ndarray) -> dict:
+        # Change since the oldest kept price of each ticker
+        first = np.argmax(~np.isnan(self.history), axis=1)
+        price = self.history[:, -1].copy()
+        return {
+            'ticker_id': self.ticker_ids,
+            'price': price,
+            'change': price - self.history[np.arange(len(first)), first],
+            'created': created,
+        }
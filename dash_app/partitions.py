@@ -0,0 +1,70 @@
+__all__ = [
+    'FAR_FUTURE',
+    'FAR_PAST',
+    'PartitionCatalog',
+]
+
+import logging
+import threading
+from bisect import bisect_right
+from datetime import datetime, timezone
+from time import monotonic
+from typing import Callable, List, Tuple
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+# Open bounds of read windows, Postgres compares them with any timestamptz
+FAR_PAST = datetime(1, 1, 1, tzinfo=timezone.utc)
+FAR_FUTURE = datetime(9999, 12, 31, tzinfo=timezone.utc)
+
+
+class PartitionCatalog:
+    """Starts of the log table partitions, as listed by the partition_catalog view.
+
+    `windows` cuts time into ranges read newest first: the partition holding
+    now with everything after it, then groups of older partitions twice as
+    large as the previous one. Reads of the last rows stop at the first
+    windows that hold enough of them, and Postgres prunes the partitions
+    outside a window. The windows cover all time, so a partition missing
+    from a stale catalog is still read.
+    """
+
+    def __init__(self, load: Callable[[], List[tuple]], refresh_interval: float = 10.0):
+        self.load = load
+        self.refresh_interval = refresh_interval
+        self.starts: List[datetime] = []
+        self.loaded = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        now = monotonic()
+        if self.loaded is not None and now - self.loaded < self.refresh_interval:
+            return
+        try:
+            starts = sorted(start for start, _ in self.load())
+        except psycopg2.errors.UndefinedTable:
+            logger.warning('View data_source.partition_catalog is missing, reads are not routed by partition')
+            starts = []
+        with self.lock:
+            self.starts = starts
+            self.loaded = now
+
+    def windows(self, now: datetime) -> List[Tuple[datetime, datetime]]:
+        self.refresh()
+        with self.lock:
+            starts = self.starts
+
+        current = bisect_right(starts, now) - 1
+        if current <= 0:
+            return [(FAR_PAST, FAR_FUTURE)]
+
+        windows = [(starts[current], FAR_FUTURE)]
+        size = 1
+        while current > 0:
+            current -= size
+            lower = starts[current] if current > 0 else FAR_PAST
+            windows.append((lower, windows[-1][0]))
+            size *= 2
+        return windows
@@ -0,0 +1,163 @@
+__all__ = [
+    'ConnectionPool',
+    'PoolTimeoutError',
+]
+
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import monotonic
+from typing import Callable
+
+import psycopg2
+
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Errors after which a connection can't be trusted anymore
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+ACQUIRE_SECONDS = REGISTRY.histogram('dash_pool_acquire_seconds', 'Wait for a free DB connection')
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Blocking psycopg2 connection pool for the threaded Flask server."""
+
+    def __init__(
+            self,
+            params: dict,
+            *,
+            min_size: int = 1,
+            max_size: int = 10,
+            timeout: float = 5.0,
+            connect: Callable = psycopg2.connect,
+    ):
+        if not 0 <= min_size <= max_size:
+            raise ValueError(f'Invalid pool size min={min_size} max={max_size}')
+        self.params = params
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle = deque()
+        self.size = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.cond = threading.Condition()
+
+        self.acquired = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+        for _ in range(min_size):
+            self.idle.append(self._connect())
+            self.size += 1
+
+    def _connect(self):
+        conn = self.connect(**self.params)
+        conn.autocommit = True
+        return conn
+
+    def getconn(self, timeout: float = None):
+        timeout = self.timeout if timeout is None else timeout
+        t1 = monotonic()
+        deadline = t1 + timeout
+        conn = None
+        with self.cond:
+            self.waiting += 1
+            try:
+                while True:
+                    if self.idle:
+                        conn = self.idle.pop()
+                        break
+                    if self.size < self.max_size:
+                        # Reserve a slot, the connection is opened outside of the lock
+                        self.size += 1
+                        break
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeoutError(f'No free connection in {timeout} sec, pool size {self.max_size}')
+                    self.cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            wait = monotonic() - t1
+            self.in_use += 1
+            self.acquired += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if conn is not None and conn.closed:
+                # Closed while idle, its slot goes to a new connection
+                self.discarded += 1
+                conn = None
+        ACQUIRE_SECONDS.observe(wait)
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self.cond:
+                    self.size -= 1
+                    self.in_use -= 1
+                    self.cond.notify()
+                raise
+        return conn
+
+    def putconn(self, conn, discard: bool = False):
+        discard = discard or bool(conn.closed)
+        with self.cond:
+            self.in_use -= 1
+            if discard:
+                self.size -= 1
+                self.discarded += 1
+            else:
+                self.idle.append(conn)
+            self.cond.notify()
+        if discard and not conn.closed:
+            conn.close()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        conn = self.getconn(timeout)
+        discard = False
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            discard = True
+            # Usually a server restart, so idle connections are broken too
+            self.close()
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                'size': self.size,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+                'waiting': self.waiting,
+                'acquired': self.acquired,
+                'timeouts': self.timeouts,
+                'discarded': self.discarded,
+                'wait_total': self.wait_total,
+                'wait_max': self.wait_max,
+                'wait_avg': self.wait_total / self.acquired if self.acquired else 0.0,
+            }
+
+    def close(self):
+        with self.cond:
+            while self.idle:
+                self.idle.pop().close()
+                self.size -= 1
+                self.discarded += 1
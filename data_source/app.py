@@ -3,15 +3,42 @@ __all__ = ['App']
 import asyncio
 import logging
 import typing
-from datetime import timedelta
+from datetime import datetime, timedelta
 from time import monotonic
-from typing import List
-from collections import defaultdict
+from typing import List, Optional
+
+import numpy as np
+
 from data_source.db import DataBase
-from utils.helpers import generate_movement, get_partition_info, utc_now
+from data_source.generator import create_generator
+from data_source.rollup import ROLLUPS, OhlcRollup
+from data_source.writer import BACKPRESSURE_BLOCK, WriteBehind
+from utils.archive import archive_path, require_pyarrow, write_partition
+from utils.helpers import get_next_partitions, get_tick_timestamps, seconds_to_us, utc_now
+from utils.metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
+# Upper bound of rows generated and copied at once during backfill
+BACKFILL_BLOCK_ROWS = 1_000_000
+
+RETENTION_DROP = 'drop'
+RETENTION_DETACH = 'detach'
+# Exported to partition_archive_dir, then dropped
+RETENTION_ARCHIVE = 'archive'
+RETENTION_ACTIONS = (RETENTION_DROP, RETENTION_DETACH, RETENTION_ARCHIVE)
+
+# Seconds given to the writer to save queued batches on stop
+WRITE_FLUSH_TIMEOUT = 10
+# Settings applied by set_config on SIGHUP, the others need a restart
+RELOADABLE_SETTINGS = ('partition_retention', 'partition_check_interval', 'rollup_flush_interval')
+
+GENERATION_SECONDS = REGISTRY.histogram('data_source_generation_seconds', 'Time to generate a block of prices')
+TICK_DRIFT_SECONDS = REGISTRY.histogram(
+    'data_source_tick_drift_seconds',
+    'How late the generation loop woke up compared to its schedule',
+)
+
 
 class App:
     def __init__(
@@ -20,42 +47,102 @@ class App:
             name: str,
             ticker_range: List[int],
             db_config: dict,
-            insert_interval: int,
+            insert_interval: float,
             generate_historical_data: bool,
             historical_timedelta: int,
+            insert_flush_interval: float = 0.1,
+            historical_interval: Optional[float] = None,
+            resume_from_checkpoint: bool = True,
+            generator: str = 'numpy',
+            generator_seed: Optional[int] = None,
+            partition_precreate: int = 3,
+            partition_retention: Optional[int] = None,
+            partition_retention_action: str = RETENTION_DROP,
+            partition_check_interval: int = 60,
+            partition_archive_dir: Optional[str] = None,
+            rollup_flush_interval: int = 10,
+            shard: Optional[int] = None,
+            write_queue_size: int = 60,
+            write_max_batch: int = 10,
+            write_connections: int = 2,
+            write_backpressure: str = BACKPRESSURE_BLOCK,
     ):
-        self.name = name
+        self.name = name if shard is None else f'{name} #{shard}'
+        # Shards only own their ticker range, the rest is handled by the supervisor or shard 0
+        self.shard = shard
         self.generate_historical_data = generate_historical_data
         self.historical_timedelta = historical_timedelta
         self.db_pool_size = db_config.pop('db_pool_size')
         self.tickers = [f'ticker_{n}' for n in range(*ticker_range)]
+        # Ticks of every ticker are insert_interval apart, and are generated and queued
+        # together once per flush interval when they are more frequent than that
         self.insert_interval = insert_interval
+        self.flush_interval = max(insert_interval, insert_flush_interval)
+        self.historical_interval = historical_interval or insert_interval
+        # Prices restart from ticker_last, and only the ticks missed while stopped are backfilled
+        self.resume_from_checkpoint = resume_from_checkpoint
+        self.checkpoint: Optional[datetime] = None
+        for key, value in (('insert_interval', insert_interval), ('historical_interval', self.historical_interval)):
+            if seconds_to_us(value) < 1:
+                raise ValueError(f'{key} must be at least a microsecond, got {value}')
+        self.generator_kind = generator
+        self.generator_seed = generator_seed
+        if generator_seed is not None and shard is not None:
+            self.generator_seed = generator_seed + shard
+        if partition_retention_action not in RETENTION_ACTIONS:
+            raise ValueError(
+                f'Unknown partition_retention_action {partition_retention_action!r}, '
+                f'expected one of {RETENTION_ACTIONS}'
+            )
+        if partition_retention_action == RETENTION_ARCHIVE:
+            if not partition_archive_dir:
+                raise ValueError('partition_archive_dir is required by partition_retention_action archive')
+            require_pyarrow()
+        self.partition_precreate = partition_precreate
+        self.partition_retention = partition_retention
+        self.partition_retention_action = partition_retention_action
+        self.partition_check_interval = partition_check_interval
+        self.partition_archive_dir = partition_archive_dir
+        self.rollup_flush_interval = rollup_flush_interval
+        self.rollups = [OhlcRollup(table, resolution) for table, resolution in ROLLUPS]
+        self.next_rollup_flush = 0
+        # Both are configured in seconds of generated prices
+        self.writer_config = {
+            'queue_size': max(1, round(write_queue_size / self.flush_interval)),
+            'max_batch': max(1, round(write_max_batch / insert_interval)),
+            'connections': write_connections,
+            'backpressure': write_backpressure,
+        }
+        self.writer = None
+        self.writer_task = None
 
-        self.db = DataBase(name, **db_config)
+        self.db = DataBase(self.name, **db_config)
         self.stopping = asyncio.Event()
         self.stopped = asyncio.Event()
         self.ticker_map = {}
-        self.ticker_price = {}
+        self.ticker_ids = np.empty(0, dtype=np.int32)
+        self.ticker_price = np.empty(0, dtype=np.int64)
+        self.generator = None
         self.tasks = []
 
-        self.scheduled_tasks = [
-            self.insert_data,
-            self.drop_old_partition,
-        ]
+        self.scheduled_tasks = [self.insert_data]
+        if not shard:
+            self.scheduled_tasks.append(self.maintain_partitions)
 
     def stop(self):
         self.stopping.set()
 
+    def set_config(self, **config):
+        for key in RELOADABLE_SETTINGS:
+            if key in config and config[key] != getattr(self, key):
+                logger.info(f'Reload {key}: {getattr(self, key)} -> {config[key]}')
+                setattr(self, key, config[key])
+
     async def wait_stopped(self):
         await self.stopped.wait()
 
     async def run(self):
-        await self.db.create_conn_pool(max_size=self.db_pool_size)
-
-        self.ticker_map = await self.db.sync_tickers(self.tickers)
-        self.ticker_price = {
-            ticker: 0 for ticker in self.ticker_map.keys()
-        }
+        await self.setup()
 
         self.tasks.extend([
             asyncio.create_task(self._create_task(task()))
@@ -64,12 +151,57 @@ class App:
 
         await self.stopping.wait()
 
-        await self.db.pool_close()
+        await self.shutdown()
+
+        self.stopped.set()
+
+    async def setup(self):
+        await self.db.create_conn_pool(max_size=self.db_pool_size)
+        await self.db.load_partitions()
+
+        self.ticker_map = await self.db.sync_tickers(self.tickers, delete_stale=self.shard is None)
+        self.ticker_ids = np.array([self.ticker_map[ticker] for ticker in self.tickers], dtype=np.int32)
+        self.generator = create_generator(
+            self.generator_kind,
+            len(self.tickers),
+            seed=self.generator_seed,
+        )
+        # Indexed by ticker slot, updated in place by the generator
+        self.ticker_price = self.generator.prices
+        if self.resume_from_checkpoint:
+            self.checkpoint = await self.load_checkpoint()
+        self.writer = WriteBehind(self.db, self.ticker_ids, on_saved=self.on_batch_saved, **self.writer_config)
+        self.writer_task = asyncio.create_task(self._create_task(self.writer.run()))
 
+    async def shutdown(self):
         for task in self.tasks:
             task.cancel()
 
-        self.stopped.set()
+        if not self.writer_task.done():
+            await self.writer.flush(WRITE_FLUSH_TIMEOUT)
+        self.writer_task.cancel()
+
+        await self.db.pool_close()
+
+    async def load_checkpoint(self) -> Optional[datetime]:
+        """Set the prices saved by the previous run, returns when they were saved or None without any."""
+        checkpoint = await self.db.load_last(self.ticker_ids)
+        if not checkpoint:
+            return None
+        for slot, ticker_id in enumerate(self.ticker_ids.tolist()):
+            if ticker_id in checkpoint:
+                self.ticker_price[slot] = checkpoint[ticker_id][0]
+        # Tickers are saved together, a ticker added since then starts from 0
+        saved = min(created for _, created in checkpoint.values())
+        logger.info(f'Resume {len(checkpoint)} of {len(self.tickers)} tickers from prices saved at {saved}')
+        return saved
+
+    def get_backfill_start(self, now: datetime) -> datetime:
+        start = (now - timedelta(hours=self.historical_timedelta)).replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.checkpoint is None:
+            return start
+        # History up to the checkpoint is already saved
+        return max(start, self.checkpoint + timedelta(microseconds=seconds_to_us(self.historical_interval)))
 
     async def _create_task(self, task):
         try:
@@ -84,77 +216,147 @@ class App:
 
     async def insert_data(self):
         if self.generate_historical_data:
-            await self.insert_historical_data()
+            now = utc_now()
+            start = self.get_backfill_start(now)
+            if start <= now:
+                await self.insert_historical_data(start, now)
 
-        next_loop = monotonic() + self.insert_interval
+        interval_us = seconds_to_us(self.insert_interval)
+        flush_us = seconds_to_us(self.flush_interval)
+        # Ticks a flush window holds when the loop keeps up
+        window_steps = -(-flush_us // interval_us)
+        # Tick n is due at origin + n * insert_interval, both clocks are read once so the schedule does not drift
+        origin, origin_mono = utc_now(), monotonic()
+        tick = 0
+        window = 0
         while True:
             t1 = monotonic()
-            now = utc_now()
-            log_data = []
-            for ticker in self.tickers:
-                new_price = self.ticker_price[ticker] + generate_movement()
-                log_data.append((self.ticker_map[ticker], new_price, now))
-                self.ticker_price[ticker] = new_price
-
-            tab_name, ts_constraint_start, ts_constraint_end = get_partition_info(now)
-            await self.db.save_tick(
-                data=log_data,
-                tab_name=tab_name,
-                ts_constraint_start=ts_constraint_start,
-                ts_constraint_end=ts_constraint_end,
-            )
+            TICK_DRIFT_SECONDS.observe(max(0.0, t1 - origin_mono - window * flush_us / 1_000_000))
+            # Ticks missed while the queue held the loop back are generated, not skipped
+            elapsed_us = max(window * flush_us, int((t1 - origin_mono) * 1_000_000))
+            due = elapsed_us // interval_us + 1
+            steps = due - tick
+            # Wakeup jitter adds a tick or two to a window, only a whole window behind is worth a warning
+            if (steps - window_steps) * interval_us >= flush_us:
+                logger.warning(f'Generation is {steps - window_steps} steps behind, catch up')
+            timestamps = get_tick_timestamps(origin, tick, steps, interval_us)
+            with GENERATION_SECONDS.time():
+                block = self.generator.advance(steps)
+            tick = due
+
+            # One batch per flush window, the writer saves it with a single COPY per partition
+            await self.writer.put(timestamps, block)
 
             t2 = monotonic()
-            logger.debug(f'Save {len(self.tickers)} prices , {t2 - t1} sec')
+            logger.debug(f'Queue {steps} x {len(self.tickers)} prices , {t2 - t1} sec')
 
-            if next_loop > t1:
-                delay = next_loop - t1
-                next_loop += self.insert_interval
+            window = max(window + 1, int((t2 - origin_mono) * 1_000_000) // flush_us + 1)
+            delay = origin_mono + window * flush_us / 1_000_000 - monotonic()
+            if delay > 0:
                 logger.debug(f'Sleep: {delay}sec')
                 await asyncio.sleep(delay)
             else:
-                next_loop = t1 + self.insert_interval
                 await asyncio.sleep(0)
 
-    async def insert_historical_data(self):
-        logger.info('Start to insert daily data')
+    async def insert_historical_data(self, start: Optional[datetime] = None, end: Optional[datetime] = None):
         t1 = monotonic()
 
-        now = utc_now()
-        start = (now - timedelta(hours=self.historical_timedelta)).replace(hour=0, minute=0, second=0, microsecond=0)
-        end = now
-
-        rowset = await self.db.get_intervals(start, end)
-
-        data = defaultdict(list)
-        constraints = defaultdict(dict)
-        for i, row in enumerate(rowset):
-            ts = row['ts']
-            tab_name, ts_constraint_start, ts_constraint_end = get_partition_info(ts)
-            constraints[tab_name]['ts_constraint_start'] = ts_constraint_start
-            constraints[tab_name]['ts_constraint_end'] = ts_constraint_end
-
-            if i % 3600 == 0:
-                logger.info(f'Calc ts -> {ts}')
-
-            for ticker in self.tickers:
-                new_price = self.ticker_price[ticker] + generate_movement()
-                data[tab_name].append((self.ticker_map[ticker], new_price, ts))
-                self.ticker_price[ticker] = new_price
-
-        for tab_name, log_data in data.items():
-            ts_constraint_start = constraints[tab_name]['ts_constraint_start']
-            ts_constraint_end = constraints[tab_name]['ts_constraint_end']
-            await self.db.save_tick(
-                data=log_data,
-                tab_name=tab_name,
-                ts_constraint_start=ts_constraint_start,
-                ts_constraint_end=ts_constraint_end,
-            )
-            logger.info(f'Insert data into {tab_name}')
+        if start is None:
+            end = utc_now()
+            start = self.get_backfill_start(end)
+        logger.info(f'Start to insert daily data from {start} to {end}')
+
+        interval_us = seconds_to_us(self.historical_interval)
+        total = (end - start) // timedelta(microseconds=interval_us) + 1
+        chunk_size = max(1, BACKFILL_BLOCK_ROWS // max(1, len(self.tickers)))
+
+        for i in range(0, total, chunk_size):
+            chunk = get_tick_timestamps(start, i, min(chunk_size, total - i), interval_us)
+            logger.info(f'Calc ts -> {chunk[0]}')
+            # History is never dropped, whatever the backpressure mode
+            await self.writer.put(chunk, self.generator.advance(len(chunk)), wait=True)
+        await self.writer.join()
 
         t2 = monotonic()
         logger.info(f'Insert daily data: {t2 - t1}')
 
-    async def drop_old_partition(self):
-        pass
+    async def on_batch_saved(self, timestamps: list, block: np.ndarray):
+        # Called by the writer in time order, once the rows are saved
+        now = monotonic()
+        flush = now >= self.next_rollup_flush
+        if flush:
+            self.next_rollup_flush = now + self.rollup_flush_interval
+        await self.update_rollups(timestamps, block, flush=flush)
+        # Last, dashboards cache range tiles which end before it
+        await self.db.save_last(self.ticker_ids, timestamps[-1], block[-1])
+
+    async def update_rollups(self, timestamps: list, block: np.ndarray, flush: bool = False):
+        epoch = np.array([ts.timestamp() for ts in timestamps], dtype=np.int64)
+        for rollup in self.rollups:
+            aggregates = rollup.update(epoch, block) if len(epoch) else []
+            if flush and rollup.current():
+                aggregates.append(rollup.current())
+            await self.db.save_ohlc(rollup.table, self.ticker_ids, aggregates)
+
+    async def maintain_partitions(self):
+        while True:
+            t1 = monotonic()
+            now = utc_now()
+            created = await self.create_next_partitions(now)
+            removed = await self.remove_old_partitions(now)
+            t2 = monotonic()
+            logger.info(
+                f'Partition maintenance: created {len(created)}, '
+                f'{self.partition_retention_action} {len(removed)}, {t2 - t1} sec'
+            )
+            await asyncio.sleep(self.partition_check_interval)
+
+    async def create_next_partitions(self, now) -> list:
+        created = []
+        next_partitions = get_next_partitions(
+            now,
+            self.partition_precreate,
+            self.db.partition_prefix,
+            self.db.partition_granularity,
+        )
+        for _, next_start, _ in next_partitions:
+            # Ranges already held by partitions of a previous granularity are not created again
+            tab_name, ts_constraint_start, ts_constraint_end = self.db.route_partition(next_start)
+            if await self.db.ensure_partition(tab_name, ts_constraint_start, ts_constraint_end):
+                created.append(tab_name)
+                logger.info(f'Pre-created partition {tab_name}')
+        return created
+
+    async def remove_old_partitions(self, now) -> list:
+        if self.partition_retention is None:
+            return []
+
+        removed = []
+        threshold = now - timedelta(hours=self.partition_retention)
+        catalog = await self.db.load_partitions()
+        for tab_name, (_, ts_constraint_end) in sorted(catalog.items(), key=lambda item: item[1]):
+            if ts_constraint_end > threshold:
+                continue
+
+            t1 = monotonic()
+            if self.partition_retention_action == RETENTION_ARCHIVE:
+                # Exported while still attached, so a failed export is retried on the next check
+                await self.archive_partition(tab_name)
+            await self.db.detach_partition(tab_name)
+            if self.partition_retention_action in (RETENTION_DROP, RETENTION_ARCHIVE):
+                await self.db.drop_partition(tab_name)
+            removed.append(tab_name)
+            logger.info(f'Partition {tab_name}: {self.partition_retention_action}, {monotonic() - t1} sec')
+        return removed
+
+    async def archive_partition(self, tab_name: str):
+        t1 = monotonic()
+        data = await self.db.export_partition(tab_name)
+        t2 = monotonic()
+        path = archive_path(self.partition_archive_dir, tab_name)
+        # Sorting and compressing an hour of ticks takes seconds, keep it off the event loop
+        rows = await asyncio.get_running_loop().run_in_executor(None, write_partition, path, data)
+        logger.info(
+            f'Archived {tab_name} to {path}: {rows} rows, {len(data)} bytes exported in {t2 - t1} sec, '
+            f'written in {monotonic() - t2} sec'
+        )
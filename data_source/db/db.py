@@ -1,130 +1,467 @@
+import asyncio
+import json
 import logging
-from typing import List
-from time import monotonic
-from data_source.db.postgres import PostgresDB
+from contextlib import asynccontextmanager
 from datetime import datetime
+from time import monotonic, perf_counter
+from typing import Dict, List, Tuple
+
+import asyncpg
+import numpy as np
+
+from data_source.db.postgres import PostgresDB
+from data_source.generator import to_packed_records, to_records
+from utils.helpers import PARTITION_HOUR, check_granularity, find_partition
+from utils.metrics import REGISTRY
+from utils.storage import (
+    LAYOUT_FLOAT8,
+    LAYOUT_INT8,
+    LAYOUT_NUMERIC,
+    LAYOUT_PACKED,
+    LOG_COLUMNS,
+    get_log_table,
+    get_partition_prefix,
+)
 
 logger = logging.getLogger(__name__)
 
+SAVE_MODE_DIRECT = 'direct'
+SAVE_MODE_TEMP = 'temp'
+SAVE_MODES = (SAVE_MODE_DIRECT, SAVE_MODE_TEMP)
+
+STATEMENT_SECONDS = REGISTRY.histogram(
+    'data_source_statement_seconds',
+    'Duration of the statements issued on the write path and by partition maintenance',
+    ['statement'],
+)
+POOL_ACQUIRE_SECONDS = REGISTRY.histogram(
+    'data_source_pool_acquire_seconds',
+    'Wait for a pool connection on the write path',
+)
+ROWS_SAVED = REGISTRY.counter('data_source_rows_saved_total', 'Rows copied into the ticker log')
+
+# Columns of the temp table used by SAVE_MODE_TEMP, by storage layout
+TEMP_TABLE_COLUMNS = {
+    LAYOUT_NUMERIC: 'ticker_id integer not null, price numeric not null, created timestamptz not null',
+    LAYOUT_INT8: 'ticker_id integer not null, price bigint not null, created timestamptz not null',
+    LAYOUT_FLOAT8: 'ticker_id integer not null, price double precision not null, created timestamptz not null',
+    LAYOUT_PACKED: 'first_id integer not null, prices bigint[] not null, created timestamptz not null',
+}
+
+# CSV export of a partition as (ticker_id, price, created in epoch microseconds), see utils.archive
+ROW_EXPORT_QUERY = '''\
+select
+    ticker_id,
+    price::float8,
+    (extract(epoch from created) * 1000000)::int8
+from {tab_name}
+'''
+PACKED_EXPORT_QUERY = '''\
+select
+    p.first_id + s.i - 1,
+    p.prices[s.i]::float8,
+    (extract(epoch from p.created) * 1000000)::int8
+from {tab_name} p
+cross join lateral generate_subscripts(p.prices, 1) as s(i)
+where p.prices[s.i] is not null
+'''
+
 
 class DataBase(PostgresDB):
-    def __init__(self, name, **kwargs):
+    def __init__(
+            self,
+            name,
+            *,
+            save_mode=SAVE_MODE_DIRECT,
+            notify_channel=None,
+            storage_layout=LAYOUT_NUMERIC,
+            partition_granularity=PARTITION_HOUR,
+            **kwargs,
+    ):
         super().__init__(name, timezone='UTC', **kwargs)
+        if save_mode not in SAVE_MODES:
+            raise ValueError(f'Unknown save_mode {save_mode!r}, expected one of {SAVE_MODES}')
+        self.save_mode = save_mode
+        self.notify_channel = notify_channel
+        self.storage_layout = storage_layout
+        self.log_table = get_log_table(storage_layout)
+        self.log_columns = LOG_COLUMNS[storage_layout]
+        self.partition_prefix = get_partition_prefix(storage_layout)
+        self.partition_granularity = check_granularity(partition_granularity)
+        # log_table partitions known to exist, by name and as (start, end, tab_name) sorted by start
+        self.partitions: Dict[str, Tuple[datetime, datetime]] = {}
+        self.partition_ranges: List[tuple] = []
+        self.partition_starts: List[datetime] = []
+        self.partitions_lock = asyncio.Lock()
 
     async def pool_close(self):
         await self.pool.close()
 
-    async def sync_tickers(self, tickers: List[str]) -> dict:
-        logger.info(f'Start to sync tickers')
+    async def sync_tickers(self, tickers: List[str], delete_stale: bool = True) -> dict:
+        logger.info('Start to sync tickers')
 
         t1 = monotonic()
 
-        ticker_map = {}
-
+        # Ordered and deduplicated, new tickers get their ids in this order
+        tickers = list(dict.fromkeys(tickers))
         rowset = await self.pool.fetch(
             '''\
 select id, ticker
 from ticker
 ''',
         )
+        existing = {ticker: ticker_id for ticker_id, ticker in rowset}
+        ticker_set = set(tickers)
+        ticker_need_add = [ticker for ticker in tickers if ticker not in existing]
+        ticker_need_del = [ticker_id for ticker, ticker_id in existing.items() if ticker not in ticker_set]
 
-        ticker_need_add = []
-        ticker_need_del = []
-        tickers_exists = []
+        if ticker_need_del and delete_stale:
+            # Their last prices go in the same statement, so they leave the market overview too
+            with STATEMENT_SECONDS.time(statement='delete_tickers'):
+                await self.pool.execute(
+                    '''\
+with deleted as (
+    delete from ticker
+    where id = any($1::int4[])
+)
+delete from ticker_last
+where ticker_id = any($1::int4[])
+''',
+                    ticker_need_del,
+                )
 
-        for ticker_id, ticker in rowset:
-            tickers_exists.append(ticker)
-            if ticker not in tickers:
-                ticker_need_del.append(ticker_id)
-                continue
+        ticker_map = {ticker: existing[ticker] for ticker in tickers if ticker in existing}
+        if ticker_need_add:
+            try:
+                with STATEMENT_SECONDS.time(statement='add_tickers'):
+                    ticker_map.update(await self._add_tickers(ticker_need_add))
+            except asyncpg.InvalidColumnReferenceError:
+                raise RuntimeError(
+                    f'Unique constraint on {self.schema}.ticker (ticker) is missing, add it with '
+                    f'`alter table {self.schema}.ticker add constraint ticker_ticker_key unique (ticker)`'
+                ) from None
 
-            ticker_map[ticker] = ticker_id
+        t2 = monotonic()
+        logger.info(
+            f'Done sync {t2 - t1} sec., {len(ticker_need_add)} added, '
+            f'{len(ticker_need_del) if delete_stale else 0} deleted'
+        )
 
-        for ticker in tickers:
-            if ticker not in tickers_exists:
-                ticker_need_add.append((ticker,))
+        return ticker_map
 
-        if ticker_need_del:
-            await self.pool.execute(
-                '''\
-delete from ticker
-where id = any($1)
+    async def _add_tickers(self, tickers: List[str]) -> dict:
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    '''\
+create temporary table temp_ticker
+(
+    ord    integer not null,
+    ticker varchar not null
+)
+on commit drop
 ''',
-                ticker_need_del,
-            )
-
-        if ticker_need_add:
-            await self.pool.executemany(
-                '''\
-insert into ticker (ticker)
-values ($1)
+                )
+                await conn.copy_records_to_table('temp_ticker', records=enumerate(tickers))
+                # Tickers added meanwhile by another process conflict and are read back as they are
+                rowset = await conn.fetch(
+                    '''\
+with inserted as (
+    insert into ticker (ticker)
+    select ticker
+    from temp_ticker
+    order by ord
+    on conflict (ticker) do nothing
+    returning id, ticker
+)
+select id, ticker
+from inserted
+union all
+select t.id, t.ticker
+from ticker t
+join temp_ticker tt on tt.ticker = t.ticker
 ''',
-                ticker_need_add,
-            )
+                )
+        return {ticker: ticker_id for ticker_id, ticker in rowset}
 
-        if ticker_need_add:
+    async def load_partitions(self) -> Dict[str, Tuple[datetime, datetime]]:
+        """Partitions of log_table and their bounds, from the catalog shared with dashboards."""
+        try:
             rowset = await self.pool.fetch(
                 '''\
-select id, ticker
-from ticker
-'''
+select tab_name, range_start, range_end
+from data_source.partition_catalog
+where log_table = $1
+''',
+                self.log_table,
             )
-            ticker_map = {ticker: _id for _id, ticker in rowset}
-
-        t2 = monotonic()
-        logger.info(f'Done sync {t2 - t1} sec.')
+        except asyncpg.UndefinedTableError:
+            raise RuntimeError(
+                'View data_source.partition_catalog is missing, create it from data_source/sql/install.sql'
+            ) from None
+        catalog = {row['tab_name']: (row['range_start'], row['range_end']) for row in rowset}
+        self._set_partitions(catalog)
+        logger.info(f'Found {len(self.partitions)} partitions of {self.log_table}')
+        return catalog
 
-        return ticker_map
+    def _set_partitions(self, partitions: Dict[str, Tuple[datetime, datetime]]):
+        self.partitions = partitions
+        self.partition_ranges = sorted((start, end, tab_name) for tab_name, (start, end) in partitions.items())
+        self.partition_starts = [start for start, _, _ in self.partition_ranges]
 
-    async def get_intervals(self, start: datetime, end: datetime):
-        return await self.pool.fetch(
-            '''\
-select date_trunc('second', dd):: timestamptz as ts
-from generate_series($1, $2, '1 second'::interval) dd
-''',
-            start,
-            end,
+    def route_partition(self, ts: datetime) -> tuple:
+        """(tab_name, start, end) of the partition ts is written to, an existing one when it holds ts."""
+        return find_partition(
+            ts,
+            self.partition_ranges,
+            self.partition_prefix,
+            self.partition_granularity,
+            starts=self.partition_starts,
         )
 
-    async def save_tick(
+    async def create_partition(
             self,
-            data: list,
             tab_name: str,
             ts_constraint_start: datetime,
-            ts_constraint_end: datetime
+            ts_constraint_end: datetime,
+            conn=None,
     ):
-        async with self.pool.acquire() as conn:
+        if conn is None:
+            async with self.acquire() as conn:
+                return await self.create_partition(tab_name, ts_constraint_start, ts_constraint_end, conn=conn)
+
+        with STATEMENT_SECONDS.time(statement='create_partition'):
             async with conn.transaction():
+                # Serializes creation of the same partition by several processes
+                await conn.execute('select pg_advisory_xact_lock(hashtext($1))', tab_name)
                 await conn.execute(
                     f'''\
-create table if not exists {tab_name} partition of data_source.ticker_log_part
+create table if not exists {tab_name} partition of data_source.{self.log_table}
 for values from ('{ts_constraint_start:%Y-%m-%d %H:%M:%S}') TO ('{ts_constraint_end:%Y-%m-%d %H:%M:%S}');
 ''',
                 )
+
+    async def ensure_partition(
+            self,
+            tab_name: str,
+            ts_constraint_start: datetime,
+            ts_constraint_end: datetime,
+            conn=None,
+    ) -> bool:
+        if tab_name in self.partitions:
+            return False
+        async with self.partitions_lock:
+            if tab_name in self.partitions:
+                return False
+            await self.create_partition(tab_name, ts_constraint_start, ts_constraint_end, conn=conn)
+            self._set_partitions({**self.partitions, tab_name: (ts_constraint_start, ts_constraint_end)})
+            return True
+
+    async def detach_partition(self, tab_name: str):
+        # Concurrent detach keeps inserts into the parent table running
+        await self.pool.execute(
+            f'''\
+alter table data_source.{self.log_table} detach partition {tab_name} concurrently
+''',
+        )
+        self._forget_partition(tab_name)
+
+    async def drop_partition(self, tab_name: str):
+        await self.pool.execute(
+            f'''\
+drop table if exists {tab_name}
+''',
+        )
+        self._forget_partition(tab_name)
+
+    def _forget_partition(self, tab_name: str):
+        if tab_name in self.partitions:
+            self._set_partitions({name: bounds for name, bounds in self.partitions.items() if name != tab_name})
+
+    async def export_partition(self, tab_name: str) -> bytes:
+        query = PACKED_EXPORT_QUERY if self.storage_layout == LAYOUT_PACKED else ROW_EXPORT_QUERY
+        chunks = []
+
+        async def write(chunk: bytes):
+            chunks.append(chunk)
+
+        with STATEMENT_SECONDS.time(statement='export_partition'):
+            async with self.acquire() as conn:
+                await conn.copy_from_query(query.format(tab_name=tab_name), output=write, format='csv')
+        return b''.join(chunks)
+
+    @asynccontextmanager
+    async def acquire(self):
+        t1 = perf_counter()
+        async with self.pool.acquire() as conn:
+            POOL_ACQUIRE_SECONDS.observe(perf_counter() - t1)
+            yield conn
+
+    def to_records(self, ticker_ids: np.ndarray, timestamps, block: np.ndarray) -> list:
+        # Rows in the shape of log_columns, ready for save_tick
+        if self.storage_layout == LAYOUT_PACKED:
+            return to_packed_records(ticker_ids, timestamps, block)
+        return to_records(ticker_ids, timestamps, block)
+
+    async def save_tick(
+            self,
+            data: list,
+            tab_name: str,
+            ts_constraint_start: datetime,
+            ts_constraint_end: datetime,
+            notify: bool = True,
+    ):
+        if self.save_mode == SAVE_MODE_TEMP:
+            return await self.save_tick_temp(data, tab_name, ts_constraint_start, ts_constraint_end, notify)
+        return await self.save_tick_direct(data, tab_name, ts_constraint_start, ts_constraint_end, notify)
+
+    async def save_tick_direct(
+            self,
+            data: list,
+            tab_name: str,
+            ts_constraint_start: datetime,
+            ts_constraint_end: datetime,
+            notify: bool = True,
+    ):
+        async with self.acquire() as conn:
+            # DDL is only issued on a partition boundary
+            await self.ensure_partition(tab_name, ts_constraint_start, ts_constraint_end, conn=conn)
+
+            try:
+                await self._copy_to_partition(conn, tab_name, data)
+            except asyncpg.UndefinedTableError:
+                # Partition was dropped behind our back
+                logger.warning(f'Partition {tab_name} is missing, recreate it')
+                await self.create_partition(tab_name, ts_constraint_start, ts_constraint_end, conn=conn)
+                await self._copy_to_partition(conn, tab_name, data)
+
+            if notify and data:
+                await self._notify(conn, data[-1][2], len(data))
+
+    async def notify(self, ts: datetime, rows: int):
+        # For writes split over several save_tick calls with notify=False
+        if not self.notify_channel:
+            return
+        async with self.acquire() as conn:
+            await self._notify(conn, ts, rows)
+
+    async def _notify(self, conn, ts: datetime, rows: int):
+        # Sent after the batch is committed, or delivered on commit inside a transaction
+        if not self.notify_channel:
+            return
+        payload = json.dumps({
+            'ts': ts.isoformat(),
+            'rows': rows,
+        })
+        with STATEMENT_SECONDS.time(statement='notify'):
+            await conn.execute('select pg_notify($1, $2)', self.notify_channel, payload)
+
+    async def _copy_to_partition(self, conn, tab_name: str, data: list):
+        with STATEMENT_SECONDS.time(statement='copy'):
+            await conn.copy_records_to_table(
+                tab_name,
+                records=data,
+                columns=self.log_columns,
+                schema_name=self.schema,
+            )
+        ROWS_SAVED.inc(len(data))
+
+    async def save_tick_temp(
+            self,
+            data: list,
+            tab_name: str,
+            ts_constraint_start: datetime,
+            ts_constraint_end: datetime,
+            notify: bool = True,
+    ):
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await self.create_partition(tab_name, ts_constraint_start, ts_constraint_end, conn=conn)
                 await conn.execute(
-                    '''\
-create temporary table if not exists  temp_ticker_log
+                    f'''\
+create temporary table if not exists  temp_{self.log_table}
 (
-ticker_id integer not null,
-price     numeric not null,
-created   timestamptz not null
+{TEMP_TABLE_COLUMNS[self.storage_layout]}
 )
 with (fillfactor=100, oids=false)
 on commit delete rows
 ''',
                 )
-                await conn.copy_records_to_table(
-                    'temp_ticker_log',
-                    records=data,
-                )
-                await conn.execute(
-                    f'''\
-insert into {tab_name} (ticker_id, price, created)
-select 
-ticker_id,
-price,
-created
-from temp_ticker_log
+                with STATEMENT_SECONDS.time(statement='copy_temp'):
+                    await conn.copy_records_to_table(
+                        f'temp_{self.log_table}',
+                        records=data,
+                    )
+                columns = ', '.join(self.log_columns)
+                with STATEMENT_SECONDS.time(statement='insert_from_temp'):
+                    await conn.execute(
+                        f'''\
+insert into {tab_name} ({columns})
+select {columns}
+from temp_{self.log_table}
 ''',
-                )
+                    )
+                ROWS_SAVED.inc(len(data))
+                if notify and data:
+                    await self._notify(conn, data[-1][2], len(data))
 
+    async def save_last(self, ticker_ids: np.ndarray, ts: datetime, prices: np.ndarray):
+        # A write older than the stored prices, from a restarted shard or a backfill, changes nothing
+        with STATEMENT_SECONDS.time(statement='save_last'):
+            await self.pool.execute(
+                '''\
+insert into ticker_last (ticker_id, price, created)
+select ticker_id, price, $3
+from unnest($1::int4[], $2::int8[]) as t(ticker_id, price)
+on conflict (ticker_id) do update set
+    price = excluded.price,
+    created = excluded.created
+where ticker_last.created < excluded.created
+''',
+                ticker_ids.tolist(),
+                prices.tolist(),
+                ts,
+            )
+
+    async def load_last(self, ticker_ids: np.ndarray) -> Dict[int, Tuple[int, datetime]]:
+        """Last saved price and time of the tickers, the checkpoint a restart resumes from."""
+        try:
+            rowset = await self.pool.fetch(
+                '''\
+select ticker_id, price::int8 as price, created
+from ticker_last
+where ticker_id = any($1::int4[])
+''',
+                ticker_ids.tolist(),
+            )
+        except asyncpg.UndefinedTableError:
+            raise RuntimeError(
+                'Table data_source.ticker_last is missing, create it from data_source/sql/install.sql'
+            ) from None
+        return {row['ticker_id']: (row['price'], row['created']) for row in rowset}
+
+    async def save_ohlc(self, table: str, ticker_ids: np.ndarray, aggregates: List[tuple]):
+        if not aggregates:
+            return
+
+        buckets, open_, high, low, close = zip(*aggregates)
+        n_tickers = len(ticker_ids)
+        # Buckets can be re-sent while open, so merge them with what is stored
+        with STATEMENT_SECONDS.time(statement='save_ohlc'):
+            await self.pool.execute(
+                f'''\
+insert into {table} (ticker_id, bucket, open, high, low, close)
+select *
+from unnest($1::int4[], $2::timestamptz[], $3::int8[], $4::int8[], $5::int8[], $6::int8[])
+on conflict (ticker_id, bucket) do update set
+    high = greatest({table}.high, excluded.high),
+    low = least({table}.low, excluded.low),
+    close = excluded.close
+''',
+                ticker_ids.tolist() * len(aggregates),
+                [bucket for bucket in buckets for _ in range(n_tickers)],
+                np.concatenate(open_).tolist(),
+                np.concatenate(high).tolist(),
+                np.concatenate(low).tolist(),
+                np.concatenate(close).tolist(),
+            )
@@ -0,0 +1,103 @@
+__all__ = [
+    'Generator',
+    'PythonGenerator',
+    'NumpyGenerator',
+    'GENERATORS',
+    'create_generator',
+    'to_records',
+    'to_packed_records',
+]
+
+import random
+from itertools import chain, repeat
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class Generator:
+    """Random walk over a fixed set of ticker slots.
+
+    `prices` holds the current price of every slot and is updated in place,
+    so it can be shared with the owner of the generator.
+    """
+
+    def __init__(self, n_tickers: int, *, seed: Optional[int] = None, start_prices=None):
+        self.n_tickers = n_tickers
+        self.seed = seed
+        self.prices = np.zeros(n_tickers, dtype=np.int64)
+        if start_prices is not None:
+            self.prices[:] = start_prices
+
+    def movements(self, n_steps: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def advance(self, n_steps: int = 1) -> np.ndarray:
+        block = np.cumsum(self.movements(n_steps), axis=0, dtype=np.int64)
+        block += self.prices
+        self.prices[:] = block[-1]
+        return block
+
+
+class PythonGenerator(Generator):
+    # Reference implementation, one random() call per price
+    def __init__(self, n_tickers: int, *, seed: Optional[int] = None, start_prices=None):
+        super().__init__(n_tickers, seed=seed, start_prices=start_prices)
+        self.random = random.Random(seed)
+
+    def movements(self, n_steps: int) -> np.ndarray:
+        rnd = self.random.random
+        return np.array(
+            [[-1 if rnd() < 0.5 else 1 for _ in range(self.n_tickers)] for _ in range(n_steps)],
+            dtype=np.int8,
+        ).reshape(n_steps, self.n_tickers)
+
+
+class NumpyGenerator(Generator):
+    def __init__(self, n_tickers: int, *, seed: Optional[int] = None, start_prices=None):
+        super().__init__(n_tickers, seed=seed, start_prices=start_prices)
+        self.rng = np.random.default_rng(seed)
+
+    def movements(self, n_steps: int) -> np.ndarray:
+        moves = self.rng.integers(0, 2, size=(n_steps, self.n_tickers), dtype=np.int8)
+        moves <<= 1
+        moves -= 1
+        return moves
+
+
+GENERATORS = {
+    'python': PythonGenerator,
+    'numpy': NumpyGenerator,
+}
+
+
+def create_generator(kind: str, n_tickers: int, **kwargs) -> Generator:
+    try:
+        generator_class = GENERATORS[kind]
+    except KeyError:
+        raise ValueError(f'Unknown generator {kind!r}, expected one of {sorted(GENERATORS)}')
+    return generator_class(n_tickers, **kwargs)
+
+
+def to_records(ticker_ids: np.ndarray, timestamps: Sequence, block: np.ndarray) -> list:
+    """Flatten a (steps x tickers) price block into (ticker_id, price, ts) records."""
+    n_steps, n_tickers = block.shape
+    ids = ticker_ids.tolist() * n_steps
+    ts = chain.from_iterable(repeat(t, n_tickers) for t in timestamps)
+    return list(zip(ids, block.ravel().tolist(), ts))
+
+
+def to_packed_records(ticker_ids: np.ndarray, timestamps: Sequence, block: np.ndarray) -> list:
+    """Turn a (steps x tickers) price block into one (first_id, prices, ts) record per step.
+
+    `prices` is indexed by ticker_id - first_id, ids missing from `ticker_ids` are None.
+    """
+    first_id = int(ticker_ids.min())
+    span = int(ticker_ids.max()) - first_id + 1
+    if np.array_equal(ticker_ids, np.arange(first_id, first_id + span)):
+        rows = block.tolist()
+    else:
+        packed = np.full((block.shape[0], span), None, dtype=object)
+        packed[:, ticker_ids - first_id] = block
+        rows = packed.tolist()
+    return list(zip(repeat(first_id), rows, timestamps))
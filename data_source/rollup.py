@@ -0,0 +1,70 @@
+__all__ = [
+    'OhlcRollup',
+    'ROLLUPS',
+]
+
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import numpy as np
+
+# (table, bucket size in seconds)
+ROLLUPS = (
+    ('ticker_ohlc_1m', 60),
+    ('ticker_ohlc_1h', 3600),
+)
+
+
+class OhlcRollup:
+    """Incremental OHLC aggregation of (steps x tickers) price blocks.
+
+    The bucket that is still open is kept in memory: `update` returns the
+    buckets closed by a new block, `current` returns the open one.
+    Aggregates are (bucket_start, open, high, low, close) with one array
+    element per ticker slot.
+    """
+
+    def __init__(self, table: str, resolution: int):
+        self.table = table
+        self.resolution = resolution
+        self.bucket = None
+        self.state = None
+
+    def update(self, epoch: np.ndarray, block: np.ndarray) -> List[tuple]:
+        buckets = np.asarray(epoch, dtype=np.int64) // self.resolution
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(buckets)] - 1
+
+        open_ = block[starts]
+        high = np.maximum.reduceat(block, starts, axis=0)
+        low = np.minimum.reduceat(block, starts, axis=0)
+        close = block[ends]
+        buckets = buckets[starts].tolist()
+
+        closed = []
+        if self.bucket is not None:
+            if self.bucket == buckets[0]:
+                state_open, state_high, state_low, _ = self.state
+                open_[0] = state_open
+                np.maximum(high[0], state_high, out=high[0])
+                np.minimum(low[0], state_low, out=low[0])
+            else:
+                closed.append(self.current())
+
+        closed.extend(
+            self._aggregate(bucket, open_[i], high[i], low[i], close[i])
+            for i, bucket in enumerate(buckets[:-1])
+        )
+
+        self.bucket = buckets[-1]
+        self.state = (open_[-1], high[-1], low[-1], close[-1])
+        return closed
+
+    def current(self) -> Optional[tuple]:
+        if self.bucket is None:
+            return None
+        return self._aggregate(self.bucket, *self.state)
+
+    def _aggregate(self, bucket: int, open_, high, low, close) -> tuple:
+        bucket_start = datetime.fromtimestamp(bucket * self.resolution, tz=timezone.utc)
+        return bucket_start, open_, high, low, close
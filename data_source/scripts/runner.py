@@ -7,8 +7,10 @@ import signal
 import uvloop
 
 from data_source.app import App
+from data_source.supervisor import Supervisor
 from utils.reader import read_config
 from utils.logger import set_logging, reopen_logs
+from utils.metrics import serve_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -52,8 +54,17 @@ async def run_app(config_file, **kwargs):
     if kwargs:
         config.update(**kwargs)
 
+    config.pop('workers', None)
+    config.pop('restart_delay', None)
+    metrics_host = config.pop('metrics_host', '0.0.0.0')
+    metrics_port = config.pop('metrics_port', None)
     app = App(name='Data source', **config)
 
+    metrics_server = None
+    if metrics_port is not None:
+        # Every shard listens on its own port
+        metrics_server = await serve_metrics(metrics_host, metrics_port + (kwargs.get('shard') or 0))
+
     loop.add_signal_handler(signal.SIGHUP, handle_sighup, 'SIGHUP', app, config_file)
     loop.add_signal_handler(signal.SIGINT, handle_sigterm, 'SIGINT', app)
     loop.add_signal_handler(signal.SIGTERM, handle_sigterm, 'SIGTERM', app)
@@ -61,6 +72,10 @@ async def run_app(config_file, **kwargs):
 
     await app.run()
 
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+
     logger.info('FINISHED')
 
 
@@ -69,6 +84,20 @@ def main():
     parser.add_argument('-c', '--config', type=str, default='ds_config.yml', help='Configuration file')
     args = parser.parse_args()
     config_file = args.config
+
+    config = read_config(config_file)
+    workers = config.get('workers', 1)
+    if workers > 1:
+        set_logging(**config['logging'])
+        supervisor = Supervisor(
+            config_file,
+            config,
+            workers=workers,
+            restart_delay=config.get('restart_delay', 5),
+        )
+        supervisor.run()
+        return
+
     asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     asyncio.run(run_app(config_file))
 
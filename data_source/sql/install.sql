@@ -6,7 +6,9 @@ create table if not exists data_source.ticker
     id          serial  not null
         constraint ticker_pk
             primary key,
-    ticker      varchar not null,
+    ticker      varchar not null
+        constraint ticker_ticker_key
+            unique,
     created   timestamp with time zone default now()
 );
 
@@ -24,5 +26,102 @@ create index if not exists ticker_log_ticker_id_index
 	on data_source.ticker_log_part (ticker_id);
 create index if not exists ticker_log_created_index
 	on data_source.ticker_log_part (created);
+-- Reads of a ticker bounded in time, like the other layouts
+create index if not exists ticker_log_ticker_id_created_index
+	on data_source.ticker_log_part (ticker_id, created);
 
 
+-- Compact alternatives to ticker_log_part, selected with db_config.storage_layout
+create table if not exists data_source.ticker_log_int8
+(
+    ticker_id integer                  not null,
+    price     bigint                   not null,
+    created   timestamp with time zone not null
+)
+    partition by RANGE (created);
+
+create index if not exists ticker_log_int8_ticker_id_created_index
+	on data_source.ticker_log_int8 (ticker_id, created);
+
+
+create table if not exists data_source.ticker_log_float8
+(
+    ticker_id integer                  not null,
+    price     double precision         not null,
+    created   timestamp with time zone not null
+)
+    partition by RANGE (created);
+
+create index if not exists ticker_log_float8_ticker_id_created_index
+	on data_source.ticker_log_float8 (ticker_id, created);
+
+
+-- One row per timestamp, prices[ticker_id - first_id + 1] is the price of ticker_id
+create table if not exists data_source.ticker_log_packed
+(
+    first_id  integer                  not null,
+    prices    bigint[]                 not null,
+    created   timestamp with time zone not null
+)
+    partition by RANGE (created);
+
+create index if not exists ticker_log_packed_created_index
+	on data_source.ticker_log_packed (created);
+
+
+-- Partitions of the ticker log tables with their bounds, whatever their granularity
+create or replace view data_source.partition_catalog as
+select
+    parent.relname as log_table,
+    child.relname  as tab_name,
+    bounds[1]::timestamptz as range_start,
+    bounds[2]::timestamptz as range_end
+from pg_inherits i
+join pg_class parent on parent.oid = i.inhparent
+join pg_namespace n on n.oid = parent.relnamespace
+join pg_class child on child.oid = i.inhrelid
+cross join lateral regexp_match(
+    pg_get_expr(child.relpartbound, child.oid),
+    $$^FOR VALUES FROM \('([^']+)'\) TO \('([^']+)'\)$$
+) as bounds
+where n.nspname = 'data_source'
+    and parent.relkind = 'p';
+
+
+-- Latest price of every ticker, upserted with each write of the data source. Rows are
+-- updated every second, free space left in the pages keeps the updates HOT
+create table if not exists data_source.ticker_last
+(
+    ticker_id integer                  not null
+        constraint ticker_last_pk
+            primary key,
+    price     numeric                  not null,
+    created   timestamp with time zone not null
+)
+    with (fillfactor = 50);
+
+
+create table if not exists data_source.ticker_ohlc_1m
+(
+    ticker_id integer                  not null,
+    bucket    timestamp with time zone not null,
+    open      numeric                  not null,
+    high      numeric                  not null,
+    low       numeric                  not null,
+    close     numeric                  not null,
+    constraint ticker_ohlc_1m_pk
+        primary key (ticker_id, bucket)
+);
+
+create table if not exists data_source.ticker_ohlc_1h
+(
+    ticker_id integer                  not null,
+    bucket    timestamp with time zone not null,
+    open      numeric                  not null,
+    high      numeric                  not null,
+    low       numeric                  not null,
+    close     numeric                  not null,
+    constraint ticker_ohlc_1h_pk
+        primary key (ticker_id, bucket)
+);
+
@@ -0,0 +1,126 @@
+__all__ = [
+    'Supervisor',
+    'split_range',
+]
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+from time import monotonic, sleep
+from typing import List
+
+from data_source.db import DataBase
+
+logger = logging.getLogger(__name__)
+
+FORWARDED_SIGNALS = (signal.SIGHUP, signal.SIGUSR1)
+STOP_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+# Seconds given to workers to finish after SIGTERM
+STOP_TIMEOUT = 30
+
+
+def split_range(ticker_range: List[int], shards: int) -> List[List[int]]:
+    start, end = ticker_range
+    shards = max(1, min(shards, end - start))
+    bounds = [start + (end - start) * i // shards for i in range(shards + 1)]
+    return [[bounds[i], bounds[i + 1]] for i in range(shards)]
+
+
+def run_worker(config_file: str, shard: int, ticker_range: List[int]):
+    # Imported here, the worker runs in a fresh interpreter
+    import uvloop
+
+    from data_source.scripts.runner import run_app
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(run_app(config_file, shard=shard, ticker_range=ticker_range))
+
+
+class Supervisor:
+    """Runs one App worker process per shard of the ticker range."""
+
+    def __init__(self, config_file: str, config: dict, *, workers: int, restart_delay: float = 5):
+        self.config_file = config_file
+        self.config = config
+        self.shards = split_range(config['ticker_range'], workers)
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = {}
+        self.restart_at = {}
+        self.stopping = False
+
+    def run(self):
+        logger.info(f'Start {len(self.shards)} workers: {self.shards}')
+        # Stale tickers are only known for the whole range, shards never delete them
+        asyncio.run(self.sync_tickers())
+
+        for signum in STOP_SIGNALS:
+            signal.signal(signum, self.handle_stop)
+        for signum in FORWARDED_SIGNALS:
+            signal.signal(signum, self.handle_forward)
+
+        for shard in range(len(self.shards)):
+            self.start_worker(shard)
+
+        while not self.stopping:
+            self.check_workers()
+            sleep(1)
+
+        self.stop_workers()
+        logger.info('All workers stopped')
+
+    async def sync_tickers(self):
+        db_config = dict(self.config['db_config'])
+        db_config.pop('db_pool_size', None)
+        db = DataBase('Data source supervisor', **db_config)
+        await db.create_conn_pool(max_size=1)
+        try:
+            await db.sync_tickers([f'ticker_{n}' for n in range(*self.config['ticker_range'])])
+        finally:
+            await db.pool_close()
+
+    def start_worker(self, shard: int):
+        process = self.context.Process(
+            target=run_worker,
+            args=(self.config_file, shard, self.shards[shard]),
+            name=f'data-source-{shard}',
+        )
+        process.start()
+        self.processes[shard] = process
+        logger.info(f'Worker {shard} started, pid {process.pid}, tickers {self.shards[shard]}')
+
+    def check_workers(self):
+        now = monotonic()
+        for shard, process in self.processes.items():
+            if process.is_alive():
+                continue
+            if shard not in self.restart_at:
+                logger.error(f'Worker {shard} exited with code {process.exitcode}, restart in {self.restart_delay} sec')
+                self.restart_at[shard] = now + self.restart_delay
+            elif now >= self.restart_at[shard]:
+                del self.restart_at[shard]
+                self.start_worker(shard)
+
+    def stop_workers(self):
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = monotonic() + STOP_TIMEOUT
+        for shard, process in self.processes.items():
+            process.join(max(0.0, deadline - monotonic()))
+            if process.is_alive():
+                logger.error(f'Worker {shard} did not stop, kill it')
+                process.kill()
+                process.join()
+
+    def handle_stop(self, signum, _):
+        logger.info(f'Received signal {signal.Signals(signum).name}')
+        self.stopping = True
+
+    def handle_forward(self, signum, _):
+        logger.info(f'Forward signal {signal.Signals(signum).name} to workers')
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
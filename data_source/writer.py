@@ -0,0 +1,235 @@
+__all__ = [
+    'BACKPRESSURE_BLOCK',
+    'BACKPRESSURE_DROP',
+    'BACKPRESSURE_MODES',
+    'WriteBehind',
+]
+
+import asyncio
+import logging
+from itertools import groupby
+from time import monotonic
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+
+from data_source.db import DataBase
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# A full queue makes the producer wait
+BACKPRESSURE_BLOCK = 'block'
+# A full queue drops its oldest batch
+BACKPRESSURE_DROP = 'drop'
+BACKPRESSURE_MODES = (BACKPRESSURE_BLOCK, BACKPRESSURE_DROP)
+
+# Smaller writes are not worth splitting over several connections
+PARALLEL_MIN_ROWS = 100_000
+
+WRITE_SECONDS = REGISTRY.histogram('data_source_write_seconds', 'Duration of a write, all slices and the notify')
+WRITE_LAG_SECONDS = REGISTRY.histogram(
+    'data_source_write_lag_seconds',
+    'Time from queueing the oldest batch of a write to its commit',
+)
+
+
+class _Batch:
+    __slots__ = ('tab_name', 'ts_constraint_start', 'ts_constraint_end', 'timestamps', 'block', 'enqueued')
+
+    def __init__(self, tab_name, ts_constraint_start, ts_constraint_end, timestamps, block):
+        self.tab_name = tab_name
+        self.ts_constraint_start = ts_constraint_start
+        self.ts_constraint_end = ts_constraint_end
+        self.timestamps = timestamps
+        self.block = block
+        self.enqueued = monotonic()
+
+
+class WriteBehind:
+    """Bounded queue between price generation and Postgres.
+
+    Batches are written in order by a single consumer. When it falls behind,
+    queued batches of the same partition are merged into one COPY of up to
+    `max_batch` steps, and writes of at least PARALLEL_MIN_ROWS rows are split
+    by ticker over `connections` pool connections. `on_saved` is awaited with
+    the timestamps and block of every write, in order.
+    """
+
+    def __init__(
+            self,
+            db: DataBase,
+            ticker_ids: np.ndarray,
+            *,
+            queue_size: int = 60,
+            max_batch: int = 10,
+            connections: int = 2,
+            backpressure: str = BACKPRESSURE_BLOCK,
+            on_saved: Optional[Callable[[list, np.ndarray], Awaitable]] = None,
+    ):
+        if backpressure not in BACKPRESSURE_MODES:
+            raise ValueError(f'Unknown write_backpressure {backpressure!r}, expected one of {BACKPRESSURE_MODES}')
+        self.db = db
+        self.ticker_ids = ticker_ids
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.max_batch = max_batch
+        self.connections = connections
+        self.backpressure = backpressure
+        self.on_saved = on_saved
+        # Batch taken from the queue that could not be merged into the previous write
+        self.pending = None
+
+        self.batches_queued = 0
+        self.batches_merged = 0
+        self.batches_dropped = 0
+        self.writes = 0
+        self.rows_written = 0
+        self.write_lag = 0.0
+        self.write_lag_max = 0.0
+        self.register_metrics()
+
+    def register_metrics(self):
+        REGISTRY.gauge(
+            'data_source_write_queue_depth',
+            'Batches waiting for the writer',
+            collect=lambda: self.queue.qsize() + (self.pending is not None),
+        )
+        REGISTRY.gauge(
+            'data_source_write_queue_size',
+            'Capacity of the write queue',
+            collect=lambda: self.queue.maxsize,
+        )
+        REGISTRY.counter(
+            'data_source_write_batches_total',
+            'Queued batches by what happened to them',
+            ['result'],
+            collect=lambda: {
+                ('queued',): self.batches_queued,
+                ('merged',): self.batches_merged,
+                ('dropped',): self.batches_dropped,
+            },
+        )
+        REGISTRY.counter(
+            'data_source_writes_total',
+            'COPY rounds done by the writer',
+            collect=lambda: self.writes,
+        )
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue.qsize() + (self.pending is not None),
+            'queue_size': self.queue.maxsize,
+            'batches_queued': self.batches_queued,
+            'batches_merged': self.batches_merged,
+            'batches_dropped': self.batches_dropped,
+            'writes': self.writes,
+            'rows_written': self.rows_written,
+            'write_lag': self.write_lag,
+            'write_lag_max': self.write_lag_max,
+        }
+
+    async def put(self, timestamps: List, block: np.ndarray, wait: bool = False):
+        """Queue generated steps, `wait` forces backpressure whatever the mode."""
+        offset = 0
+        for (tab_name, ts_constraint_start, ts_constraint_end), partition_ts in groupby(
+                timestamps,
+                key=self.db.route_partition,
+        ):
+            partition_ts = list(partition_ts)
+            batch = _Batch(
+                tab_name,
+                ts_constraint_start,
+                ts_constraint_end,
+                partition_ts,
+                block[offset:offset + len(partition_ts)],
+            )
+            offset += len(partition_ts)
+            await self._put(batch, wait)
+
+    async def _put(self, batch: _Batch, wait: bool):
+        if self.queue.full() and not wait and self.backpressure == BACKPRESSURE_DROP:
+            dropped = self.queue.get_nowait()
+            self.queue.task_done()
+            self.batches_dropped += 1
+            logger.warning(
+                f'Write queue is full, dropped {len(dropped.timestamps)} steps from {dropped.timestamps[0]}'
+            )
+        elif self.queue.full() and not wait:
+            logger.warning(f'Write queue is full ({self.queue.maxsize} batches), wait for the writer')
+        await self.queue.put(batch)
+        self.batches_queued += 1
+
+    async def run(self):
+        while True:
+            batches = await self._next_batches()
+            try:
+                await self._write(batches)
+            finally:
+                for _ in batches:
+                    self.queue.task_done()
+
+    async def join(self):
+        await self.queue.join()
+
+    async def flush(self, timeout: float):
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'Write queue is not flushed in {timeout} sec, lost {self.queue.qsize()} batches')
+
+    async def _next_batches(self) -> List[_Batch]:
+        if self.pending is not None:
+            batches, self.pending = [self.pending], None
+        else:
+            batches = [await self.queue.get()]
+
+        steps = len(batches[0].timestamps)
+        while steps < self.max_batch and not self.queue.empty():
+            batch = self.queue.get_nowait()
+            if batch.tab_name != batches[0].tab_name or steps + len(batch.timestamps) > self.max_batch:
+                self.pending = batch
+                break
+            batches.append(batch)
+            steps += len(batch.timestamps)
+        return batches
+
+    async def _write(self, batches: List[_Batch]):
+        t1 = monotonic()
+        first = batches[0]
+        timestamps = [ts for batch in batches for ts in batch.timestamps]
+        block = batches[0].block if len(batches) == 1 else np.vstack([batch.block for batch in batches])
+
+        n_rows = block.size
+        n_slices = min(self.connections, max(1, n_rows // PARALLEL_MIN_ROWS))
+        slices = np.array_split(np.arange(len(self.ticker_ids)), n_slices)
+        await asyncio.gather(*(
+            self.db.save_tick(
+                data=self.db.to_records(self.ticker_ids[columns], timestamps, block[:, columns]),
+                tab_name=first.tab_name,
+                ts_constraint_start=first.ts_constraint_start,
+                ts_constraint_end=first.ts_constraint_end,
+                notify=False,
+            )
+            for columns in slices
+        ))
+        # Sent once every slice is committed, so listeners see the whole write
+        await self.db.notify(timestamps[-1], n_rows)
+
+        if self.on_saved is not None:
+            await self.on_saved(timestamps, block)
+
+        t2 = monotonic()
+        self.writes += 1
+        self.rows_written += n_rows
+        self.batches_merged += len(batches) - 1
+        self.write_lag = t2 - first.enqueued
+        self.write_lag_max = max(self.write_lag_max, self.write_lag)
+        WRITE_SECONDS.observe(t2 - t1)
+        WRITE_LAG_SECONDS.observe(self.write_lag)
+        if len(batches) > 1:
+            logger.info(
+                f'Writer is behind: merged {len(batches)} batches, {n_rows} rows in {n_slices} slices, '
+                f'{t2 - t1:.3f} sec, lag {self.write_lag:.1f} sec, queued {self.queue.qsize()}'
+            )
+        else:
+            logger.debug(f'Save {n_rows} rows, {t2 - t1:.3f} sec, lag {self.write_lag:.3f} sec')
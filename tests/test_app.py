@@ -0,0 +1,172 @@
+import asyncio
+import base64
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import dash
+import numpy as np
+import pytest
+from dash.exceptions import PreventUpdate
+
+import dash_app.app
+from dash_app.app import (
+    DROPDOWN_ID,
+    GRAPH_ID,
+    INTERVAL_ID,
+    SLIDER_OFF,
+    SLIDER_ON,
+    STREAM_MODE_EXTEND,
+    App as DashApp,
+)
+from data_source.app import App
+from data_source.generator import create_generator
+
+NOW = datetime(2022, 5, 1, 13, 30, tzinfo=timezone.utc)
+
+
+class FakeDataBase:
+    def __init__(self, last):
+        self.last = last
+
+    async def load_last(self, ticker_ids):
+        return {ticker_id: value for ticker_id, value in self.last.items() if ticker_id in ticker_ids}
+
+
+def app(last) -> App:
+    async def create():
+        # Like run_app, the asyncio primitives of App are made in a running loop
+        return App(
+            name='test',
+            ticker_range=[0, 3],
+            db_config={'db_pool_size': 1, 'schema': 'data_source'},
+            insert_interval=1,
+            generate_historical_data=True,
+            historical_timedelta=10,
+        )
+
+    app = asyncio.run(create())
+    app.db = FakeDataBase(last)
+    app.ticker_ids = np.array([10, 11, 12], dtype=np.int32)
+    app.generator = create_generator('numpy', 3, seed=0)
+    app.ticker_price = app.generator.prices
+    return app
+
+
+def test_resume_backfills_only_the_gap():
+    saved = NOW - timedelta(minutes=5)
+    # Ticker 12 was added since the checkpoint, ticker 99 belongs to another shard
+    resumed = app({10: (7, saved), 11: (-3, saved), 99: (1, NOW)})
+    resumed.checkpoint = asyncio.run(resumed.load_checkpoint())
+
+    assert resumed.checkpoint == saved
+    assert resumed.ticker_price.tolist() == [7, -3, 0]
+    assert resumed.get_backfill_start(NOW) == saved + timedelta(seconds=1)
+    # The first generated prices continue from the checkpoint
+    assert np.abs(resumed.generator.advance(1)[0] - [7, -3, 0]).max() == 1
+
+
+def test_start_without_checkpoint_backfills_whole_history():
+    fresh = app({})
+    assert asyncio.run(fresh.load_checkpoint()) is None
+    assert fresh.get_backfill_start(NOW) == datetime(2022, 5, 1, tzinfo=timezone.utc)
+
+    # A checkpoint older than the history is not backfilled from
+    fresh.checkpoint = NOW - timedelta(days=3)
+    assert fresh.get_backfill_start(NOW) == datetime(2022, 5, 1, tzinfo=timezone.utc)
+
+
+def test_set_config_applies_reloadable_settings():
+    reloaded = app({})
+    reloaded.set_config(partition_retention=12, insert_interval=0.5, logging={}, workers=4)
+    assert reloaded.partition_retention == 12
+    # Needs a restart
+    assert reloaded.insert_interval == 1
+
+
+class StubDataSource:
+    """Ticks of every ticker one second apart, `now` of them so far."""
+
+    def __init__(self, **kwargs):
+        self.now = 10
+
+    def _ticks(self):
+        x = np.datetime64('2022-01-01T00:00:00', 'us') + np.arange(self.now) * np.timedelta64(1, 's')
+        return x, np.arange(self.now, dtype=np.float64)
+
+    def get_last_data(self, ticker_id, limit=300):
+        x, y = self._ticks()
+        return x[-limit:], y[-limit:]
+
+    def get_update(self, ticker_id, ts, limit=60):
+        x, y = self._ticks()
+        new = x > np.datetime64(ts, 'us')
+        return x[new][:limit], y[new][:limit]
+
+    def get_data_by_range(self, ticker_id, start, end, min_points):
+        x, y = self._ticks()
+        inside = (x > np.datetime64(start, 'us')) & (x < np.datetime64(end, 'us'))
+        return x[inside], y[inside]
+
+
+@pytest.fixture
+def dashboard(monkeypatch):
+    monkeypatch.setattr(dash_app.app, 'DataSource', StubDataSource)
+    app = DashApp(name='test', update_interval=0, row_limit=5, db_config={}, stream_mode=STREAM_MODE_EXTEND)
+    app.ticker_map = {'ticker_1': 1, 'ticker_2': 2}
+
+    def trigger(component_id):
+        monkeypatch.setattr(dash, 'callback_context', SimpleNamespace(triggered_id=component_id))
+
+    return app, trigger
+
+
+def test_stream_figure_is_not_rebuilt_while_extended(dashboard):
+    app, trigger = dashboard
+    trigger(DROPDOWN_ID)
+    figure, state = app.update_graph_scatter(0, 'ticker_1', None, SLIDER_ON)
+    assert figure['data'][0]['y'].tolist() == [5, 6, 7, 8, 9]
+    assert state == {'ticker': 'ticker_1', 'last': '2022-01-01T00:00:09.000000'}
+
+    trigger(INTERVAL_ID)
+    with pytest.raises(PreventUpdate):
+        app.update_graph_scatter(1, 'ticker_1', None, SLIDER_ON, stream_state=state)
+
+
+def test_extend_sends_only_rows_after_the_state(dashboard):
+    app, trigger = dashboard
+    trigger(DROPDOWN_ID)
+    _, state = app.update_graph_scatter(0, 'ticker_1', None, SLIDER_ON)
+    with pytest.raises(PreventUpdate):
+        app.extend_graph(1, None, 'ticker_1', SLIDER_ON, state)
+
+    app.db.now = 13
+    extend, state = app.extend_graph(2, None, 'ticker_1', SLIDER_ON, state)
+    data, traces, max_points = extend
+    assert data['y'][0].tolist() == [10, 11, 12]
+    assert traces == [0] and max_points == app.row_limit
+    assert state == {'ticker': 'ticker_1', 'last': '2022-01-01T00:00:12.000000'}
+
+
+def test_ticker_change_or_zoom_rebuilds_the_figure(dashboard):
+    app, trigger = dashboard
+    trigger(DROPDOWN_ID)
+    _, state = app.update_graph_scatter(0, 'ticker_1', None, SLIDER_ON)
+
+    # The state belongs to the previous ticker, extends wait for the new figure
+    trigger(INTERVAL_ID)
+    with pytest.raises(PreventUpdate):
+        app.extend_graph(1, None, 'ticker_2', SLIDER_ON, state)
+    figure, state = app.update_graph_scatter(1, 'ticker_2', None, SLIDER_ON, stream_state=state)
+    assert figure['data'][0]['y'].tolist() == [5, 6, 7, 8, 9]
+    assert state['ticker'] == 'ticker_2'
+
+    # A zoom with the stream off shows a fixed range and stops extends
+    zoom = {'xaxis.range[0]': '2022-01-01 00:00:01', 'xaxis.range[1]': '2022-01-01 00:00:04'}
+    trigger(GRAPH_ID)
+    figure, state = app.update_graph_scatter(1, 'ticker_2', zoom, SLIDER_OFF, stream_state=state)
+    assert state is None
+    # Typed arrays once the stream is off, rows strictly inside the range
+    assert np.frombuffer(base64.b64decode(figure['data'][0]['y']['bdata']), dtype='<f8').tolist() == [2, 3]
+    assert figure['layout']['xaxis']['range'] == [datetime(2022, 1, 1, 0, 0, 1), datetime(2022, 1, 1, 0, 0, 4)]
+    with pytest.raises(PreventUpdate):
+        app.extend_graph(2, None, 'ticker_2', SLIDER_OFF, state)
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from utils.archive import Archive, archive_path, write_partition
+
+pytest.importorskip('pyarrow')
+
+START = datetime(2022, 5, 1, 13, tzinfo=timezone.utc)
+PREFIX = 'ticker_log_part_'
+
+
+def export(hour: datetime, ticker_ids, seconds=3600) -> bytes:
+    # Like DataBase.export_partition: unsorted, created in epoch microseconds
+    epoch = int(hour.timestamp() * 1_000_000)
+    lines = [
+        f'{ticker_id},{ticker_id * 1000 + second},{epoch + second * 1_000_000}'
+        for second in reversed(range(seconds))
+        for ticker_id in ticker_ids
+    ]
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def test_archived_partition_roundtrip(tmp_path):
+    path = archive_path(str(tmp_path), f'{PREFIX}2022050113')
+    assert write_partition(path, export(START, range(1, 101))) == 360_000
+
+    archive = Archive(str(tmp_path), PREFIX)
+    [(start, end, found)] = archive.split(START + timedelta(minutes=10), START + timedelta(minutes=20))
+    assert found == path
+    x, y = archive.read(path, 42, start, end)
+    assert len(x) == 600
+    assert x[0] == np.datetime64('2022-05-01T13:10:00', 'us')
+    assert np.array_equal(y, 42_000 + np.arange(600, 1200))
+
+
+def test_split_between_archive_and_db(tmp_path):
+    archive = Archive(str(tmp_path), PREFIX)
+    assert archive.split(START, START + timedelta(hours=3)) == [(START, START + timedelta(hours=3), None)]
+
+    path = archive_path(str(tmp_path), f'{PREFIX}2022050114')
+    write_partition(path, export(START + timedelta(hours=1), [1], seconds=10))
+    # Naive bounds are UTC
+    start, end = datetime(2022, 5, 1, 13, 30), datetime(2022, 5, 1, 15, 30)
+    assert archive.split(start, end) == [
+        (START + timedelta(minutes=30), START + timedelta(hours=1), None),
+        (START + timedelta(hours=1), START + timedelta(hours=2), path),
+        (START + timedelta(hours=2), START + timedelta(hours=2, minutes=30), None),
+    ]
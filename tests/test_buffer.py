@@ -0,0 +1,71 @@
+import numpy as np
+
+from dash_app.buffer import RingBuffer, TickerBuffers
+
+
+def _ticks(start, n):
+    x = np.datetime64('2022-01-01T00:00:00', 'us') + np.arange(start, start + n) * np.timedelta64(1, 's')
+    return x, np.arange(start, start + n, dtype=np.float64)
+
+
+def test_ring_buffer_keeps_last_rows_in_order():
+    buffer = RingBuffer(5)
+    for start in range(0, 12, 3):
+        buffer.extend(*_ticks(start, 3))
+    x, y = buffer.arrays()
+    assert y.tolist() == [7, 8, 9, 10, 11]
+    assert buffer.last_ts == x[-1]
+
+
+def test_ring_buffer_evicts_by_age():
+    buffer = RingBuffer(100, max_age=3)
+    buffer.extend(*_ticks(0, 10))
+    _, y = buffer.arrays()
+    assert y.tolist() == [6, 7, 8, 9]
+
+
+def test_ring_buffer_oversized_extend():
+    buffer = RingBuffer(3)
+    buffer.extend(*_ticks(0, 2))
+    buffer.extend(*_ticks(2, 10))
+    assert buffer.arrays()[1].tolist() == [9, 10, 11]
+
+
+class FakeDataBase:
+    """Ticker 1 ticks every second up to `now`, ticker 2 as well."""
+
+    def __init__(self, now):
+        self.now = now
+        self.calls = []
+
+    def _rows(self, since, limit, last):
+        x, y = _ticks(0, self.now)
+        if last:
+            return x[-limit:], y[-limit:]
+        new = x > np.datetime64(since, 'us')
+        return x[new][:limit], y[new][:limit]
+
+    def get_last_data_many(self, ticker_ids, limit):
+        self.calls.append(('last', list(ticker_ids), limit))
+        return {ticker_id: self._rows(None, limit, last=True) for ticker_id in ticker_ids}
+
+    def get_update_many(self, ticker_ids, since, limit):
+        self.calls.append(('update', list(ticker_ids), limit))
+        return {ticker_id: self._rows(ts, limit, last=False) for ticker_id, ts in zip(ticker_ids, since)}
+
+
+def test_batched_refresh_is_capped_per_ticker():
+    db = FakeDataBase(now=10)
+    buffers = TickerBuffers(db, capacity=5, min_refresh=0)
+    buffers.get_many([1])
+    db.now = 12
+    buffers.get_many([1])
+    # Ticker 2 is filled much later, ticker 1 is then far behind
+    db.now = 100
+    buffers.get_many([2])
+    db.calls.clear()
+
+    result = buffers.get_many([1, 2])
+    assert db.calls == [('update', [1, 2], 5), ('last', [1], 5)]
+    assert result[1][1].tolist() == [95, 96, 97, 98, 99]
+    assert result[2][1].tolist() == [95, 96, 97, 98, 99]
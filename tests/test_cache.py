@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from dash_app.cache import MemoryBackend, RedisBackend, TileCache, to_datetime64
+
+START = datetime(2022, 1, 1, tzinfo=timezone.utc)
+X = to_datetime64(START) + np.arange(4 * 3600) * np.timedelta64(1, 's')
+Y = np.arange(4 * 3600, dtype=np.float64)
+SAVED_UNTIL = START + timedelta(hours=4)
+
+
+class Fetcher:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, source, ticker_id, start, end):
+        self.calls.append((start, end))
+        lo = np.searchsorted(X, to_datetime64(start), side='left')
+        hi = np.searchsorted(X, to_datetime64(end), side='left')
+        return X[lo:hi], Y[lo:hi]
+
+
+def test_tile_cache_serves_windows_from_tiles():
+    fetch = Fetcher()
+    cache = TileCache(fetch, lambda ticker_id: SAVED_UNTIL, tile_points=600)
+    start, end = START + timedelta(minutes=7), START + timedelta(minutes=95, seconds=30)
+
+    x, y = cache.get('raw', 1, 1, start, end)
+    assert y[0] == 7 * 60 + 1 and y[-1] == 95 * 60 + 29
+    assert len(fetch.calls) == 1
+
+    x, y = cache.get('raw', 1, 1, start + timedelta(minutes=3), end - timedelta(minutes=3))
+    assert y[0] == 10 * 60 + 1 and y[-1] == 92 * 60 + 29
+    assert len(fetch.calls) == 1
+    assert cache.stats()['hits'] > 0
+
+
+def test_tile_cache_fetches_only_missing_runs():
+    fetch = Fetcher()
+    cache = TileCache(fetch, lambda ticker_id: SAVED_UNTIL, tile_points=600)
+    cache.get('raw', 1, 1, START + timedelta(minutes=30), START + timedelta(minutes=39))
+    cache.get('raw', 1, 1, START, START + timedelta(minutes=59))
+    assert fetch.calls[1:] == [
+        (START, START + timedelta(minutes=30)),
+        (START + timedelta(minutes=40), START + timedelta(minutes=60)),
+    ]
+
+
+def test_tile_cache_keeps_tiles_ending_after_saved_rows():
+    fetch = Fetcher()
+    # Rows after 00:25 are still queued by the data source
+    cache = TileCache(fetch, lambda ticker_id: START + timedelta(minutes=25), tile_points=600)
+    cache.get('raw', 1, 1, START, START + timedelta(minutes=29))
+    cache.get('raw', 1, 1, START, START + timedelta(minutes=29))
+    assert fetch.calls[1:] == [(START + timedelta(minutes=20), START + timedelta(minutes=30))]
+
+    # Nothing is cached before the first write
+    cache = TileCache(fetch, lambda ticker_id: None, tile_points=600)
+    cache.get('raw', 1, 1, START, START + timedelta(minutes=9))
+    cache.get('raw', 1, 1, START, START + timedelta(minutes=9))
+    assert cache.stats()['tiles'] == 0
+
+
+def test_memory_backend_is_bounded():
+    backend = MemoryBackend(max_bytes=3 * 160)
+    for i in range(10):
+        backend.set_many({(i,): (X[:10], Y[:10])})
+    assert backend.nbytes <= 3 * 160
+    assert list(backend.tiles) == [(7,), (8,), (9,)]
+
+
+def test_redis_backend_roundtrip():
+    fakeredis = pytest.importorskip('fakeredis')
+    backend = RedisBackend(fakeredis.FakeRedis(), ttl=60)
+    backend.set_many({('raw', 1, 600, 5): (X[:100], Y[:100])})
+    x, y = backend.get_many([('raw', 1, 600, 5), ('raw', 1, 600, 6)])[('raw', 1, 600, 5)]
+    assert np.array_equal(x, X[:100]) and np.array_equal(y, Y[:100])
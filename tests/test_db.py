@@ -0,0 +1,73 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from data_source.db import DataBase
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.temp = []
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def execute(self, query, *args):
+        pass
+
+    async def copy_records_to_table(self, table, records):
+        self.temp = [ticker for _, ticker in sorted(records)]
+
+    async def fetch(self, query, *args):
+        # The insert ... on conflict do nothing, read back with the existing tickers
+        for ticker in self.temp:
+            if ticker not in self.pool.tickers:
+                self.pool.tickers[ticker] = self.pool.next_id
+                self.pool.next_id += 1
+        return [(self.pool.tickers[ticker], ticker) for ticker in self.temp]
+
+
+class FakePool:
+    def __init__(self, tickers):
+        self.tickers = dict(tickers)
+        self.next_id = max(self.tickers.values(), default=0) + 1
+        self.deleted = []
+
+    async def fetch(self, query, *args):
+        return [(ticker_id, ticker) for ticker, ticker_id in self.tickers.items()]
+
+    async def execute(self, query, ticker_ids):
+        self.deleted.extend(ticker_ids)
+        self.tickers = {ticker: ticker_id for ticker, ticker_id in self.tickers.items() if ticker_id not in ticker_ids}
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield FakeConnection(self)
+
+
+def sync(existing, tickers, delete_stale=True):
+    async def run():
+        db = DataBase('test', schema='data_source')
+        db.pool = FakePool(existing)
+        return await db.sync_tickers(tickers, delete_stale=delete_stale), db.pool
+
+    return asyncio.run(run())
+
+
+def test_sync_tickers_adds_keeps_and_deletes():
+    ticker_map, pool = sync({'a': 1, 'b': 2, 'c': 3}, ['d', 'b', 'e', 'b', 'a'])
+    # New tickers get ids in the requested order, duplicates are ignored
+    assert ticker_map == {'d': 4, 'b': 2, 'e': 5, 'a': 1}
+    assert pool.deleted == [3]
+
+
+def test_sync_tickers_without_changes_or_deletes():
+    ticker_map, pool = sync({'a': 1, 'b': 2}, ['a', 'b'])
+    assert ticker_map == {'a': 1, 'b': 2}
+    assert pool.deleted == [] and pool.next_id == 3
+
+    # Shards only own part of the tickers
+    ticker_map, pool = sync({'a': 1, 'b': 2}, ['b'], delete_stale=False)
+    assert ticker_map == {'b': 2}
+    assert pool.deleted == []
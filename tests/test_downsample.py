@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from dash_app.downsample import binary_to_arrays, downsample, lttb, minmax
+
+
+@pytest.mark.parametrize('method', [lttb, minmax])
+def test_downsample_keeps_ends_and_budget(method):
+    x = np.arange(10_000)
+    y = np.sin(x / 100.0)
+    idx = method(x, y, 500)
+    assert idx[0] == 0 and idx[-1] == len(x) - 1
+    assert len(idx) <= 500
+    assert np.all(np.diff(idx) > 0)
+
+
+def test_minmax_keeps_extremes():
+    y = np.zeros(1000)
+    y[123], y[777] = 10, -10
+    idx = minmax(np.arange(1000), y, 50)
+    assert 123 in idx and 777 in idx
+
+
+def test_lttb_keeps_spike():
+    y = np.zeros(1000)
+    y[500] = 100
+    assert 500 in lttb(np.arange(1000), y, 100)
+
+
+def test_downsample_is_noop_under_budget():
+    x, y = np.arange(10), np.arange(10.0)
+    dx, dy = downsample(x, y, 100)
+    assert dx is x and dy is y
+
+
+def test_binary_to_arrays():
+    # As float8send / timestamptz_send: big-endian, microseconds since 2000-01-01
+    seconds = (datetime(2022, 1, 1, tzinfo=timezone.utc) - datetime(2000, 1, 1, tzinfo=timezone.utc)).total_seconds()
+    created = (np.array([0, 1], dtype=np.int64) + int(seconds)) * 1_000_000
+    x, y = binary_to_arrays(np.array([1.5, 2.5], dtype='>f8').tobytes(), created.astype('>i8').tobytes())
+    assert x.tolist() == [datetime(2022, 1, 1), datetime(2022, 1, 1, 0, 0, 1)]
+    assert y.tolist() == [1.5, 2.5]
+
+    x, y = binary_to_arrays(None, None)
+    assert x.dtype == np.dtype('datetime64[us]') and len(x) == len(y) == 0
+
@@ -0,0 +1,30 @@
+import numpy as np
+
+from data_source.generator import create_generator, to_packed_records, to_records
+
+
+def test_numpy_generator_is_reproducible():
+    first = create_generator('numpy', 5, seed=42).advance(10)
+    second = create_generator('numpy', 5, seed=42).advance(10)
+    assert np.array_equal(first, second)
+
+
+def test_advance_is_a_random_walk():
+    generator = create_generator('numpy', 3, seed=1, start_prices=[10, 20, 30])
+    block = generator.advance(100)
+    steps = np.diff(np.vstack([[10, 20, 30], block]), axis=0)
+    assert set(np.unique(steps)) <= {-1, 1}
+    assert np.array_equal(generator.prices, block[-1])
+
+
+def test_to_records():
+    block = np.array([[1, 2], [3, 4]])
+    records = to_records(np.array([7, 8]), ['a', 'b'], block)
+    assert records == [(7, 1, 'a'), (8, 2, 'a'), (7, 3, 'b'), (8, 4, 'b')]
+
+
+def test_to_packed_records():
+    block = np.array([[1, 2], [3, 4]])
+    assert to_packed_records(np.array([7, 8]), ['a', 'b'], block) == [(7, [1, 2], 'a'), (7, [3, 4], 'b')]
+    # Gaps between ticker ids are kept as nulls, so prices stay indexed by id
+    assert to_packed_records(np.array([9, 7]), ['a'], block[:1]) == [(7, [2, None, 1], 'a')]
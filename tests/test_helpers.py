@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.helpers import (
+    PARTITION_DAY,
+    PARTITION_HOUR,
+    PARTITION_MINUTE,
+    find_partition,
+    get_next_partitions,
+    get_partition_bounds,
+    get_partition_info,
+    get_tick_timestamps,
+)
+from utils.storage import LAYOUT_PACKED, get_partition_prefix
+
+
+def test_partition_bounds_roundtrip():
+    ts = datetime(2022, 5, 1, 13, 45, 12, tzinfo=timezone.utc)
+    tab_name, start, end = get_partition_info(ts)
+    assert tab_name == 'ticker_log_part_2022050113'
+    assert get_partition_bounds(tab_name) == (start, end)
+
+
+def test_next_partitions():
+    ts = datetime(2022, 5, 1, 23, 10, tzinfo=timezone.utc)
+    names = [tab_name for tab_name, _, _ in get_next_partitions(ts, 2)]
+    assert names == ['ticker_log_part_2022050123', 'ticker_log_part_2022050200', 'ticker_log_part_2022050201']
+
+
+@pytest.mark.parametrize('granularity, name, size', [
+    (PARTITION_MINUTE, 'ticker_log_part_202205011345', timedelta(minutes=1)),
+    (PARTITION_DAY, 'ticker_log_part_20220501', timedelta(days=1)),
+])
+def test_partition_granularity(granularity, name, size):
+    ts = datetime(2022, 5, 1, 13, 45, 12, tzinfo=timezone.utc)
+    tab_name, start, end = get_partition_info(ts, granularity=granularity)
+    assert tab_name == name
+    assert start <= ts < end == start + size
+    # Bounds are found from the name alone, whatever the configured granularity
+    assert get_partition_bounds(tab_name) == (start, end)
+    assert [info[1] for info in get_next_partitions(ts, 2, granularity=granularity)] == [start, end, end + size]
+
+
+def test_partition_bounds_rejects_foreign_tables():
+    with pytest.raises(ValueError):
+        get_partition_bounds('ticker')
+
+
+def test_partitions_of_other_layouts():
+    prefix = get_partition_prefix(LAYOUT_PACKED)
+    tab_name, start, end = get_partition_info(datetime(2022, 5, 1, 13, tzinfo=timezone.utc), prefix)
+    assert tab_name == 'ticker_log_packed_2022050113'
+    assert get_partition_bounds(tab_name, prefix) == (start, end)
+    with pytest.raises(ValueError):
+        get_partition_bounds(tab_name)
+
+
+def test_tick_timestamps_do_not_drift():
+    origin = datetime(2022, 5, 1, 13, tzinfo=timezone.utc)
+    # 1000 ticks per second, the millionth tick is exactly 1000 seconds after the origin
+    [ts] = get_tick_timestamps(origin, 1_000_000, 1, 1000)
+    assert ts == origin + timedelta(seconds=1000)
+    assert get_tick_timestamps(origin, 2, 3, 1000) == [
+        origin + timedelta(milliseconds=n) for n in (2, 3, 4)
+    ]
+
+
+def test_find_partition_after_granularity_change():
+    ts = datetime(2022, 5, 1, 13, 45, 12, tzinfo=timezone.utc)
+    hour = get_partition_info(ts)
+    minutes = [get_partition_info(ts + timedelta(minutes=i), granularity=PARTITION_MINUTE) for i in range(3)]
+    ranges = sorted((start, end, tab_name) for tab_name, start, end in [hour])
+
+    # Hour to minute: the hour partition still takes its rows, minute ones follow it
+    assert find_partition(ts, ranges, granularity=PARTITION_MINUTE) == hour
+    assert find_partition(hour[2], ranges, granularity=PARTITION_MINUTE)[0] == 'ticker_log_part_202205011400'
+
+    # Minute to day: minutes in the hour holding minute partitions, hours in its day, then days
+    ranges = sorted((start, end, tab_name) for tab_name, start, end in minutes)
+    assert find_partition(ts + timedelta(minutes=1), ranges, granularity=PARTITION_DAY) == minutes[1]
+    assert find_partition(ts + timedelta(minutes=3), ranges, granularity=PARTITION_DAY)[0] == (
+        'ticker_log_part_202205011348'
+    )
+    assert find_partition(ts - timedelta(minutes=50), ranges, granularity=PARTITION_DAY)[0] == (
+        'ticker_log_part_2022050112'
+    )
+    assert find_partition(ts + timedelta(hours=11), ranges, granularity=PARTITION_DAY)[0] == 'ticker_log_part_20220502'
+    assert find_partition(ts + timedelta(days=1), [], granularity=PARTITION_HOUR)[0] == 'ticker_log_part_2022050213'
+
+
+def test_find_partition_at_bounds():
+    ts = datetime(2022, 5, 1, 13, tzinfo=timezone.utc)
+    hours = [get_partition_info(ts + timedelta(hours=i)) for i in range(2)]
+    ranges = [(start, end, tab_name) for tab_name, start, end in hours]
+
+    # A partition holds its start, the next one holds its end
+    assert find_partition(ts, ranges) == hours[0]
+    assert find_partition(ts + timedelta(hours=1), ranges) == hours[1]
+    assert find_partition(ts - timedelta(microseconds=1), ranges)[0] == 'ticker_log_part_2022050112'
+    assert find_partition(ts + timedelta(hours=2), ranges)[0] == 'ticker_log_part_2022050115'
@@ -0,0 +1,47 @@
+import asyncio
+
+from utils.metrics import Registry, serve_metrics
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    counter = registry.counter('rows_total', 'Rows')
+    counter.inc(3)
+    registry.gauge('depth', 'Queue depth', ['queue'], collect=lambda: {('write',): 2})
+    histogram = registry.histogram('latency_seconds', 'Latency', ['query'], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, query='get_update')
+
+    lines = registry.render().splitlines()
+    assert '# TYPE rows_total counter' in lines
+    assert 'rows_total 3' in lines
+    assert 'depth{queue="write"} 2' in lines
+    assert lines[-5:] == [
+        'latency_seconds_bucket{query="get_update",le="0.1"} 1',
+        'latency_seconds_bucket{query="get_update",le="1"} 2',
+        'latency_seconds_bucket{query="get_update",le="+Inf"} 3',
+        'latency_seconds_sum{query="get_update"} 5.55',
+        'latency_seconds_count{query="get_update"} 3',
+    ]
+
+
+def test_serve_metrics():
+    async def run():
+        registry = Registry()
+        registry.counter('rows_total', 'Rows').inc()
+        server = await serve_metrics('127.0.0.1', 0, registry)
+        port = server.sockets[0].getsockname()[1]
+        responses = []
+        for path in ('/metrics', '/other'):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+            responses.append(await reader.read())
+            writer.close()
+        server.close()
+        await server.wait_closed()
+        return responses
+
+    metrics, missing = asyncio.run(run())
+    assert metrics.startswith(b'HTTP/1.0 200 OK')
+    assert metrics.endswith(b'rows_total 1\n')
+    assert missing.startswith(b'HTTP/1.0 404')
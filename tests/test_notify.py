@@ -0,0 +1,31 @@
+from dash_app.notify import Broadcaster
+
+
+def drain(events) -> list:
+    found = []
+    while not events.empty():
+        found.append(events.get_nowait()['n'])
+    return found
+
+
+def test_broadcaster_fans_out_until_unsubscribed():
+    broadcaster = Broadcaster()
+    with broadcaster.subscribe() as first, broadcaster.subscribe() as second:
+        assert len(broadcaster) == 2
+        broadcaster.publish({'n': 1})
+        assert drain(first) == drain(second) == [1]
+
+    assert len(broadcaster) == 0
+    broadcaster.publish({'n': 2})
+    assert first.empty() and second.empty()
+
+
+def test_slow_subscriber_keeps_the_latest_events():
+    broadcaster = Broadcaster(max_queue=3)
+    with broadcaster.subscribe() as slow, broadcaster.subscribe() as fast:
+        for n in range(10):
+            broadcaster.publish({'n': n})
+            assert drain(fast) == [n]
+        # The oldest events were dropped, the subscription stays
+        assert drain(slow) == [7, 8, 9]
+        assert len(broadcaster) == 2
@@ -0,0 +1,48 @@
+import numpy as np
+
+from dash_app.overview import MarketOverview, sparkline
+
+
+class FakeDataBase:
+    def __init__(self):
+        self.rows = []
+
+    def set(self, ticker_ids, prices, second):
+        self.rows = (
+            np.array(ticker_ids, dtype=np.int32),
+            np.array(prices, dtype=np.float64),
+            np.full(len(ticker_ids), np.datetime64('2022-05-01T13:00:00', 'us') + np.timedelta64(second, 's')),
+        )
+
+    def get_ticker_last(self):
+        return self.rows
+
+
+def test_sparkline_scales_each_row():
+    history = np.array([[np.nan, np.nan, 5.0], [1.0, 2.0, 3.0], [3.0, 1.0, 2.0]])
+    assert sparkline(history) == ['▁', '▁▅█', '█▁▅']
+    assert sparkline(np.empty((0, 3))) == []
+
+
+def test_overview_keeps_history_of_remaining_tickers():
+    db = FakeDataBase()
+    overview = MarketOverview(db, points=3, min_refresh=0)
+
+    db.set([1, 2], [10, 20], 0)
+    overview.page('ticker_id', False, 0, 10)
+    # Same prices and time, nothing new to append
+    overview.page('ticker_id', False, 0, 10)
+    db.set([1, 2], [12, 15], 1)
+    overview.page('ticker_id', False, 0, 10)
+    # Ticker 1 is removed and ticker 3 added
+    db.set([2, 3], [16, 30], 2)
+
+    rows, total = overview.page('change', True, 0, 10)
+    assert total == 2
+    assert rows['ticker_id'].tolist() == [3, 2]
+    assert rows['price'].tolist() == [30, 16]
+    assert rows['change'].tolist() == [0, -4]
+    assert rows['trend'] == ['▁', '█▁▂']
+
+    rows, total = overview.page('price', False, 1, 1)
+    assert rows['ticker_id'].tolist() == [3]
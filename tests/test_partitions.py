@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+
+from dash_app.partitions import FAR_FUTURE, FAR_PAST, PartitionCatalog
+
+START = datetime(2022, 5, 1, 13, tzinfo=timezone.utc)
+
+
+def catalog(n: int) -> PartitionCatalog:
+    # n minute partitions from START, listed in no particular order like the view
+    bounds = [(START + timedelta(minutes=i), START + timedelta(minutes=i + 1)) for i in reversed(range(n))]
+    return PartitionCatalog(lambda: bounds)
+
+
+def test_windows_go_newest_first_in_growing_groups():
+    now = START + timedelta(minutes=9, seconds=30)
+    # Partitions 10 and 11 are created ahead of time
+    windows = catalog(12).windows(now)
+    minutes = [
+        (None if lower == FAR_PAST else int((lower - START).total_seconds() // 60),
+         None if upper == FAR_FUTURE else int((upper - START).total_seconds() // 60))
+        for lower, upper in windows
+    ]
+    assert minutes == [(9, None), (8, 9), (6, 8), (2, 6), (None, 2)]
+
+
+def test_windows_without_partitions_cover_everything():
+    assert catalog(0).windows(START) == [(FAR_PAST, FAR_FUTURE)]
+    assert catalog(3).windows(START) == [(FAR_PAST, FAR_FUTURE)]
+
+
+def test_missing_catalog_view():
+    def load():
+        raise psycopg2.errors.UndefinedTable()
+
+    assert PartitionCatalog(load).windows(START) == [(FAR_PAST, FAR_FUTURE)]
@@ -0,0 +1,66 @@
+import threading
+
+import psycopg2
+import pytest
+
+from dash_app.pool import ConnectionPool, PoolTimeoutError
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = False
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeConnect:
+    def __init__(self):
+        self.connections = []
+
+    def __call__(self, **params):
+        conn = FakeConnection()
+        self.connections.append(conn)
+        return conn
+
+
+def test_pool_times_out_when_exhausted():
+    pool = ConnectionPool({}, min_size=0, max_size=1, timeout=0.05, connect=FakeConnect())
+    conn = pool.getconn()
+    with pytest.raises(PoolTimeoutError):
+        pool.getconn()
+    assert pool.stats()['timeouts'] == 1
+
+    # A connection given back meanwhile is handed to the waiter
+    threading.Timer(0.05, pool.putconn, (conn,)).start()
+    assert pool.getconn(timeout=2) is conn
+    stats = pool.stats()
+    assert stats['in_use'] == 1 and stats['waiting'] == 0 and stats['acquired'] == 2
+    assert 0.03 < stats['wait_max'] < 2
+
+
+def test_pool_replaces_closed_and_broken_connections():
+    connect = FakeConnect()
+    pool = ConnectionPool({}, min_size=2, max_size=2, connect=connect)
+    assert all(conn.autocommit for conn in connect.connections)
+
+    # Closed while idle: reopened in its slot
+    connect.connections[1].closed = 1
+    conn = pool.getconn()
+    assert conn is connect.connections[2]
+    pool.putconn(conn)
+    assert pool.stats()['discarded'] == 1
+
+    # Broken while in use: discarded with the idle ones
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection() as conn:
+            raise psycopg2.OperationalError
+    assert conn.closed
+    stats = pool.stats()
+    assert stats['size'] == 0 and stats['idle'] == 0 and stats['in_use'] == 0
+    assert stats['discarded'] == 3
+
+    with pool.connection() as conn:
+        assert pool.stats()['in_use'] == 1
+    assert conn is connect.connections[-1] and pool.stats()['size'] == 1
@@ -0,0 +1,25 @@
+import numpy as np
+
+from data_source.rollup import OhlcRollup
+
+
+def test_rollup_matches_single_pass():
+    rng = np.random.default_rng(0)
+    block = np.cumsum(rng.choice([-1, 1], size=(300, 4)), axis=0)
+    epoch = np.arange(1_000_000, 1_000_300)
+
+    rollup = OhlcRollup('ticker_ohlc_1m', 60)
+    closed = []
+    for i in range(0, 300, 7):
+        closed.extend(rollup.update(epoch[i:i + 7], block[i:i + 7]))
+    closed.append(rollup.current())
+
+    edges = np.flatnonzero(np.diff(epoch // 60)) + 1
+    expected = np.split(block, edges)
+    assert len(closed) == len(expected)
+    for (bucket, open_, high, low, close), rows in zip(closed, expected):
+        assert bucket.timestamp() % 60 == 0
+        assert np.array_equal(open_, rows[0])
+        assert np.array_equal(high, rows.max(axis=0))
+        assert np.array_equal(low, rows.min(axis=0))
+        assert np.array_equal(close, rows[-1])
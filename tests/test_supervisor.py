@@ -0,0 +1,11 @@
+from data_source.supervisor import split_range
+
+
+def test_split_range_covers_tickers_once():
+    assert split_range([0, 10], 3) == [[0, 3], [3, 6], [6, 10]]
+    assert split_range([5, 105], 4) == [[5, 30], [30, 55], [55, 80], [80, 105]]
+
+
+def test_split_range_with_more_workers_than_tickers():
+    assert split_range([0, 3], 8) == [[0, 1], [1, 2], [2, 3]]
+    assert split_range([0, 10], 0) == [[0, 10]]
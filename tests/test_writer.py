@@ -0,0 +1,90 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from data_source.generator import to_records
+from data_source.writer import BACKPRESSURE_DROP, WriteBehind
+from utils.helpers import PARTITION_MINUTE, find_partition
+
+START = datetime(2022, 5, 1, 13, 59, 58, tzinfo=timezone.utc)
+
+
+class FakeDataBase:
+    partition_prefix = 'ticker_log_part_'
+    partition_granularity = 'hour'
+
+    def __init__(self, ranges=()):
+        self.saved = []
+        self.notified = []
+        self.partition_ranges = sorted(ranges)
+
+    def route_partition(self, ts):
+        return find_partition(ts, self.partition_ranges, self.partition_prefix, self.partition_granularity)
+
+    to_records = staticmethod(to_records)
+
+    async def save_tick(self, data, tab_name, ts_constraint_start, ts_constraint_end, notify=True):
+        self.saved.append((tab_name, data))
+
+    async def notify(self, ts, rows):
+        self.notified.append((ts, rows))
+
+
+def steps(first, n):
+    return [START + timedelta(seconds=first + i) for i in range(n)]
+
+
+def test_queued_batches_are_merged_per_partition():
+    async def run():
+        db = FakeDataBase()
+        writer = WriteBehind(db, np.array([1, 2]), queue_size=10, max_batch=10)
+        # Queued before the writer starts, like a writer stuck on a slow COPY
+        for i in range(4):
+            await writer.put(steps(i, 1), np.full((1, 2), i))
+        task = asyncio.create_task(writer.run())
+        await writer.join()
+        task.cancel()
+        return db, writer.stats()
+
+    db, stats = asyncio.run(run())
+    # 13:59:58 and 13:59:59 in one COPY, 14:00:00 and 14:00:01 in the next partition
+    assert [(tab_name, len(data)) for tab_name, data in db.saved] == [
+        ('ticker_log_part_2022050113', 4),
+        ('ticker_log_part_2022050114', 4),
+    ]
+    assert db.notified == [(START + timedelta(seconds=1), 4), (START + timedelta(seconds=3), 4)]
+    assert stats['batches_merged'] == 2
+    assert stats['writes'] == 2
+    assert stats['queue_depth'] == 0
+
+
+def test_drop_backpressure_keeps_the_newest_batches():
+    async def run():
+        db = FakeDataBase()
+        writer = WriteBehind(db, np.array([1]), queue_size=2, max_batch=1, backpressure=BACKPRESSURE_DROP)
+        for i in range(5):
+            await writer.put(steps(i, 1), np.full((1, 1), i))
+        task = asyncio.create_task(writer.run())
+        await writer.join()
+        task.cancel()
+        return db, writer.stats()
+
+    db, stats = asyncio.run(run())
+    assert [data[0][1] for _, data in db.saved] == [3, 4]
+    assert stats['batches_dropped'] == 3
+
+
+def test_granularity_change_keeps_existing_partitions():
+    async def run():
+        # Hour partitions made before the switch to minute ones
+        db = FakeDataBase([
+            (START.replace(minute=0, second=0), START.replace(minute=0, second=0) + timedelta(hours=1),
+             'ticker_log_part_2022050113'),
+        ])
+        db.partition_granularity = PARTITION_MINUTE
+        writer = WriteBehind(db, np.array([1]), queue_size=10, max_batch=1)
+        await writer.put(steps(0, 63), np.zeros((63, 1)))
+        return [(batch.tab_name, len(batch.timestamps)) for batch in [writer.queue.get_nowait() for _ in range(2)]]
+
+    assert asyncio.run(run()) == [('ticker_log_part_2022050113', 2), ('ticker_log_part_202205011400', 60)]
@@ -0,0 +1,181 @@
+__all__ = [
+    'ARCHIVE_COLUMNS',
+    'ARCHIVE_SUFFIX',
+    'Archive',
+    'archive_path',
+    'require_pyarrow',
+    'write_partition',
+]
+
+import logging
+import os
+import threading
+from bisect import bisect_left
+from datetime import datetime, timezone
+from time import time_ns
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.helpers import PARTITION_MAX_INTERVAL, get_partition_bounds
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIX = '.parquet'
+# Columns of an archived partition whatever the storage layout, created is in epoch microseconds in the CSV export
+ARCHIVE_COLUMNS = ('ticker_id', 'price', 'created')
+# Rows are sorted by ticker, so a row group holds a few tickers and reads skip the others by their statistics
+ROW_GROUP_ROWS = 64 * 1024
+COMPRESSION = 'zstd'
+MTIME_TRUSTED_AFTER = 2 * 10 ** 9
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError('pyarrow package is required for partition archives')
+
+
+def _utc(ts: datetime) -> datetime:
+    # Naive datetimes coming from the browser are UTC
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+
+def archive_path(directory: str, tab_name: str) -> str:
+    return os.path.join(directory, f'{tab_name}{ARCHIVE_SUFFIX}')
+
+
+def write_partition(path: str, data: bytes) -> int:
+    """Write a CSV export of a partition as a Parquet file sorted by ticker and time.
+
+    The file appears under its final name only once complete, so readers never
+    see a partial archive. Returns the number of rows.
+    """
+    require_pyarrow()
+    table = pyarrow.csv.read_csv(
+        pa.py_buffer(data),
+        read_options=pyarrow.csv.ReadOptions(column_names=list(ARCHIVE_COLUMNS)),
+        convert_options=pyarrow.csv.ConvertOptions(column_types={
+            'ticker_id': pa.int32(),
+            'price': pa.float64(),
+            'created': pa.int64(),
+        }),
+    )
+    table = table.set_column(2, 'created', table.column('created').cast(pa.timestamp('us', tz='UTC')))
+    table = table.sort_by([('ticker_id', 'ascending'), ('created', 'ascending')])
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_ROWS, compression=COMPRESSION)
+    os.replace(tmp_path, path)
+    return table.num_rows
+
+
+class Archive:
+    """Partitions archived by the data source, read through memory maps.
+
+    The directory is listed again whenever its mtime changes, so partitions
+    archived and dropped from the DB are found before the DB is asked for them.
+    """
+
+    def __init__(self, directory: str, prefix: str):
+        require_pyarrow()
+        self.directory = directory
+        self.prefix = prefix
+        # Start of the archived partition -> (its end, file)
+        self.files: Dict[datetime, Tuple[datetime, str]] = {}
+        self.starts: List[datetime] = []
+        # File -> (metadata, min and max ticker_id of every row group)
+        self.index: Dict[str, tuple] = {}
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        # A coarse mtime may not change for a file added in the same tick, so a recent one is not trusted
+        if mtime == self.mtime and (mtime is None or time_ns() - mtime > MTIME_TRUSTED_AFTER):
+            return
+
+        files = {}
+        if mtime is not None:
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(ARCHIVE_SUFFIX):
+                    continue
+                try:
+                    start, end = get_partition_bounds(entry.name[:-len(ARCHIVE_SUFFIX)], self.prefix)
+                except ValueError:
+                    continue
+                files[start] = (end, entry.path)
+        with self.lock:
+            paths = {path for _, path in files.values()}
+            self.index = {path: value for path, value in self.index.items() if path in paths}
+            self.files = files
+            self.starts = sorted(files)
+            self.mtime = mtime
+        logger.debug(f'Found {len(files)} archived partitions in {self.directory}')
+
+    def split(self, start: datetime, end: datetime) -> List[Tuple[datetime, datetime, Optional[str]]]:
+        """Cut [start, end) into runs of archived partitions (with their file) and of time in the DB (None)."""
+        self.refresh()
+        start, end = _utc(start), _utc(end)
+        with self.lock:
+            starts, files = self.starts, self.files
+
+        segments = []
+        cursor = start
+        # The partition holding start begins at most one partition of the largest granularity before it
+        for part_start in starts[bisect_left(starts, start - PARTITION_MAX_INTERVAL):bisect_left(starts, end)]:
+            part_end, path = files[part_start]
+            if part_end <= cursor:
+                continue
+            if cursor < part_start:
+                segments.append((cursor, part_start, None))
+            part_end = min(part_end, end)
+            segments.append((max(cursor, part_start), part_end, path))
+            cursor = part_end
+        if cursor < end:
+            segments.append((cursor, end, None))
+        return segments
+
+    def _row_groups(self, path: str) -> tuple:
+        with self.lock:
+            value = self.index.get(path)
+        if value is None:
+            metadata = pq.read_metadata(path, memory_map=True)
+            column = metadata.schema.names.index('ticker_id')
+            stats = [metadata.row_group(i).column(column).statistics for i in range(metadata.num_row_groups)]
+            value = (
+                metadata,
+                np.array([s.min for s in stats], dtype=np.int64),
+                np.array([s.max for s in stats], dtype=np.int64),
+            )
+            with self.lock:
+                self.index[path] = value
+        return value
+
+    def read(self, path: str, ticker_id: int, start: datetime, end: datetime) -> Tuple[np.ndarray, np.ndarray]:
+        """Prices of a ticker with start <= created < end."""
+        metadata, mins, maxs = self._row_groups(path)
+        groups = np.flatnonzero((mins <= ticker_id) & (maxs >= ticker_id)).tolist()
+        if not groups:
+            return np.empty(0, dtype='datetime64[us]'), np.empty(0, dtype=np.float64)
+
+        # A handle per read, ParquetFile is not meant to be shared between threads
+        table = pq.ParquetFile(path, memory_map=True, metadata=metadata).read_row_groups(groups)
+        mask = table.column('ticker_id').to_numpy() == ticker_id
+        x = table.column('created').to_numpy().astype('datetime64[us]')[mask]
+        y = table.column('price').to_numpy()[mask]
+        lo, hi = np.searchsorted(x, [
+            np.datetime64(_utc(start).replace(tzinfo=None), 'us'),
+            np.datetime64(_utc(end).replace(tzinfo=None), 'us'),
+        ], side='left')
+        return x[lo:hi], y[lo:hi]
@@ -1,5 +1,6 @@
-from random import random
+from bisect import bisect_right
 from datetime import datetime, timezone, timedelta
+from typing import List, Optional
 
 DT_CONVERTERS = [
     lambda s: datetime.strptime(s, '%Y-%m-%d %H:%M:%S.%f'),
@@ -17,19 +18,103 @@ def str_to_dt(string) -> datetime:
     raise ValueError(f'Can`t convert {string} to datetime')
 
 
-def generate_movement() -> int:
-    movement = -1 if random() < 0.5 else 1
-    return movement
-
-
 def utc_now() -> datetime:
     return datetime.utcnow().replace(tzinfo=timezone.utc)
 
 
-def get_partition_info(ts: datetime) -> tuple:
-    partition_name = f'ticker_log_part_{ts:%Y%m%d%H}'
-    ts_constraint_start = ts.replace(minute=0, second=0, microsecond=0)
-    ts_constraint_end = ts_constraint_start + timedelta(hours=1)
+def seconds_to_us(seconds: float) -> int:
+    return round(seconds * 1_000_000)
+
+
+def get_tick_timestamps(origin: datetime, first: int, count: int, interval_us: int) -> list:
+    # Tick n is at origin + n * interval, in whole microseconds so fractional intervals do not accumulate errors
+    return [origin + timedelta(microseconds=(first + i) * interval_us) for i in range(count)]
+
+
+PARTITION_PREFIX = 'ticker_log_part_'
+PARTITION_MINUTE = 'minute'
+PARTITION_HOUR = 'hour'
+PARTITION_DAY = 'day'
+# Name suffix, size and fields truncated to get the start of a partition
+PARTITION_GRANULARITIES = {
+    PARTITION_MINUTE: ('%Y%m%d%H%M', timedelta(minutes=1), {'second': 0, 'microsecond': 0}),
+    PARTITION_HOUR: ('%Y%m%d%H', timedelta(hours=1), {'minute': 0, 'second': 0, 'microsecond': 0}),
+    PARTITION_DAY: ('%Y%m%d', timedelta(days=1), {'hour': 0, 'minute': 0, 'second': 0, 'microsecond': 0}),
+}
+PARTITION_MAX_INTERVAL = max(interval for _, interval, _ in PARTITION_GRANULARITIES.values())
+# Partitions of any granularity can coexist after it is changed, their suffix tells them apart
+GRANULARITY_BY_SUFFIX_LENGTH = {
+    len(f'{datetime(2000, 1, 1):{suffix_format}}'): granularity
+    for granularity, (suffix_format, _, _) in PARTITION_GRANULARITIES.items()
+}
+
+
+def check_granularity(granularity: str) -> str:
+    if granularity not in PARTITION_GRANULARITIES:
+        raise ValueError(
+            f'Unknown partition_granularity {granularity!r}, expected one of {tuple(PARTITION_GRANULARITIES)}'
+        )
+    return granularity
+
+
+def get_partition_info(ts: datetime, prefix: str = PARTITION_PREFIX, granularity: str = PARTITION_HOUR) -> tuple:
+    suffix_format, interval, truncated = PARTITION_GRANULARITIES[granularity]
+    partition_name = f'{prefix}{ts:{suffix_format}}'
+    ts_constraint_start = ts.replace(**truncated)
+    ts_constraint_end = ts_constraint_start + interval
     return partition_name, ts_constraint_start, ts_constraint_end
 
 
+def get_next_partitions(
+        ts: datetime,
+        count: int,
+        prefix: str = PARTITION_PREFIX,
+        granularity: str = PARTITION_HOUR,
+) -> list:
+    _, start, _ = get_partition_info(ts, prefix, granularity)
+    _, interval, _ = PARTITION_GRANULARITIES[granularity]
+    return [get_partition_info(start + interval * i, prefix, granularity) for i in range(count + 1)]
+
+
+def find_partition(
+        ts: datetime,
+        ranges: List[tuple],
+        prefix: str = PARTITION_PREFIX,
+        granularity: str = PARTITION_HOUR,
+        starts: Optional[List[datetime]] = None,
+) -> tuple:
+    """(tab_name, start, end) of the partition holding ts.
+
+    `ranges` are the existing partitions as (start, end, tab_name) sorted by start, `starts` their
+    starts when already at hand. When none of them holds ts, the new partition is the one of
+    `granularity`, or the largest finer one that overlaps none of them, so partitions made under
+    another granularity are kept as they are.
+    """
+    if starts is None:
+        starts = [start for start, _, _ in ranges]
+    i = bisect_right(starts, ts) - 1
+    if i >= 0 and ts < ranges[i][1]:
+        start, end, tab_name = ranges[i]
+        return tab_name, start, end
+
+    lower = ranges[i][1] if i >= 0 else None
+    upper = ranges[i + 1][0] if i + 1 < len(ranges) else None
+    # Granularities are listed finest first and nest, so the minute one fits between aligned partitions
+    granularities = list(PARTITION_GRANULARITIES)
+    for candidate in reversed(granularities[:granularities.index(granularity) + 1]):
+        tab_name, start, end = get_partition_info(ts, prefix, candidate)
+        if (lower is None or lower <= start) and (upper is None or end <= upper):
+            return tab_name, start, end
+    raise ValueError(f'No partition of {prefix} fits {ts} between the existing ones, they are not aligned')
+
+
+def get_partition_bounds(partition_name: str, prefix: str = PARTITION_PREFIX) -> tuple:
+    if not partition_name.startswith(prefix):
+        raise ValueError(f'{partition_name} is not a partition name')
+    suffix = partition_name[len(prefix):]
+    try:
+        suffix_format, interval, _ = PARTITION_GRANULARITIES[GRANULARITY_BY_SUFFIX_LENGTH[len(suffix)]]
+    except KeyError:
+        raise ValueError(f'{partition_name} is not a partition name')
+    start = datetime.strptime(suffix, suffix_format).replace(tzinfo=timezone.utc)
+    return start, start + interval
@@ -0,0 +1,244 @@
+__all__ = [
+    'CONTENT_TYPE',
+    'DEFAULT_BUCKETS',
+    'SIZE_BUCKETS',
+    'REGISTRY',
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'Registry',
+    'serve_metrics',
+]
+
+import asyncio
+import logging
+import math
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from sub-millisecond statements to stalled writes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = tuple(2 ** i for i in range(8, 25, 2))
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} expects labels {self.labels}, got {tuple(labels)}')
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{labels} {_format_value(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class _Value(_Metric):
+    """Metric set by the code or read from `collect` at scrape time.
+
+    `collect` returns a value, or a dict of values by label value tuple.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labels: Iterable[str] = (),
+            collect: Optional[Callable[[], object]] = None,
+    ):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+        self.collect = collect
+
+    def samples(self):
+        if self.collect is not None:
+            values = self.collect()
+            values = values.items() if isinstance(values, dict) else [((), values)]
+        else:
+            with self.lock:
+                values = list(self.values.items())
+        return [(self.name, _format_labels(self.labels, key), value) for key, value in values]
+
+
+class Counter(_Value):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Value):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labels: Iterable[str] = (),
+            buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Label values -> [per bucket counts, sum]
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t1 = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - t1, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="{}"'.format(_format_value(bound))
+                samples.append((f'{self.name}_bucket', _format_labels(self.labels, key, le), cumulative))
+            samples.append((f'{self.name}_sum', _format_labels(self.labels, key), total))
+            samples.append((f'{self.name}_count', _format_labels(self.labels, key), cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        # Registering the same name again returns the metric registered first
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def _value(self, metric: _Value, collect) -> _Value:
+        metric = self.register(metric)
+        # The latest owner of a collected metric wins, e.g. an App created again in the same process
+        if collect is not None:
+            metric.collect = collect
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = (), collect=None) -> Counter:
+        return self._value(Counter(name, documentation, labels), collect)
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = (), collect=None) -> Gauge:
+        return self._value(Gauge(name, documentation, labels), collect)
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labels: Iterable[str] = (),
+            buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        parts = []
+        for metric in metrics:
+            try:
+                parts.append(metric.render())
+            except Exception:
+                logger.exception(f'Failed to collect {metric.name}')
+        return '\n'.join(parts) + '\n'
+
+
+REGISTRY = Registry()
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, registry: Registry):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Headers are not used, but have to be read before answering
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+            pass
+        method, path, *_ = request_line.decode('latin-1').split() + ['', '']
+        if method == 'GET' and path.split('?')[0] == '/metrics':
+            status, content_type, body = '200 OK', CONTENT_TYPE, registry.render().encode()
+        else:
+            status, content_type, body = '404 Not Found', 'text/plain', b'Not found\n'
+        writer.write(
+            f'HTTP/1.0 {status}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(host: str, port: int, registry: Registry = REGISTRY) -> asyncio.AbstractServer:
+    """Minimal HTTP listener for asyncio services, answers GET /metrics."""
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle_request(reader, writer, registry),
+        host,
+        port,
+    )
+    logger.info(f'Metrics are served on http://{host}:{port}/metrics')
+    return server
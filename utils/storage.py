@@ -0,0 +1,48 @@
+__all__ = [
+    'LAYOUT_NUMERIC',
+    'LAYOUT_INT8',
+    'LAYOUT_FLOAT8',
+    'LAYOUT_PACKED',
+    'LAYOUTS',
+    'LOG_TABLES',
+    'LOG_COLUMNS',
+    'get_log_table',
+    'get_partition_prefix',
+]
+
+# One row per ticker per second, price stored as numeric (the original layout)
+LAYOUT_NUMERIC = 'numeric'
+# One row per ticker per second, fixed width price columns
+LAYOUT_INT8 = 'int8'
+LAYOUT_FLOAT8 = 'float8'
+# One row per timestamp, prices of all tickers in an array indexed by ticker_id - first_id
+LAYOUT_PACKED = 'packed'
+LAYOUTS = (LAYOUT_NUMERIC, LAYOUT_INT8, LAYOUT_FLOAT8, LAYOUT_PACKED)
+
+LOG_TABLES = {
+    LAYOUT_NUMERIC: 'ticker_log_part',
+    LAYOUT_INT8: 'ticker_log_int8',
+    LAYOUT_FLOAT8: 'ticker_log_float8',
+    LAYOUT_PACKED: 'ticker_log_packed',
+}
+
+# Columns written by the data source, the timestamp is always the third one
+ROW_COLUMNS = ('ticker_id', 'price', 'created')
+PACKED_COLUMNS = ('first_id', 'prices', 'created')
+LOG_COLUMNS = {
+    LAYOUT_NUMERIC: ROW_COLUMNS,
+    LAYOUT_INT8: ROW_COLUMNS,
+    LAYOUT_FLOAT8: ROW_COLUMNS,
+    LAYOUT_PACKED: PACKED_COLUMNS,
+}
+
+
+def get_log_table(layout: str) -> str:
+    try:
+        return LOG_TABLES[layout]
+    except KeyError:
+        raise ValueError(f'Unknown storage_layout {layout!r}, expected one of {LAYOUTS}')
+
+
+def get_partition_prefix(layout: str) -> str:
+    return f'{get_log_table(layout)}_'